@@ -0,0 +1,141 @@
+"""
+Fleet benchmark of the PersonaGym dispatcher
+
+Starts fleets of coordinator servers against the stub LLM and the stub purple agent, dispatches the same batch of
+personas to each fleet with the dispatcher, and reports the throughput of each fleet size and its scaling efficiency
+relative to a single coordinator. With `--fail-node-after`, the first coordinator of the largest fleet is killed
+during its run to measure the re-dispatch of its evaluations. Results are written to a JSON file.
+
+Usage:
+    PYTHONPATH=src python -m benchmarks.fleet_benchmark --replicas 1,2,4 --personas 16 --concurrency 2 --output output/fleet_benchmark.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.startup_benchmark import free_port, subprocess_env, wait_for_agent_card
+from benchmarks.stub_purple_agent import StubPurpleAgentServer
+
+DEFAULT_OUTPUT_PATH = "output/fleet_benchmark.json"
+
+def start_coordinator(llm_latency: float, log_file) -> tuple[str, subprocess.Popen]:
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-W", "ignore", "-m", "benchmarks.startup_benchmark", "--serve",
+            "--port", str(port), "--llm-latency", str(llm_latency)
+        ],
+        env=subprocess_env(), stdout=log_file, stderr=subprocess.STDOUT
+    )
+    return f"http://127.0.0.1:{port}", process
+
+async def kill_after(process: subprocess.Popen, delay: float) -> None:
+    await asyncio.sleep(delay)
+    process.kill()
+
+async def run_fleet(replicas: int, args: argparse.Namespace, purple_agent_url: str, work_dir: str, log_file) -> dict:
+    """
+    Dispatches the benchmark personas to a fleet of coordinators and returns the dispatcher summary
+    """
+    # The dispatcher is only needed by this benchmark, and lives outside of the src package
+    from client.dispatcher import Dispatcher
+
+    coordinators = [start_coordinator(args.llm_latency, log_file) for _ in range(replicas)]
+    try:
+        await asyncio.gather(*(wait_for_agent_card(url, process, args.timeout) for url, process in coordinators))
+        records = [
+            {"id": f"persona-{i}", "persona": f"Benchmark persona {i}, a {20 + i % 50}-year-old teacher from Lisbon."}
+            for i in range(args.personas)
+        ]
+        dispatcher = Dispatcher(
+            urls=[url for url, _ in coordinators],
+            concurrency=args.concurrency,
+            persona_agent_url=purple_agent_url,
+            timeout=args.timeout,
+            health_check_interval=1.0
+        )
+        failure = None
+        if args.fail_node_after and replicas > 1 and replicas == max(args.replicas):
+            failure = asyncio.create_task(kill_after(coordinators[0][1], args.fail_node_after))
+        summary = await dispatcher.run(records, os.path.join(work_dir, f"results_{replicas}.jsonl"))
+        if failure:
+            failure.cancel()
+        return summary
+    finally:
+        for _, process in coordinators:
+            process.terminate()
+        for _, process in coordinators:
+            process.wait(timeout=10)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the PersonaGym dispatcher fleet benchmark.")
+    parser.add_argument("--replicas", type=lambda value: [int(count) for count in value.split(",")], default=[1, 2, 4], help="Comma-separated fleet sizes")
+    parser.add_argument("--personas", type=int, default=16, help="Number of personas dispatched to each fleet")
+    parser.add_argument("--concurrency", type=int, default=2, help="Number of evaluations sent to each coordinator at once")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Latency of each stub LLM call in seconds")
+    parser.add_argument("--fail-node-after", type=float, help="Seconds after which the first coordinator of the largest fleet is killed")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for the coordinators and each evaluation")
+    parser.add_argument("--output", type=str, default=DEFAULT_OUTPUT_PATH, help="JSON file to write the benchmark report to")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "WARNING"),
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    fleets = {}
+    purple_agent = StubPurpleAgentServer(latency=0.01)
+    purple_agent.start()
+    try:
+        with tempfile.TemporaryDirectory() as work_dir, tempfile.TemporaryFile() as log_file:
+            for replicas in args.replicas:
+                start = time.monotonic()
+                try:
+                    fleets[replicas] = asyncio.run(run_fleet(replicas, args, purple_agent.url, work_dir, log_file))
+                except Exception:
+                    log_file.seek(0)
+                    sys.stderr.write(log_file.read().decode(errors="replace")[-4000:])
+                    raise
+                logging.info(f"Fleet of {replicas} coordinators done in {time.monotonic() - start:.1f}s")
+    finally:
+        purple_agent.stop()
+
+    baseline = fleets[min(fleets)]
+    baseline_throughput = baseline["personas_per_minute"] / min(fleets)
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python_version": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "fleets": {
+            replicas: {
+                **{key: summary[key] for key in ("completed", "failed", "resubmitted", "redispatched", "duplicated", "elapsed_seconds", "personas_per_minute")},
+                "scaling_efficiency": round(summary["personas_per_minute"] / (replicas * baseline_throughput), 3) if baseline_throughput else 0.0,
+                "latency_seconds": summary["latency_seconds"],
+                "completed_per_node": [node.get("completed", 0) for node in summary["nodes"].values()],
+            }
+            for replicas, summary in fleets.items()
+        },
+    }
+
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=4))
+    print(json.dumps({
+        replicas: {key: fleet[key] for key in ("completed", "failed", "redispatched", "personas_per_minute", "scaling_efficiency", "completed_per_node")}
+        for replicas, fleet in report["fleets"].items()
+    }, indent=4))
+    print(f"Benchmark report written to: {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Offline end-to-end benchmark of the PersonaGym evaluator
+
+Runs the evaluator root agent for N personas against the stub LLM and the stub purple agent, so orchestration
+performance can be measured without network access or provider credentials. Reports the wall time, per-stage
+latency, peak RSS (overall and per concurrent evaluation) and the number of LLM and HTTP calls, and writes them to a
+JSON file.
+
+Usage:
+    PYTHONPATH=src python -m benchmarks.run_benchmark --personas 10 --concurrency 4 --output output/benchmark.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from benchmarks.stub_llm import DEFAULT_QUESTION_COUNT, DEFAULT_TEXT_LENGTH, create_stub_model_provider, stub_llm_stats
+from benchmarks.stub_purple_agent import StubPurpleAgentServer
+from src.utils.llm_factory import set_model_provider
+
+DEFAULT_OUTPUT_PATH = "output/benchmark.json"
+
+baseline_rss = 0.0
+
+def peak_rss_mb() -> float:
+    """
+    Returns the peak resident set size of the process in MB
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def summarize_latencies(values: list[float]) -> dict[str, float]:
+    return {
+        "count": len(values),
+        "mean": round(statistics.mean(values), 4) if values else 0.0,
+        "p50": round(percentile(values, 0.5), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+def summarize_stages(results: list[dict]) -> dict[str, dict[str, float]]:
+    """
+    Aggregates the per-agent wall times recorded in the run metrics of each evaluation
+    """
+    stage_latencies = defaultdict(list)
+    for result in results:
+        run_metrics = result.get("run_metrics") or {}
+        for agent_name, agent_metrics in run_metrics.get("agents", {}).items():
+            stage_latencies[agent_name].append(agent_metrics["wall_time_seconds"])
+    return {agent_name: summarize_latencies(latencies) for agent_name, latencies in sorted(stage_latencies.items())}
+
+async def run_benchmark(personas: int, concurrency: int, purple_agent_url: str, results_path: str) -> tuple[dict, list[dict]]:
+    # The agents are imported only after the stub model provider is set
+    from src.agents.personagym_evaluator.agent import root_agent
+    from src.agents.personagym_evaluator.sub_agents.results_storage import ResultsStorage, set_results_storage
+    from src.tools.message_tool import client_pool
+    from src.workflows.serial_evaluation import PersonaRecord, SerialEvaluationWorkflow
+
+    # Peak RSS once the agents are loaded, before any evaluation has run
+    global baseline_rss
+    baseline_rss = peak_rss_mb()
+
+    storage = ResultsStorage(results_path)
+    set_results_storage(storage)
+    workflow = SerialEvaluationWorkflow(
+        agent=root_agent,
+        storage=storage,
+        concurrency=concurrency,
+        persona_agent_url=purple_agent_url,
+        run_id="benchmark"
+    )
+    records = [
+        PersonaRecord(id=f"persona-{i}", persona=f"Benchmark persona {i}, a {20 + i % 50}-year-old teacher from Lisbon.")
+        for i in range(personas)
+    ]
+    try:
+        summary = await workflow.run(records)
+    finally:
+        # Closes the connections to the purple agent before the event loop ends
+        await client_pool.close()
+    results = storage.get_run_evaluations(workflow.run_id)
+    storage.close()
+    return summary.model_dump(), results
+
+def sum_tokens(results: list[dict]) -> dict[str, int]:
+    """
+    Sums the prompt and completion tokens recorded in the run metrics of each evaluation
+    """
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0}
+    for result in results:
+        for model_metrics in (result.get("run_metrics") or {}).get("models", {}).values():
+            for key in tokens:
+                tokens[key] += model_metrics.get(key, 0)
+    return tokens
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline PersonaGym evaluator benchmark.")
+    parser.add_argument("--personas", type=int, default=4, help="Number of personas to evaluate")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of personas evaluated concurrently")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Latency of each stub LLM call in seconds")
+    parser.add_argument("--purple-latency", type=float, default=0.01, help="Latency of each stub purple agent reply in seconds")
+    parser.add_argument("--purple-port", type=int, help="Port of the stub purple agent, fix it to replay a recorded cassette")
+    parser.add_argument("--purple-replicas", type=int, default=1, help="Number of stub purple agent replicas, on consecutive ports")
+    parser.add_argument("--purple-slow-latency", type=float, help="Latency of the last purple agent replica, to measure the routing around a slow replica")
+    parser.add_argument("--questions", type=int, default=DEFAULT_QUESTION_COUNT, help="Number of questions generated per task")
+    parser.add_argument("--text-length", type=int, default=DEFAULT_TEXT_LENGTH, help="Minimum length of the strings generated by the stub LLM")
+    parser.add_argument("--output", type=str, default=DEFAULT_OUTPUT_PATH, help="JSON file to write the benchmark report to")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "WARNING"),
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    set_model_provider(create_stub_model_provider(latency=args.llm_latency, question_count=args.questions, text_length=args.text_length))
+    purple_agents = [
+        StubPurpleAgentServer(
+            port=args.purple_port + i if args.purple_port else None,
+            latency=args.purple_slow_latency if args.purple_slow_latency and i == args.purple_replicas - 1 else args.purple_latency
+        )
+        for i in range(args.purple_replicas)
+    ]
+    for purple_agent in purple_agents:
+        purple_agent.start()
+    # Replicas are given to the evaluator as comma-separated urls
+    purple_agent_url = ",".join(purple_agent.url for purple_agent in purple_agents)
+
+    try:
+        with tempfile.TemporaryDirectory() as results_dir:
+            start_time = time.monotonic()
+            summary, results = asyncio.run(
+                run_benchmark(args.personas, args.concurrency, purple_agent_url, str(Path(results_dir) / "results.sqlite"))
+            )
+            wall_time = time.monotonic() - start_time
+    finally:
+        for purple_agent in purple_agents:
+            purple_agent.stop()
+
+    from src.tools.message_tool import get_pool_stats
+    http_requests = sum((purple_agent.requests for purple_agent in purple_agents), Counter())
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python_version": platform.python_version(),
+        "config": vars(args),
+        "wall_time_seconds": round(wall_time, 3),
+        "batch": summary,
+        "persona_latency_seconds": summarize_latencies([result["elapsed_seconds"] or 0.0 for result in results]),
+        "stage_latency_seconds": summarize_stages(results),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "baseline_rss_mb": round(baseline_rss, 1),
+        # Growth of the peak RSS over the baseline, divided by the number of evaluations running at the same time
+        "peak_rss_per_concurrent_evaluation_mb": round((peak_rss_mb() - baseline_rss) / max(1, min(args.concurrency, args.personas)), 2),
+        "llm_calls": {"total": stub_llm_stats.total(), "by_model": dict(stub_llm_stats.calls)},
+        "llm_tokens": sum_tokens(results),
+        "http_calls": {
+            "total": sum(purple_agent.request_count() for purple_agent in purple_agents),
+            "by_path": dict(http_requests),
+            "by_replica": [purple_agent.request_count() for purple_agent in purple_agents],
+        },
+        "a2a_pool": get_pool_stats(),
+    }
+
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=4))
+    print(json.dumps({
+        key: report[key]
+        for key in ("wall_time_seconds", "peak_rss_mb", "peak_rss_per_concurrent_evaluation_mb", "llm_calls", "http_calls")
+    }, indent=4))
+    print(f"Benchmark report written to: {output_path}")
+
+if __name__ == "__main__":
+    main()
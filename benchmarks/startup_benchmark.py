@@ -0,0 +1,203 @@
+"""
+Cold start benchmark of the PersonaGym evaluator
+
+Measures, in fresh interpreters, the time to import the coordinator agent module and to build its agent graph, and
+the time a coordinator server started against the stub LLM and the stub purple agent takes to serve its agent card
+and to serve its first evaluation request. Results are written to a JSON file.
+
+Usage:
+    PYTHONPATH=src python -m benchmarks.startup_benchmark --runs 3 --output output/startup_benchmark.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+from benchmarks.stub_llm import DEFAULT_QUESTION_COUNT, create_stub_model_provider
+from benchmarks.stub_purple_agent import StubPurpleAgentServer
+
+DEFAULT_OUTPUT_PATH = "output/startup_benchmark.json"
+# Model environment variables of the coordinator, given placeholder names when unset since no model is called
+MODEL_ENV_VARS = ("SETTINGS_MODEL", "QUESTION_MODEL", "RUBRIC_MODEL", "EVAL_1_MODEL", "SCORE_AGG_MODEL")
+PLACEHOLDER_MODEL = "openai/placeholder"
+AGENT_CARD_PATH = "/.well-known/agent-card.json"
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import src.agents.personagym_evaluator.agent as agent
+imported = time.perf_counter()
+agent.get_root_agent()
+built = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "build_seconds": built - imported,
+    "litellm_imported": "litellm" in sys.modules,
+}))
+"""
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def subprocess_env() -> dict[str, str]:
+    env = dict(os.environ)
+    for model_env_var in MODEL_ENV_VARS:
+        env.setdefault(model_env_var, PLACEHOLDER_MODEL)
+    # The repository root must be importable by the subprocesses
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(Path(__file__).resolve().parent.parent), env.get("PYTHONPATH")]))
+    return env
+
+def measure_import() -> dict:
+    """
+    Imports the coordinator agent module and builds its agent graph in a fresh interpreter
+    """
+    start = time.monotonic()
+    output = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", IMPORT_SCRIPT],
+        env=subprocess_env(), capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process_seconds"] = time.monotonic() - start
+    return result
+
+async def wait_for_agent_card(url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=1) as client:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"Coordinator exited with code {process.returncode} before serving requests")
+            try:
+                if (await client.get(url + AGENT_CARD_PATH)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Coordinator did not serve its agent card within {timeout}s")
+            await asyncio.sleep(0.01)
+
+async def measure_server(purple_agent_url: str, llm_latency: float, timeout: float, log_file) -> dict:
+    """
+    Starts a coordinator server and measures the time until it serves its agent card and its first evaluation
+    """
+    # The client is only needed by this benchmark, and lives outside of the src package
+    from client.client import send_message
+
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    start = time.monotonic()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-W", "ignore", "-m", "benchmarks.startup_benchmark", "--serve",
+            "--port", str(port), "--llm-latency", str(llm_latency)
+        ],
+        env=subprocess_env(), stdout=log_file, stderr=subprocess.STDOUT
+    )
+    try:
+        await wait_for_agent_card(url, process, timeout)
+        ready_seconds = time.monotonic() - start
+        request = json.dumps({"persona": "A 34-year-old nurse from Porto who loves surfing.", "persona_agent_url": purple_agent_url})
+        outputs = await asyncio.wait_for(send_message(request, url), timeout)
+        first_request_seconds = time.monotonic() - start
+        if outputs.get("status", "completed") != "completed":
+            raise RuntimeError(f"First evaluation failed: {outputs}")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return {
+        "ready_seconds": ready_seconds,
+        "first_request_seconds": first_request_seconds,
+        "first_evaluation_seconds": first_request_seconds - ready_seconds,
+    }
+
+def summarize(values: list[float]) -> dict[str, float]:
+    return {
+        "min": round(min(values), 3),
+        "median": round(statistics.median(values), 3),
+        "max": round(max(values), 3),
+    }
+
+def serve(port: int, llm_latency: float) -> None:
+    """
+    Runs the coordinator server against the stub LLM
+    """
+    from src.utils.llm_factory import set_model_provider
+
+    set_model_provider(create_stub_model_provider(latency=llm_latency, question_count=DEFAULT_QUESTION_COUNT))
+    from src.agents.personagym_evaluator.agent import main as coordinator_main
+
+    sys.argv = [sys.argv[0], "--host", "127.0.0.1", "--port", str(port)]
+    coordinator_main()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the PersonaGym evaluator cold start benchmark.")
+    parser.add_argument("--runs", type=int, default=3, help="Number of cold starts measured")
+    parser.add_argument("--llm-latency", type=float, default=0.01, help="Latency of each stub LLM call in seconds")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for the server and the first request")
+    parser.add_argument("--output", type=str, default=DEFAULT_OUTPUT_PATH, help="JSON file to write the benchmark report to")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.llm_latency)
+        return
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "WARNING"),
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    imports = [measure_import() for _ in range(args.runs)]
+
+    purple_agent = StubPurpleAgentServer(latency=0.01)
+    purple_agent.start()
+    try:
+        with tempfile.TemporaryFile() as log_file:
+            try:
+                servers = [
+                    asyncio.run(measure_server(purple_agent.url, args.llm_latency, args.timeout, log_file))
+                    for _ in range(args.runs)
+                ]
+            except Exception:
+                log_file.seek(0)
+                sys.stderr.write(log_file.read().decode(errors="replace")[-4000:])
+                raise
+    finally:
+        purple_agent.stop()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python_version": platform.python_version(),
+        "config": vars(args),
+        "import_seconds": summarize([result["import_seconds"] for result in imports]),
+        "build_seconds": summarize([result["build_seconds"] for result in imports]),
+        "import_process_seconds": summarize([result["process_seconds"] for result in imports]),
+        "litellm_imported": any(result["litellm_imported"] for result in imports),
+        "ready_seconds": summarize([result["ready_seconds"] for result in servers]),
+        "first_request_seconds": summarize([result["first_request_seconds"] for result in servers]),
+        "first_evaluation_seconds": summarize([result["first_evaluation_seconds"] for result in servers]),
+    }
+
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=4))
+    print(json.dumps({key: report[key] for key in report if key.endswith("_seconds") or key == "litellm_imported"}, indent=4))
+    print(f"Benchmark report written to: {output_path}")
+
+if __name__ == "__main__":
+    main()
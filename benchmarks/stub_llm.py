@@ -0,0 +1,166 @@
+"""
+Deterministic local stand-in for the LiteLlm models
+
+Responses are generated from the request's output schema, so every structured output is valid JSON for the schema
+the agent expects. Requests without an output schema are answered with a JSON list of evaluation questions, which is
+what the question generators produce.
+"""
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+from pydantic import BaseModel
+
+import asyncio
+import hashlib
+import json
+import threading
+import types as python_types
+import typing
+from collections import Counter
+from enum import Enum
+from typing import AsyncGenerator
+
+DEFAULT_LATENCY = 0.05
+DEFAULT_QUESTION_COUNT = 5
+# Minimum length of the generated strings, e.g. to approximate the size of real justifications and example responses
+DEFAULT_TEXT_LENGTH = 0
+FILLER_TEXT = "lorem ipsum dolor sit amet "
+
+class StubLlmStats:
+    """
+    Thread-safe counters of the calls made to the stub models
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = Counter()
+
+    def record(self, model_env_var: str) -> None:
+        with self._lock:
+            self.calls[model_env_var] += 1
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+stub_llm_stats = StubLlmStats()
+
+def _system_instruction_text(llm_request: LlmRequest) -> str:
+    system_instruction = llm_request.config.system_instruction if llm_request.config else None
+    return system_instruction if isinstance(system_instruction, str) else ""
+
+def _contents_text(llm_request: LlmRequest) -> str:
+    return "\n".join(part.text for content in llm_request.contents for part in content.parts or [] if part.text)
+
+def _request_text(llm_request: LlmRequest) -> str:
+    return _system_instruction_text(llm_request) + "\n" + _contents_text(llm_request)
+
+class StubValueGenerator:
+    """
+    Builds a deterministic value for a type annotation, seeded by the request so scores vary between requests
+    """
+
+    def __init__(self, seed: str, llm_request: LlmRequest, list_length: int, text_length: int = DEFAULT_TEXT_LENGTH):
+        self.seed = seed
+        self.llm_request = llm_request
+        self.list_length = list_length
+        self.text_length = text_length
+        self._counter = 0
+
+    def _next_int(self, low: int, high: int) -> int:
+        self._counter += 1
+        digest = hashlib.sha256(f"{self.seed}:{self._counter}".encode()).digest()
+        return low + digest[0] % (high - low + 1)
+
+    def generate(self, annotation, name: str = "value"):
+        origin = typing.get_origin(annotation)
+        args = typing.get_args(annotation)
+
+        if origin in (typing.Union, python_types.UnionType):
+            return self.generate(next(arg for arg in args if arg is not type(None)), name)
+        if origin is list:
+            return [self.generate(args[0] if args else str, name) for _ in range(self.list_length)]
+        if origin is dict:
+            return {}
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            # Fields left out of the JSON schema are not part of the model's output
+            properties = annotation.model_json_schema().get("properties", {})
+            return {
+                field_name: self.generate(field.annotation, field_name)
+                for field_name, field in annotation.model_fields.items()
+                if field_name in properties
+            }
+        if isinstance(annotation, type) and issubclass(annotation, Enum):
+            # Prefer the member mentioned most often in the input, then in the instruction, e.g. the evaluation task
+            # being scored, since instructions may mention other members as examples
+            for text in (_contents_text(self.llm_request), _system_instruction_text(self.llm_request)):
+                member = max(annotation, key=lambda member: text.count(str(member.value)))
+                if str(member.value) in text:
+                    return member.value
+            return next(iter(annotation)).value
+        if annotation is bool:
+            return True
+        if annotation is int:
+            return self._next_int(1, 5)
+        if annotation is float:
+            return float(self._next_int(1, 5))
+        text = f"Stub {name.replace('_', ' ')} {self._next_int(1, 1000)}"
+        if len(text) < self.text_length:
+            text += " " + (FILLER_TEXT * (self.text_length // len(FILLER_TEXT) + 1))[:self.text_length - len(text) - 1]
+        return text
+
+class StubLlm(BaseLlm):
+    """
+    Model returning schema-valid JSON after a configurable latency, without any network access
+    """
+
+    model_env_var: str = "STUB_MODEL"
+    latency: float = DEFAULT_LATENCY
+    question_count: int = DEFAULT_QUESTION_COUNT
+    text_length: int = DEFAULT_TEXT_LENGTH
+
+    def _generate_text(self, llm_request: LlmRequest) -> str:
+        request_text = _request_text(llm_request)
+        seed = hashlib.sha256(f"{self.model_env_var}:{request_text}".encode()).hexdigest()
+        generator = StubValueGenerator(seed, llm_request, self.question_count, self.text_length)
+
+        response_schema = llm_request.config.response_schema if llm_request.config else None
+        if isinstance(response_schema, type) and issubclass(response_schema, BaseModel):
+            return json.dumps(generator.generate(response_schema))
+
+        questions = [f"Stub question {i + 1} for {self.model_env_var} ({seed[:8]})?" for i in range(self.question_count)]
+        return json.dumps(questions)
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        stub_llm_stats.record(self.model_env_var)
+        await asyncio.sleep(self.latency)
+
+        text = self._generate_text(llm_request)
+        yield LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                # Rough token estimate of 4 characters per token
+                prompt_token_count=len(_request_text(llm_request)) // 4,
+                candidates_token_count=len(text) // 4,
+            )
+        )
+
+def create_stub_model_provider(
+        latency: float = DEFAULT_LATENCY,
+        question_count: int = DEFAULT_QUESTION_COUNT,
+        text_length: int = DEFAULT_TEXT_LENGTH
+):
+    """
+    Returns a model provider for `set_model_provider` that creates stub models
+    """
+    def provider(model_env_var: str) -> StubLlm:
+        return StubLlm(
+            model=f"stub/{model_env_var.lower()}",
+            model_env_var=model_env_var,
+            latency=latency,
+            question_count=question_count,
+            text_length=text_length
+        )
+    return provider
@@ -0,0 +1,90 @@
+"""
+Stub A2A persona (purple) agent
+
+Answers every question with a short deterministic in-character reply after a configurable latency, and counts the
+HTTP requests it receives. The server runs in a background thread so it can share a process with the benchmark.
+"""
+
+from google.adk.a2a.utils.agent_to_a2a import to_a2a
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.genai import types
+from starlette.middleware.base import BaseHTTPMiddleware
+
+import asyncio
+import hashlib
+import socket
+import threading
+import time
+from collections import Counter
+from typing import AsyncGenerator
+
+import uvicorn
+
+DEFAULT_LATENCY = 0.01
+
+class StubPersonaAgent(BaseAgent):
+    """
+    Persona agent replying with a deterministic answer to each question
+    """
+
+    latency: float = DEFAULT_LATENCY
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        await asyncio.sleep(self.latency)
+        question = "".join(part.text for part in ctx.user_content.parts if part.text) if ctx.user_content else ""
+        digest = hashlib.sha256(question.encode()).hexdigest()[:8]
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=f"Stub persona answer {digest}.")])
+        )
+
+class StubPurpleAgentServer:
+    """
+    Runs the stub persona agent as an A2A server on a local port in a background thread
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int | None = None, latency: float = DEFAULT_LATENCY):
+        self.host = host
+        self.port = port or self._free_port()
+        self.requests = Counter()
+        self._lock = threading.Lock()
+
+        app = to_a2a(StubPersonaAgent(name="stub_persona_agent", latency=latency), host=self.host, port=self.port)
+        app.add_middleware(BaseHTTPMiddleware, dispatch=self._count_request)
+        self._server = uvicorn.Server(uvicorn.Config(app, host=self.host, port=self.port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    async def _count_request(self, request, call_next):
+        with self._lock:
+            self.requests[request.url.path] += 1
+        return await call_next(request)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def request_count(self) -> int:
+        with self._lock:
+            return sum(self.requests.values())
+
+    def start(self, timeout: float = 30) -> None:
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError(f"Stub purple agent failed to start on {self.url}")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
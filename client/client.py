@@ -1,11 +1,20 @@
+import argparse
 import asyncio
+import csv
+import hashlib
+import inspect
 import json
 import logging
+import statistics
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
 from uuid import uuid4
 
 import httpx
 from a2a.client import (
     A2ACardResolver,
+    Client,
     ClientConfig,
     ClientFactory,
     Consumer,
@@ -14,12 +23,24 @@ from a2a.types import (
     Message,
     Part,
     Role,
+    TaskStatusUpdateEvent,
     TextPart,
     DataPart,
 )
 
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_TIMEOUT = 1200
+DEFAULT_COORDINATOR_URL = "http://127.0.0.1:8001"
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds before a failed persona is resubmitted, doubled with every attempt
+RESUBMIT_BACKOFF = 2.0
+# Maximum number of seconds before a persona rejected by a full evaluation queue is resubmitted
+MAX_REJECTED_BACKOFF = 60.0
+# Fields of an input record forwarded to the coordinator
+REQUEST_FIELDS = ("persona", "persona_agent_url", "purple_model", "resume", "priority")
 
 
 def create_message(*, role: Role = Role.user, text: str, context_id: str | None = None) -> Message:
@@ -40,8 +61,37 @@ def merge_parts(parts: list[Part]) -> str:
             chunks.append(json.dumps(part.root.data, indent=2))
     return "\n".join(chunks)
 
-async def send_message(message: str, base_url: str, context_id: str | None = None, streaming=False, consumer: Consumer | None = None):
-    """Returns dict with context_id, response and status (if exists)"""
+def parse_result_update(parts: list[Part]) -> dict | None:
+    """
+    Returns the evaluation result contained in a streamed message, or None if the message is not a result.
+
+    Results are either the partial result of a single evaluation task ({"type": "task_result", ...})
+    or the final output of the evaluation (an object with "overall_score" and "task_scores").
+    """
+    try:
+        data = json.loads(merge_parts(parts))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    if data.get("type") == "task_result" or ("overall_score" in data and "task_scores" in data):
+        return data
+    return None
+
+async def send_message(
+        message: str,
+        base_url: str,
+        context_id: str | None = None,
+        streaming=False,
+        consumer: Consumer | None = None,
+        on_result: Callable[[dict], Awaitable[None] | None] | None = None
+):
+    """
+    Returns dict with context_id, response and status (if exists).
+
+    When streaming, `on_result` is called with each evaluation result as soon as it is received:
+    the partial result of each evaluation task as it completes, followed by the final output.
+    """
     async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT) as httpx_client:
         resolver = A2ACardResolver(httpx_client=httpx_client, base_url=base_url)
         agent_card = await resolver.get_agent_card()
@@ -54,34 +104,312 @@ async def send_message(message: str, base_url: str, context_id: str | None = Non
         if consumer:
             await client.add_event_consumer(consumer)
 
-        outbound_msg = create_message(text=message, context_id=context_id)
-        last_event = None
-        outputs = {
-            "response": "",
-            "context_id": None
-        }
+        return await send_client_message(client, message, context_id, on_result)
 
-        # if streaming == False, only one event is generated
-        async for event in client.send_message(outbound_msg):
-            last_event = event
+async def send_client_message(
+        client: Client,
+        message: str,
+        context_id: str | None = None,
+        on_result: Callable[[dict], Awaitable[None] | None] | None = None
+):
+    """
+    Sends a message with an existing A2A client and returns dict with context_id, response and status (if exists).
+    """
+    outbound_msg = create_message(text=message, context_id=context_id)
+    last_event = None
+    outputs = {
+        "response": "",
+        "context_id": None
+    }
 
-        match last_event:
+    # if streaming == False, only one event is generated
+    async for event in client.send_message(outbound_msg):
+        last_event = event
+        if on_result is None:
+            continue
+
+        match event:
             case Message() as msg:
-                outputs["context_id"] = msg.context_id
+                result = parse_result_update(msg.parts)
+            case (_, TaskStatusUpdateEvent() as update) if update.status.message:
+                result = parse_result_update(update.status.message.parts)
+            case _:
+                result = None
+
+        if result is not None:
+            callback_result = on_result(result)
+            if inspect.isawaitable(callback_result):
+                await callback_result
+
+    match last_event:
+        case Message() as msg:
+            outputs["context_id"] = msg.context_id
+            outputs["response"] += merge_parts(msg.parts)
+
+        case (task, update):
+            outputs["context_id"] = task.context_id
+            outputs["status"] = task.status.state.value
+            msg = task.status.message
+            if msg:
                 outputs["response"] += merge_parts(msg.parts)
+            if task.artifacts:
+                for artifact in task.artifacts:
+                    outputs["response"] += merge_parts(artifact.parts)
 
-            case (task, update):
-                outputs["context_id"] = task.context_id
-                outputs["status"] = task.status.state.value
-                msg = task.status.message
-                if msg:
-                    outputs["response"] += merge_parts(msg.parts)
-                if task.artifacts:
-                    for artifact in task.artifacts:
-                        outputs["response"] += merge_parts(artifact.parts)
+        case _:
+            pass
 
-            case _:
-                pass
+    return outputs
+
+def persona_id(persona: str) -> str:
+    """
+    Returns a stable identifier for a persona description, matching the persona hash of the results storage
+    """
+    return hashlib.sha256(persona.strip().encode()).hexdigest()[:16]
+
+def load_personas(path: str) -> list[dict]:
+    """
+    Loads the personas to submit from a JSONL file, or from a CSV file with a header row.
+
+    Each record has a "persona" field and optionally "id", "persona_agent_url", "purple_model" and "priority" fields.
+    """
+    with open(path, newline="") as personas_file:
+        if Path(path).suffix.lower() == ".csv":
+            rows = list(csv.DictReader(personas_file))
+        else:
+            rows = [json.loads(line) for line in personas_file if line.strip()]
+
+    records = []
+    for line_number, row in enumerate(rows, start=1):
+        record = {key: value for key, value in row.items() if value not in (None, "")}
+        if not record.get("persona"):
+            raise ValueError(f"Record {line_number} of {path} has no persona")
+        record.setdefault("id", persona_id(record["persona"]))
+        records.append(record)
+    return records
+
+def load_completed_ids(path: str) -> set[str]:
+    """
+    Returns the ids of the personas already completed in an output JSONL file
+    """
+    if not Path(path).exists():
+        return set()
+    with open(path) as output_file:
+        results = [json.loads(line) for line in output_file if line.strip()]
+    return {result["id"] for result in results if result.get("status") == "completed"}
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def summarize_latencies(values: list[float]) -> dict[str, float]:
+    return {
+        "mean": round(statistics.mean(values), 3) if values else 0.0,
+        "p50": round(percentile(values, 0.5), 3),
+        "p90": round(percentile(values, 0.9), 3),
+        "p95": round(percentile(values, 0.95), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "max": round(max(values), 3) if values else 0.0,
+    }
+
+class EvaluationRejectedError(RuntimeError):
+    """
+    Raised when a coordinator running a job queue rejects an evaluation because its queue is full
+    """
+
+def create_request(record: dict, persona_agent_url: str | None = None) -> str:
+    """
+    Returns the coordinator request of a persona record, defaulting its persona agent url to the given one
+    """
+    request = {field: record[field] for field in REQUEST_FIELDS if field in record}
+    if persona_agent_url:
+        request.setdefault("persona_agent_url", persona_agent_url)
+    return json.dumps(request)
 
-        return outputs
+async def submit_request(client: Client, request: str) -> tuple[dict, str | None]:
+    """
+    Submits an evaluation request and returns its final output and the context id of the evaluation
+    """
+    final_outputs = []
+
+    def on_result(result: dict) -> None:
+        if result.get("type") != "task_result":
+            final_outputs.append(result)
+
+    outputs = await send_client_message(client, request, on_result=on_result)
+    if outputs.get("status") == "rejected":
+        raise EvaluationRejectedError(f"Evaluation rejected: {outputs['response'][:500]}")
+    if outputs.get("status", "completed") != "completed":
+        raise RuntimeError(f"Evaluation ended with status {outputs.get('status')}: {outputs['response'][:500]}")
+    if not final_outputs:
+        # Coordinators that do not stream return the final output as their response
+        final_output = parse_result_update([Part(TextPart(kind="text", text=outputs["response"]))])
+        if final_output is None:
+            raise RuntimeError(f"Evaluation returned no final output: {outputs['response'][:500]}")
+        final_outputs.append(final_output)
+    return final_outputs[-1], outputs["context_id"]
+
+class BatchClient:
+    """
+    Submits personas to the coordinator with bounded concurrency.
+
+    All requests share one A2A client over a keep-alive HTTP connection pool, and the agent card is resolved once.
+    Each final output is appended to the output JSONL file as soon as it is received. Failed personas are resubmitted
+    with exponential backoff after the personas queued before them, up to `max_attempts` times. Personas rejected by a
+    full evaluation queue are resubmitted with a growing backoff, without counting as an attempt.
+    """
+
+    def __init__(
+            self,
+            base_url: str = DEFAULT_COORDINATOR_URL,
+            concurrency: int = DEFAULT_CONCURRENCY,
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+            persona_agent_url: str | None = None,
+            timeout: float = DEFAULT_TIMEOUT
+    ):
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.persona_agent_url = persona_agent_url
+        self.timeout = timeout
+
+    async def run(self, records: list[dict], output_path: str, resume: bool = False) -> dict:
+        """
+        Submits all personas, skipping those already completed in the output file when resuming, and returns the
+        throughput and latency summary of the batch
+        """
+        completed_ids = load_completed_ids(output_path) if resume else set()
+        pending = [record for record in records if record["id"] not in completed_ids]
+        if resume:
+            logger.info(f"Resuming batch, skipping {len(records) - len(pending)} personas already completed")
+
+        queue = asyncio.Queue()
+        for record in pending:
+            queue.put_nowait((record, 1, 0))
+        loop = asyncio.get_running_loop()
+        latencies = []
+        stats = {"completed": 0, "failed": 0, "resubmitted": 0, "rejected": 0}
+        start_time = time.monotonic()
+
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as httpx_client:
+            agent_card = await A2ACardResolver(httpx_client=httpx_client, base_url=self.base_url).get_agent_card()
+            client = ClientFactory(ClientConfig(httpx_client=httpx_client, streaming=True)).create(agent_card)
+
+            with open(output_path, "a" if resume else "w") as output_file:
+                def write_result(result: dict) -> None:
+                    output_file.write(json.dumps(result) + "\n")
+                    output_file.flush()
+
+                def requeue(item: tuple) -> None:
+                    queue.put_nowait(item)
+                    # The submission the persona is resubmitted from is only done once the persona is queued again
+                    queue.task_done()
+
+                async def evaluate(record: dict, attempt: int, rejections: int) -> tuple[float, tuple] | None:
+                    """
+                    Evaluates a persona, and returns the backoff and the queue item of its resubmission if it is resubmitted
+                    """
+                    submit_time = time.monotonic()
+                    try:
+                        final_output, context_id = await submit_request(client, create_request(record, self.persona_agent_url))
+                    except EvaluationRejectedError as e:
+                        # The coordinator's queue is full, which is backpressure rather than a failed attempt
+                        stats["rejected"] += 1
+                        backoff = min(RESUBMIT_BACKOFF * 2 ** rejections, MAX_REJECTED_BACKOFF)
+                        logger.info(f"Evaluation of persona {record['id']} rejected ({e}), resubmitting in {backoff:.1f}s")
+                        return backoff, (record, attempt, rejections + 1)
+                    except Exception as e:
+                        if attempt < self.max_attempts:
+                            logger.warning(f"Evaluation of persona {record['id']} failed ({e}), resubmitting ({attempt}/{self.max_attempts})")
+                            stats["resubmitted"] += 1
+                            return RESUBMIT_BACKOFF * 2 ** (attempt - 1), (record, attempt + 1, rejections)
+                        logger.error(f"Evaluation of persona {record['id']} failed after {attempt} attempts: {e}")
+                        stats["failed"] += 1
+                        write_result({"id": record["id"], "status": "failed", "attempts": attempt, "error": str(e)})
+                    else:
+                        latency = time.monotonic() - submit_time
+                        latencies.append(latency)
+                        stats["completed"] += 1
+                        write_result({
+                            "id": record["id"],
+                            "status": "completed",
+                            "attempts": attempt,
+                            "latency_seconds": round(latency, 3),
+                            "context_id": context_id,
+                            "result": final_output
+                        })
+
+                    done = stats["completed"] + stats["failed"]
+                    logger.info(
+                        f"{done}/{len(pending)} personas evaluated ({stats['failed']} failed, "
+                        f"{done / (time.monotonic() - start_time) * 60:.2f} personas/min)"
+                    )
+                    return None
+
+                async def worker() -> None:
+                    while True:
+                        record, attempt, rejections = await queue.get()
+                        resubmission = None
+                        try:
+                            resubmission = await evaluate(record, attempt, rejections)
+                        finally:
+                            if resubmission is None:
+                                queue.task_done()
+                            else:
+                                # The event loop queues the resubmission after its backoff, so no worker sleeps while
+                                # other personas are ready
+                                backoff, item = resubmission
+                                loop.call_later(backoff, requeue, item)
+
+                # Workers run until every persona, including those resubmitted later, is done
+                workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+                joined = asyncio.create_task(queue.join())
+                try:
+                    finished, _ = await asyncio.wait([joined, *workers], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for task in (joined, *workers):
+                        task.cancel()
+                    await asyncio.gather(joined, *workers, return_exceptions=True)
+                for task in finished:
+                    if task is not joined:
+                        # Workers only stop on an unexpected error
+                        task.result()
+
+        elapsed = time.monotonic() - start_time
+        return {
+            "total": len(records),
+            "skipped": len(records) - len(pending),
+            **stats,
+            "elapsed_seconds": round(elapsed, 3),
+            "personas_per_minute": round(stats["completed"] / elapsed * 60, 2) if elapsed else 0.0,
+            "latency_seconds": summarize_latencies(latencies),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit a batch of personas to the PersonaGym coordinator.")
+    parser.add_argument("--input", type=str, required=True, help="JSONL or CSV file of personas to evaluate")
+    parser.add_argument("--output", type=str, default="output/batch_results.jsonl", help="JSONL file the final outputs are written to")
+    parser.add_argument("--url", type=str, default=DEFAULT_COORDINATOR_URL, help="Base url of the coordinator")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Number of personas evaluated concurrently")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="Number of submissions of a failing persona")
+    parser.add_argument("--persona-agent-url", type=str, help="Base url of the persona agent, if not given per persona")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Timeout of each evaluation in seconds")
+    parser.add_argument("--resume", action="store_true", help="Skip the personas already completed in the output file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    batch_client = BatchClient(
+        base_url=args.url,
+        concurrency=args.concurrency,
+        max_attempts=args.max_attempts,
+        persona_agent_url=args.persona_agent_url,
+        timeout=args.timeout
+    )
+    summary = asyncio.run(batch_client.run(load_personas(args.input), args.output, resume=args.resume))
+    print(json.dumps(summary, indent=4))
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Dispatcher spreading a batch of personas across a fleet of PersonaGym coordinators
+
+Each coordinator reports the number of evaluations it is running with the `personagym_requests_in_flight` gauge of
+its /metrics endpoint (or with the gauges of its evaluation queue, when it runs a job queue), which doubles as its
+health check. Personas are assigned to the healthy coordinator with the fewest outstanding evaluations, counting
+those of other clients, and at most `concurrency` evaluations are sent to each coordinator at once. A coordinator
+failing its health checks is taken out of rotation and its running evaluations are dispatched again to the other
+coordinators, while evaluations rejected by a full queue are resubmitted after a backoff without counting as
+failures. Once no persona is left to dispatch, evaluations running for much longer than the median evaluation are
+duplicated on an idle coordinator, and the first result wins. All final outputs are merged into one JSONL file, in
+the format of the batch client.
+
+Usage:
+    uv run python -m client.dispatcher --input personas.jsonl --urls http://evaluator-1:9019,http://evaluator-2:9019 --output output/batch_results.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from collections import Counter, deque
+from pathlib import Path
+
+import httpx
+from a2a.client import A2ACardResolver, Client, ClientConfig, ClientFactory
+
+from client.client import (
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_TIMEOUT,
+    RESUBMIT_BACKOFF,
+    EvaluationRejectedError,
+    create_request,
+    load_completed_ids,
+    load_personas,
+    submit_request,
+    summarize_latencies,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of evaluations sent to each coordinator at once
+DEFAULT_NODE_CONCURRENCY = 4
+# Seconds between two health checks of each coordinator
+HEALTH_CHECK_INTERVAL = 5.0
+HEALTH_CHECK_TIMEOUT = 5.0
+# Consecutive failed health checks (or failed evaluations) after which a coordinator is taken out of rotation
+MAX_HEALTH_FAILURES = 2
+# A running evaluation is a straggler once it has run for this many times the median evaluation latency
+STRAGGLER_FACTOR = 2.0
+# Number of completed evaluations needed before stragglers are duplicated
+STRAGGLER_MIN_SAMPLES = 3
+# Seconds without any healthy coordinator after which the remaining personas are failed
+NO_HEALTHY_NODE_TIMEOUT = 300.0
+# Maximum number of seconds the dispatcher waits for an evaluation to complete before checking the fleet again
+DISPATCH_INTERVAL = 1.0
+IN_FLIGHT_GAUGE = "personagym_requests_in_flight"
+# Gauges of the coordinators running a job queue, whose queued and running evaluations may not hold a request open
+QUEUE_DEPTH_GAUGE = "personagym_evaluation_queue_depth"
+QUEUE_RUNNING_GAUGE = "personagym_evaluation_queue_running"
+
+
+def parse_gauge(metrics: str, name: str) -> float | None:
+    """
+    Returns the value of an unlabelled gauge from metrics in the Prometheus text format
+    """
+    for line in metrics.splitlines():
+        metric, _, value = line.partition(" ")
+        if metric == name:
+            return float(value)
+    return None
+
+class CoordinatorNode:
+    """
+    Coordinator of the fleet, with its health and the evaluations the dispatcher is running on it
+    """
+
+    def __init__(self, url: str, concurrency: int):
+        self.url = url.rstrip("/")
+        self.concurrency = concurrency
+        self.client: Client | None = None
+        self.healthy = False
+        self.health_failures = 0
+        self.outstanding = 0
+        # Evaluations run by other clients, from the in-flight count reported by the coordinator
+        self.foreign_load = 0
+        self.stats = Counter()
+        self.latencies: list[float] = []
+
+    @property
+    def load(self) -> int:
+        return self.outstanding + self.foreign_load
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.outstanding < self.concurrency
+
+    def summary(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            **self.stats,
+            "latency_seconds": summarize_latencies(self.latencies),
+        }
+
+class Job:
+    """
+    Persona to evaluate, with its evaluations running on the fleet
+    """
+
+    def __init__(self, record: dict):
+        self.record = record
+        self.attempt = 1
+        self.not_before = 0.0
+        self.done = False
+        self.duplicated = False
+        # Coordinators the persona failed on, avoided when it is resubmitted
+        self.failed_urls: set[str] = set()
+        self.tasks: set[asyncio.Task] = set()
+
+class Dispatcher:
+    """
+    Evaluates a batch of personas on a fleet of coordinators, balancing them by outstanding evaluations
+    """
+
+    def __init__(
+            self,
+            urls: list[str],
+            concurrency: int = DEFAULT_NODE_CONCURRENCY,
+            max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+            persona_agent_url: str | None = None,
+            timeout: float = DEFAULT_TIMEOUT,
+            health_check_interval: float = HEALTH_CHECK_INTERVAL,
+            straggler_factor: float = STRAGGLER_FACTOR
+    ):
+        if not urls:
+            raise ValueError("At least one coordinator url is required")
+        self.nodes = [CoordinatorNode(url, concurrency) for url in urls]
+        self.max_attempts = max_attempts
+        self.persona_agent_url = persona_agent_url
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.straggler_factor = straggler_factor
+        self._pending: deque[Job] = deque()
+        # Running evaluations with their job, coordinator and start time
+        self._running: dict[asyncio.Task, tuple[Job, CoordinatorNode, float]] = {}
+        self._latencies: list[float] = []
+        self._stats = Counter()
+        self._wakeup = asyncio.Event()
+        self._health_checks: set[asyncio.Task] = set()
+        self._httpx_client: httpx.AsyncClient | None = None
+
+    async def _check_health(self, node: CoordinatorNode) -> None:
+        """
+        Reads the in-flight evaluations of a coordinator from its metrics, connecting to it on its first success
+        """
+        try:
+            response = await self._httpx_client.get(f"{node.url}/metrics", timeout=HEALTH_CHECK_TIMEOUT)
+            response.raise_for_status()
+            if node.client is None:
+                agent_card = await A2ACardResolver(httpx_client=self._httpx_client, base_url=node.url).get_agent_card()
+                config = ClientConfig(httpx_client=self._httpx_client, streaming=True)
+                node.client = ClientFactory(config).create(agent_card)
+        except Exception as e:
+            node.health_failures += 1
+            if node.healthy and node.health_failures >= MAX_HEALTH_FAILURES:
+                self._take_out_of_rotation(node, e)
+            elif not node.healthy:
+                logger.debug(f"Coordinator {node.url} is unavailable: {e}")
+            return
+
+        in_flight = max(
+            parse_gauge(response.text, IN_FLIGHT_GAUGE) or 0,
+            (parse_gauge(response.text, QUEUE_DEPTH_GAUGE) or 0) + (parse_gauge(response.text, QUEUE_RUNNING_GAUGE) or 0)
+        )
+        node.foreign_load = max(0, int(in_flight) - node.outstanding)
+        node.health_failures = 0
+        if not node.healthy:
+            node.healthy = True
+            logger.info(f"Coordinator {node.url} is in rotation")
+            self._wakeup.set()
+
+    def _take_out_of_rotation(self, node: CoordinatorNode, error: Exception) -> None:
+        """
+        Marks a coordinator as failed and cancels its running evaluations, which are then dispatched again
+        """
+        node.healthy = False
+        node.stats["failures"] += 1
+        running = [task for task, (_, task_node, _) in self._running.items() if task_node is node]
+        logger.warning(f"Coordinator {node.url} failed ({error!r}), dispatching its {len(running)} running evaluations again")
+        for task in running:
+            task.cancel()
+        self._wakeup.set()
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await asyncio.gather(*(self._check_health(node) for node in self.nodes))
+
+    def _select_node(self, exclude: set[str] | None = None) -> CoordinatorNode | None:
+        """
+        Returns the available coordinator with the fewest outstanding evaluations, avoiding the excluded ones if possible
+        """
+        available = [node for node in self.nodes if node.available]
+        preferred = [node for node in available if not exclude or node.url not in exclude]
+        candidates = preferred or available
+        return min(candidates, key=lambda node: (node.load, node.outstanding)) if candidates else None
+
+    def _start(self, job: Job, node: CoordinatorNode) -> None:
+        request = create_request(job.record, self.persona_agent_url)
+        task = asyncio.create_task(submit_request(node.client, request))
+        job.tasks.add(task)
+        node.outstanding += 1
+        node.stats["dispatched"] += 1
+        self._running[task] = (job, node, time.monotonic())
+
+    def _dispatch_pending(self) -> None:
+        now = time.monotonic()
+        for job in list(self._pending):
+            if job.not_before > now:
+                continue
+            node = self._select_node(exclude=job.failed_urls)
+            if node is None:
+                return
+            self._pending.remove(job)
+            self._start(job, node)
+
+    def _duplicate_stragglers(self) -> None:
+        """
+        Duplicates the evaluations running for much longer than the median evaluation on idle coordinators
+        """
+        if len(self._latencies) < STRAGGLER_MIN_SAMPLES or any(job.not_before <= time.monotonic() for job in self._pending):
+            return
+        threshold = self.straggler_factor * statistics.median(self._latencies)
+        now = time.monotonic()
+        # Longest running evaluations first
+        for job, node, start_time in sorted(self._running.values(), key=lambda running: running[2]):
+            if now - start_time < threshold:
+                break
+            if job.duplicated or job.done:
+                continue
+            target = self._select_node(exclude={node.url})
+            if target is None or target is node:
+                return
+            logger.info(f"Persona {job.record['id']} has run for {now - start_time:.1f}s on {node.url}, duplicating it on {target.url}")
+            job.duplicated = True
+            self._stats["duplicated"] += 1
+            self._start(job, target)
+
+    def _fail(self, job: Job, error: str, write_result) -> None:
+        job.done = True
+        self._stats["failed"] += 1
+        write_result({"id": job.record["id"], "status": "failed", "attempts": job.attempt, "error": error})
+
+    def _handle_completion(self, task: asyncio.Task, write_result) -> None:
+        job, node, start_time = self._running.pop(task)
+        job.tasks.discard(task)
+        node.outstanding -= 1
+        if job.done:
+            # The other evaluation of a duplicated persona
+            return
+
+        if task.cancelled():
+            # Its coordinator was taken out of rotation
+            if not job.tasks:
+                self._stats["redispatched"] += 1
+                self._pending.appendleft(job)
+            return
+
+        error = task.exception()
+        if error is None:
+            final_output, context_id = task.result()
+            latency = time.monotonic() - start_time
+            job.done = True
+            for other_task in job.tasks:
+                other_task.cancel()
+            self._latencies.append(latency)
+            node.latencies.append(latency)
+            node.stats["completed"] += 1
+            self._stats["completed"] += 1
+            write_result({
+                "id": job.record["id"],
+                "status": "completed",
+                "attempts": job.attempt,
+                "node": node.url,
+                "latency_seconds": round(latency, 3),
+                "context_id": context_id,
+                "result": final_output
+            })
+            return
+
+        if isinstance(error, EvaluationRejectedError):
+            # The coordinator's queue is full, which is backpressure rather than a failure of the persona or the coordinator
+            node.stats["rejected"] += 1
+            if not job.tasks:
+                logger.info(f"Evaluation of persona {job.record['id']} rejected by {node.url}, resubmitting")
+                job.not_before = time.monotonic() + RESUBMIT_BACKOFF
+                self._pending.append(job)
+            return
+
+        node.stats["errors"] += 1
+        # A failed evaluation counts as a failed health check, the next health check tells whether the coordinator is down
+        node.health_failures += 1
+        health_check = asyncio.create_task(self._check_health(node))
+        self._health_checks.add(health_check)
+        health_check.add_done_callback(self._health_checks.discard)
+        if job.tasks:
+            # The other evaluation of a duplicated persona is still running
+            return
+        job.failed_urls.add(node.url)
+        if job.attempt < self.max_attempts:
+            logger.warning(f"Evaluation of persona {job.record['id']} failed on {node.url} ({error}), resubmitting ({job.attempt}/{self.max_attempts})")
+            job.not_before = time.monotonic() + RESUBMIT_BACKOFF * 2 ** (job.attempt - 1)
+            job.attempt += 1
+            self._stats["resubmitted"] += 1
+            self._pending.append(job)
+            return
+        logger.error(f"Evaluation of persona {job.record['id']} failed after {job.attempt} attempts: {error}")
+        self._fail(job, str(error), write_result)
+
+    async def run(self, records: list[dict], output_path: str, resume: bool = False) -> dict:
+        """
+        Evaluates all personas on the fleet, skipping those already completed in the output file when resuming, and
+        returns the throughput and latency summary of the batch and of each coordinator
+        """
+        completed_ids = load_completed_ids(output_path) if resume else set()
+        self._pending = deque(Job(record) for record in records if record["id"] not in completed_ids)
+        total_pending = len(self._pending)
+        if resume:
+            logger.info(f"Resuming batch, skipping {len(records) - total_pending} personas already completed")
+        start_time = time.monotonic()
+
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        connections = sum(node.concurrency for node in self.nodes) * 2 + len(self.nodes)
+        limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+        async with httpx.AsyncClient(timeout=self.timeout, limits=limits) as self._httpx_client:
+            await asyncio.gather(*(self._check_health(node) for node in self.nodes))
+            monitor = asyncio.create_task(self._monitor())
+            last_healthy_time = time.monotonic()
+            try:
+                with open(output_path, "a" if resume else "w") as output_file:
+                    def write_result(result: dict) -> None:
+                        output_file.write(json.dumps(result) + "\n")
+                        output_file.flush()
+
+                    while self._pending or self._running:
+                        if any(node.healthy for node in self.nodes):
+                            last_healthy_time = time.monotonic()
+                        elif time.monotonic() - last_healthy_time > NO_HEALTHY_NODE_TIMEOUT:
+                            logger.error(f"No healthy coordinator for {NO_HEALTHY_NODE_TIMEOUT}s, failing {len(self._pending)} personas")
+                            while self._pending:
+                                self._fail(self._pending.popleft(), "No healthy coordinator", write_result)
+                            continue
+
+                        self._dispatch_pending()
+                        self._duplicate_stragglers()
+
+                        self._wakeup.clear()
+                        wakeup = asyncio.create_task(self._wakeup.wait())
+                        done, _ = await asyncio.wait(
+                            [*self._running, wakeup], timeout=DISPATCH_INTERVAL, return_when=asyncio.FIRST_COMPLETED
+                        )
+                        wakeup.cancel()
+                        completions = [task for task in done if task in self._running]
+                        for task in completions:
+                            self._handle_completion(task, write_result)
+                        if completions:
+                            done_count = self._stats["completed"] + self._stats["failed"]
+                            logger.info(
+                                f"{done_count}/{total_pending} personas evaluated ({self._stats['failed']} failed, "
+                                f"{done_count / (time.monotonic() - start_time) * 60:.2f} personas/min)"
+                            )
+            finally:
+                monitor.cancel()
+                for task in [*self._running, *self._health_checks]:
+                    task.cancel()
+
+        elapsed = time.monotonic() - start_time
+        return {
+            "total": len(records),
+            "skipped": len(records) - total_pending,
+            "completed": self._stats["completed"],
+            "failed": self._stats["failed"],
+            "resubmitted": self._stats["resubmitted"],
+            "redispatched": self._stats["redispatched"],
+            "duplicated": self._stats["duplicated"],
+            "elapsed_seconds": round(elapsed, 3),
+            "personas_per_minute": round(self._stats["completed"] / elapsed * 60, 2) if elapsed else 0.0,
+            "latency_seconds": summarize_latencies(self._latencies),
+            "nodes": {node.url: node.summary() for node in self.nodes},
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Dispatch a batch of personas across a fleet of PersonaGym coordinators.")
+    parser.add_argument("--input", type=str, required=True, help="JSONL or CSV file of personas to evaluate")
+    parser.add_argument("--output", type=str, default="output/batch_results.jsonl", help="JSONL file the final outputs are written to")
+    parser.add_argument("--urls", type=str, required=True, help="Comma-separated base urls of the coordinators")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_NODE_CONCURRENCY, help="Number of personas evaluated concurrently by each coordinator")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="Number of submissions of a failing persona")
+    parser.add_argument("--persona-agent-url", type=str, help="Base url of the persona agent, if not given per persona")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Timeout of each evaluation in seconds")
+    parser.add_argument("--health-check-interval", type=float, default=HEALTH_CHECK_INTERVAL, help="Seconds between the health checks of each coordinator")
+    parser.add_argument("--straggler-factor", type=float, default=STRAGGLER_FACTOR, help="Multiple of the median latency after which an evaluation is duplicated")
+    parser.add_argument("--resume", action="store_true", help="Skip the personas already completed in the output file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    dispatcher = Dispatcher(
+        urls=[url.strip() for url in args.urls.split(",") if url.strip()],
+        concurrency=args.concurrency,
+        max_attempts=args.max_attempts,
+        persona_agent_url=args.persona_agent_url,
+        timeout=args.timeout,
+        health_check_interval=args.health_check_interval,
+        straggler_factor=args.straggler_factor
+    )
+    summary = asyncio.run(dispatcher.run(load_personas(args.input), args.output, resume=args.resume))
+    print(json.dumps(summary, indent=4))
+
+if __name__ == "__main__":
+    main()
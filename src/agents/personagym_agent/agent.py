@@ -7,19 +7,22 @@ This is the agent being tested by the PersonaGym framework. It:
 3. Gets evaluated on Expected Action, Toxicity, Linguistic Habits, Persona Consistency, and Action Justification
 """
 import argparse
-import os
+import threading
 import uvicorn
 from dotenv import load_dotenv
-from google.adk.models.lite_llm import LiteLlm
 
 # Load .env if it exists (for local development), but don't fail if missing (for Docker)
 load_dotenv(verbose=False, override=False)
 
 from google.adk.agents import LlmAgent
 from google.adk.a2a.utils.agent_to_a2a import to_a2a
+from google.adk.runners import Runner
 from a2a.types import AgentCard, AgentSkill, AgentCapabilities
 
-from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback
+from src.utils.instrumentation import metrics_endpoint
+from src.utils.llm_factory import create_llm, preload_llm_models
+from src.utils.session_eviction import create_bounded_session_service
+from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback, pre_model_logging_callback, post_model_logging_callback
 
 def create_agent_card(url: str) -> AgentCard:
     """Create the agent card for the PersonaGym agent."""
@@ -64,12 +67,14 @@ def create_personagym_agent() -> LlmAgent:
         LlmAgent instance configured for PersonaGym evaluation
     """
     return LlmAgent(
-        model=LiteLlm(model=os.environ["PERSONAGYM_MODEL"]),
+        model=create_llm("PERSONAGYM_MODEL", stage="persona_agent"),
         name="personagym_agent",
         description="Persona-adopting agent for PersonaGym behavioral evaluation",
         instruction=SYSTEM_PROMPT,
         before_agent_callback=pre_agent_logging_callback,
-        after_agent_callback=post_agent_logging_callback
+        after_agent_callback=post_agent_logging_callback,
+        before_model_callback=pre_model_logging_callback,
+        after_model_callback=post_model_logging_callback
     )
 
 
@@ -89,8 +94,12 @@ def main():
     card_url = args.card_url or f"http://{args.host}:{args.port}/"
     agent_card = create_agent_card(card_url)
 
-    # Convert ADK agent to A2A
-    a2a_app = to_a2a(root_agent, agent_card=agent_card)
+    # Convert ADK agent to A2A, keeping the sessions of the A2A contexts in a bounded in-memory store
+    runner = Runner(app_name=root_agent.name, agent=root_agent, session_service=create_bounded_session_service())
+    a2a_app = to_a2a(root_agent, agent_card=agent_card, runner=runner)
+    a2a_app.add_route("/metrics", metrics_endpoint, methods=["GET"])
+    # Imports LiteLLM in the background once the server is up rather than on the first request
+    a2a_app.add_event_handler("startup", lambda: threading.Thread(target=preload_llm_models, name="warm_up", daemon=True).start())
 
     uvicorn.run(
         a2a_app,
@@ -1,33 +1,38 @@
 # PersonaGym Coordinator Agent
 # This agent handles the A2A protocol and orchestrates the workflow.
 
-from google.adk.agents import ParallelAgent, SequentialAgent
-from google.adk.a2a.utils.agent_to_a2a import to_a2a
-from google.adk.sessions import InMemorySessionService
+from google.adk.agents import BaseAgent, ParallelAgent, SequentialAgent
 from a2a.types import AgentCard, AgentSkill, AgentCapabilities
 import argparse
-import uvicorn
 import logging
 import os
+import threading
+from functools import lru_cache
 
 # Try relative imports first (for Docker), fall back to absolute imports (for local uv run)
 try:
     from personagym_evaluator.sub_agents.settings_selector import root_agent as settings_selector_agent
-    from personagym_evaluator.sub_agents.question_generator import EvaluationTask, create_question_agent
-    from personagym_evaluator.sub_agents.persona_response import create_persona_response_agent
-    from personagym_evaluator.sub_agents.rubric_formatter import create_rubric_formatter_agent
-    from personagym_evaluator.sub_agents.evaluator import create_evaluator_agent
+    from personagym_evaluator.sub_agents.question_generator import EvaluationTask, create_question_agent, question_output_key
+    from personagym_evaluator.sub_agents.persona_response import create_persona_response_agent, persona_responses_output_key
+    from personagym_evaluator.sub_agents.rubric_formatter import create_rubric_formatter_agent, evaluation_rubric_output_key, examples_output_key, rubric_state_key
+    from personagym_evaluator.sub_agents.evaluator import create_evaluator_agent, create_task_result_callback, evaluation_output_key
     from personagym_evaluator.sub_agents.score_aggregator import create_score_aggregator_agent
 except ImportError:
     # Fallback for local development with uv run
     from agents.personagym_evaluator.sub_agents.settings_selector import root_agent as settings_selector_agent
-    from agents.personagym_evaluator.sub_agents.question_generator import EvaluationTask, create_question_agent
-    from agents.personagym_evaluator.sub_agents.persona_response import create_persona_response_agent
-    from agents.personagym_evaluator.sub_agents.rubric_formatter import create_rubric_formatter_agent
-    from agents.personagym_evaluator.sub_agents.evaluator import create_evaluator_agent
+    from agents.personagym_evaluator.sub_agents.question_generator import EvaluationTask, create_question_agent, question_output_key
+    from agents.personagym_evaluator.sub_agents.persona_response import create_persona_response_agent, persona_responses_output_key
+    from agents.personagym_evaluator.sub_agents.rubric_formatter import create_rubric_formatter_agent, evaluation_rubric_output_key, examples_output_key, rubric_state_key
+    from agents.personagym_evaluator.sub_agents.evaluator import create_evaluator_agent, create_task_result_callback, evaluation_output_key
     from agents.personagym_evaluator.sub_agents.score_aggregator import create_score_aggregator_agent
 
+from src.utils.checkpoints import create_resume_callback, create_session_service
+from src.utils.evaluation_request import seed_evaluation_request_callback
+from src.utils.instrumentation import InFlightRequestsMiddleware, metrics_endpoint
+from src.utils.llm_factory import preload_llm_models
 from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback
+from src.utils.settings_index import get_settings_index
+from src.utils.state_compaction import create_state_compaction_agent
 
 from dotenv import load_dotenv
 load_dotenv(verbose=False, override=False)
@@ -37,45 +42,78 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Create workflows for each evaluation task
-evaluation_task_workflows = []
-for task in EvaluationTask:
+def create_evaluation_task_workflow(task: EvaluationTask) -> SequentialAgent:
+    """Create the sequential workflow evaluating a persona for one evaluation task"""
     task_name = task.name.lower()
-    evaluation_task_workflow = SequentialAgent(
+    return SequentialAgent(
         name=f"{task_name}_eval_workflow",
         description=f"Evaluation task workflow for the task {task.value}",
         sub_agents=[
             create_question_agent(task=task),
-            create_persona_response_agent(name=f"persona_response_agent_for_{task_name}_eval"),
-            create_rubric_formatter_agent(task=task),   
-            create_evaluator_agent(agent_name=f"evaluator_agent1_for_{task_name}_eval")
+            create_persona_response_agent(name=f"persona_response_agent_for_{task_name}_eval", task=task),
+            create_rubric_formatter_agent(task=task),
+            create_evaluator_agent(
+                agent_name=f"evaluator_agent1_for_{task_name}_eval",
+                output_key=evaluation_output_key(task),
+                task=task
+            ),
+            # Only the evaluator output is needed once the task has been evaluated
+            *create_state_compaction_agent(
+                name=f"state_compaction_for_{task_name}_eval",
+                keys=[
+                    question_output_key(task),
+                    persona_responses_output_key(task),
+                    rubric_state_key(task),
+                    examples_output_key(task),
+                    evaluation_rubric_output_key(task)
+                ]
+            )
         ],
+        # Skips the whole task when a resumed evaluation already has its evaluator output, still streaming it as a
+        # partial result
+        before_agent_callback=[
+            pre_agent_logging_callback,
+            create_resume_callback(evaluation_output_key(task), on_restored=create_task_result_callback(task))
+        ],
+        # Emits the task's evaluator output as a partial result for streaming clients
+        after_agent_callback=[post_agent_logging_callback, create_task_result_callback(task)]
+    )
+
+@lru_cache(maxsize=1)
+def get_root_agent() -> BaseAgent:
+    """Build the agent graph on first use, so importing this module stays cheap"""
+    # Create a coordinator agent that orchestrates persona evaluation for each evaluation task in parallel
+    evaluation_task_coordinator = ParallelAgent(
+        name="evaluation_task_coordinator",
+        description="Agent that coordinates the evaluation of a persona for all possible evaluation tasks in parallel",
+        sub_agents=[create_evaluation_task_workflow(task) for task in EvaluationTask],
         before_agent_callback=pre_agent_logging_callback,
         after_agent_callback=post_agent_logging_callback
     )
-    evaluation_task_workflows.append(evaluation_task_workflow)
-
-# Create a coordinator agent that orchestrates persona evaluation for each evaluation task in parallel
-evaluation_task_coordinator = ParallelAgent(
-    name="evaluation_task_coordinator",
-    description="Agent that coordinates the evaluation of a persona for all possible evaluation tasks in parallel",
-    sub_agents=evaluation_task_workflows,
-    before_agent_callback=pre_agent_logging_callback,
-    after_agent_callback=post_agent_logging_callback
-)
 
-# Expose the main sequential workflow as the root agent
-root_agent = SequentialAgent(
-    name="personagym_coordinator",
-    description="Orchestrates the PersonaGym evaluation workflow. Expects a persona description as input.",
-    sub_agents=[
-        settings_selector_agent,
-        evaluation_task_coordinator,
-        create_score_aggregator_agent()
-    ],
-    before_agent_callback=pre_agent_logging_callback,
-    after_agent_callback=post_agent_logging_callback
-)
+    # Expose the main sequential workflow as the root agent
+    return SequentialAgent(
+        name="personagym_coordinator",
+        description="Orchestrates the PersonaGym evaluation workflow. Expects a persona description as input.",
+        sub_agents=[
+            settings_selector_agent,
+            evaluation_task_coordinator,
+            create_score_aggregator_agent()
+        ],
+        before_agent_callback=[pre_agent_logging_callback, seed_evaluation_request_callback],
+        after_agent_callback=post_agent_logging_callback
+    )
+
+def __getattr__(name: str):
+    # root_agent is built lazily on first access, e.g. by `adk web` or `from ... import root_agent`
+    if name == "root_agent":
+        return get_root_agent()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def warm_up():
+    """Load what the first evaluation needs but the server startup does not"""
+    preload_llm_models()
+    get_settings_index()
 
 def create_agent_card(url: str) -> AgentCard:
     """Create the A2A agent card for PersonaGym"""
@@ -98,7 +136,7 @@ def create_agent_card(url: str) -> AgentCard:
         version="1.0.0",
         default_input_modes=['text'],
         default_output_modes=['text'],
-        capabilities=AgentCapabilities(streaming=False),
+        capabilities=AgentCapabilities(streaming=True),
         skills=[skill],
     )
     return agent_card
@@ -113,11 +151,31 @@ def main():
     card_url = args.card_url or f"http://{args.host}:{args.port}/"
     agent_card = create_agent_card(card_url)
 
-    # Expose root agent with session via A2A
-    a2a_app = to_a2a(
-        root_agent,
-        agent_card=agent_card
-    )
+    # The server modules are only needed when serving the agent
+    from google.adk.a2a.utils.agent_to_a2a import to_a2a
+    from google.adk.runners import Runner
+    import uvicorn
+
+    from src.utils.evaluation_queue import EVALUATION_QUEUE_ENABLED, create_job_queue_app
+
+    # Expose root agent with session via A2A, sessions are persisted when SESSION_DB_URL is set
+    root_agent = get_root_agent()
+    runner = Runner(app_name=root_agent.name, agent=root_agent, session_service=create_session_service())
+    if EVALUATION_QUEUE_ENABLED:
+        # Evaluations are queued and run by a bounded number of workers
+        a2a_app = create_job_queue_app(agent_card, runner)
+    else:
+        a2a_app = to_a2a(
+            root_agent,
+            agent_card=agent_card,
+            runner=runner
+        )
+    a2a_app.add_route("/metrics", metrics_endpoint, methods=["GET"])
+    # Reports the number of running evaluations to the dispatcher through /metrics
+    a2a_app.add_middleware(InFlightRequestsMiddleware)
+    # Imports LiteLLM and builds the settings index in the background once the server is up, so neither delays
+    # the startup nor the first request
+    a2a_app.add_event_handler("startup", lambda: threading.Thread(target=warm_up, name="warm_up", daemon=True).start())
     uvicorn.run(a2a_app, host=args.host, port=args.port)
 
 if __name__ == "__main__":
@@ -1,16 +1,50 @@
 # Evaluator Agent
-from google.adk.agents import Agent
-from google.adk.models.lite_llm import LiteLlm
+from google.adk.agents import Agent, BaseAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.agents.readonly_context import ReadonlyContext
+from google.adk.events import Event, EventActions
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.genai import types
 
+import asyncio
+import json
+import logging
 import os
+import statistics
+from typing import AsyncGenerator, Callable
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
+from pydantic.json_schema import SkipJsonSchema
 
 from src.agents.personagym_evaluator.sub_agents.question_generator import EvaluationTask
-from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback
+from src.agents.personagym_evaluator.sub_agents.rubric_formatter import EvaluationRubric, ResponseToEvaluate, evaluation_rubric_output_key
+from src.utils.instrumentation import metrics_registry, record_model_call_end, record_model_request, record_model_response, record_retry
+from src.utils.llm_factory import create_llm, get_retriable_llm_errors
+from src.utils.llm_scheduler import StagePriority
+from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback, pre_model_logging_callback, post_model_logging_callback
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# "per_question" judges each question/response pair with a separate model call, "batch" judges all pairs of a task in one call
+EVALUATOR_MODE = os.getenv("EVALUATOR_MODE", "per_question")
+# Maximum number of concurrent judge calls per evaluation task, and the number of attempts at a valid judgement per question
+EVALUATOR_CONCURRENCY = int(os.getenv("EVALUATOR_CONCURRENCY", "5"))
+EVALUATOR_MAX_ATTEMPTS = int(os.getenv("EVALUATOR_MAX_ATTEMPTS", "3"))
+# Comma-separated model environment variables of the judges scoring each response in per_question mode
+EVALUATOR_JUDGE_MODELS = [name.strip() for name in os.getenv("EVALUATOR_JUDGE_MODELS", "EVAL_1_MODEL").split(",") if name.strip()]
+# "mean" or "median" of the judge scores
+EVALUATOR_SCORE_AGGREGATION = os.getenv("EVALUATOR_SCORE_AGGREGATION", "mean")
+# Judges agree when their scores differ by at most this threshold. With early exit, the remaining judges are skipped
+# when the first two judges agree.
+EVALUATOR_AGREEMENT_THRESHOLD = float(os.getenv("EVALUATOR_AGREEMENT_THRESHOLD", "0"))
+EVALUATOR_EARLY_EXIT = os.getenv("EVALUATOR_EARLY_EXIT", "true").lower() == "true"
+
+SCORE_AGGREGATIONS = {"mean": statistics.mean, "median": statistics.median}
+
 ### Evaluator System Prompt
 
 # :TODO how to create system_prompt: You are an ACCURATE, FAITHFUL, CRITICAL and FAIR judge who is tasked to evaluate responses to questions based on a given rubric.
@@ -46,11 +80,48 @@ Format:
 Each question evaluation will be a JSON object as defined above with the "question", "justification" and "score" fields. The length of the "evaluations" array should be equal to the total number of question-response pairs.
 """
 
+# System prompt of the per-question judge, the rubric is shared by all questions of a task
+judge_system_prompt = """
+You are an expert judge for the PersonaGym framework. Your goal is to be ACCURATE, FAITHFUL, CRITICAL, and FAIR.
+
+You are given a persona, the scoring rubric of the {evaluation_task} evaluation task, and a single question answered by the persona together with example responses for each score.
+Evaluate the persona's response to the question based on the criteria established in the rubric.
+
+You must follow this STRICT Output Format:
+{{
+    "justification": [Evaluation of the persona's response to the question with detailed reasoning matching the rubric criteria],
+    "score": [Final score based on the rubric (1-5)]
+}}
+
+Persona:
+{persona}
+
+Scoring rubric:
+{scoring_rubric}
+"""
+
+JUDGE_REQUEST_TEMPLATE = """Question: {question}
+
+Persona response: {response}
+
+Example responses for each score:
+{examples}"""
+
+JUDGE_CORRECTION_TEMPLATE = """Your previous judgement (attempt {attempt}) could not be used: {error}
+Reply only with a JSON object following the output format, with a score between 1 and 5."""
+
 ### Result formatter
 
 # Format for evaluations for individual questions
 class ResponseEvaluation(BaseModel):
     question: str = Field(description="The evaluation question")
+    justification: str = Field(description="The evaluator agent's justification of their assigned score")
+    score: float = Field(description="The evaluator agent's score for the persona agent's response based on the provided rubric")
+    # Scores of the individual judges when the response is scored by a judge ensemble (not part of the model's output schema)
+    judge_scores: SkipJsonSchema[list[int] | None] = None
+
+# Output schema of the per-question judge
+class ResponseJudgement(BaseModel):
     justification: str = Field(description="The evaluator agent's justification of their assigned score")
     score: int = Field(description="The evaluator agent's score for the persona agent's response based on the provided rubric")
 
@@ -58,18 +129,254 @@ class ResponseEvaluation(BaseModel):
 class EvaluatorOutput(BaseModel):
     evaluation_task: EvaluationTask
     evaluations: list[ResponseEvaluation] = Field(description="Array of persona response evaluations with scores")
+    # Fraction of the responses scored by several judges whose judges agreed (not part of the model's output schema)
+    judge_agreement: SkipJsonSchema[float | None] = None
+
+def evaluation_output_key(task: EvaluationTask) -> str:
+    """
+    Returns the session state key under which the evaluator output for a given evaluation task is stored
+    """
+    return f"{task.name.lower()}_evaluation"
+
+# Type of the streamed update emitted when an evaluation task workflow completes
+TASK_RESULT_UPDATE_TYPE = "task_result"
 
-def create_evaluator_agent(agent_name: str) -> Agent:
+def create_task_result_callback(task: EvaluationTask) -> Callable[[CallbackContext], types.Content | None]:
     """
-    Creates an instance of the Evaluator Agent.
+    Creates a callback for an evaluation task workflow that emits the task's evaluator output once the workflow completes, so that it is streamed to the client as a partial result
     """
+    output_key = evaluation_output_key(task)
+
+    def task_result_callback(callback_context: CallbackContext) -> types.Content | None:
+        evaluation = callback_context.state.get(output_key)
+        if evaluation is None:
+            return None
+        update = {
+            "type": TASK_RESULT_UPDATE_TYPE,
+            "evaluation_task": task.value,
+            "result": EvaluatorOutput.model_validate(evaluation).model_dump(mode="json")
+        }
+        return types.Content(role="model", parts=[types.Part(text=json.dumps(update))])
+
+    return task_result_callback
+
+class PerQuestionEvaluatorAgent(BaseAgent):
+    """
+    Agent that evaluates each question/response pair of an evaluation rubric with separate judge calls.
+
+    Each response is scored by every judge model, and the judge scores are aggregated by mean or median. With
+    `early_exit`, the first two judges run first and the remaining judges are skipped if they agree within
+    `agreement_threshold`. Judge calls run concurrently (bounded by `max_concurrency`) and are merged into an
+    `EvaluatorOutput` in question order. A judgement that does not match the schema is retried on its own with a
+    correction, while transient model errors are left to the resilience policy of the model; a question that no judge
+    could score is given a score of 0, which the score aggregator ignores.
+    """
+    models: list[BaseLlm]
+    task: EvaluationTask
+    rubric_key: str
+    output_key: str
+    max_concurrency: int = EVALUATOR_CONCURRENCY
+    max_attempts: int = EVALUATOR_MAX_ATTEMPTS
+    score_aggregation: str = EVALUATOR_SCORE_AGGREGATION
+    agreement_threshold: float = EVALUATOR_AGREEMENT_THRESHOLD
+    early_exit: bool = EVALUATOR_EARLY_EXIT
+
+    async def _judge(
+            self,
+            callback_context: CallbackContext,
+            model: BaseLlm,
+            call_id: str,
+            system_instruction: str,
+            item: ResponseToEvaluate
+    ) -> ResponseJudgement | None:
+        """
+        Scores a response with one judge model, returning None if all attempts fail
+        """
+        contents = [types.Content(role="user", parts=[types.Part(text=JUDGE_REQUEST_TEMPLATE.format(
+            question=item.question,
+            response=item.response,
+            examples=json.dumps([example.model_dump() for example in item.examples], indent=4)
+        ))])]
+
+        for attempt in range(self.max_attempts):
+            if attempt:
+                record_retry(model.model, invocation_id=callback_context.invocation_id)
+            llm_request = LlmRequest(
+                model=model.model,
+                contents=contents,
+                config=types.GenerateContentConfig(system_instruction=system_instruction)
+            )
+            llm_request.set_output_schema(ResponseJudgement)
+            attempt_call_id = f"{call_id}:{attempt}"
+            record_model_request(callback_context, llm_request, call_id=attempt_call_id)
+            try:
+                text = ""
+                async for llm_response in model.generate_content_async(llm_request):
+                    record_model_response(callback_context, llm_response, call_id=attempt_call_id)
+                    if llm_response.error_code:
+                        raise ValueError(f"{llm_response.error_code}: {llm_response.error_message}")
+                    if not llm_response.partial and llm_response.content and llm_response.content.parts:
+                        text += "".join(part.text for part in llm_response.content.parts if part.text and not part.thought)
+                judgement = ResponseJudgement.model_validate_json(text)
+                if not 1 <= judgement.score <= 5:
+                    raise ValueError(f"Score out of range: {judgement.score}")
+                return judgement
+            except get_retriable_llm_errors() as e:
+                # Transient errors were already retried by the resilience policy of the model
+                logger.warning(
+                    f"[{callback_context.invocation_id}] Judgement of {self.task.value} question by {model.model} failed "
+                    f"({type(e).__name__})"
+                )
+                return None
+            except ValueError as e:
+                # Asks for a corrected judgement, which also keeps the retry from being served the cached response
+                contents = contents[:1] + [
+                    types.Content(role="user", parts=[types.Part(text=JUDGE_CORRECTION_TEMPLATE.format(attempt=attempt + 1, error=str(e)[:500]))])
+                ]
+                logger.warning(
+                    f"[{callback_context.invocation_id}] Judgement of {self.task.value} question by {model.model} failed "
+                    f"({type(e).__name__}), attempt {attempt + 1}/{self.max_attempts}"
+                )
+            finally:
+                record_model_call_end(callback_context, attempt_call_id)
+        return None
+
+    def _agree(self, scores: list[int]) -> bool:
+        return max(scores) - min(scores) <= self.agreement_threshold
+
+    async def _evaluate(
+            self,
+            callback_context: CallbackContext,
+            semaphore: asyncio.Semaphore,
+            system_instruction: str,
+            index: int,
+            item: ResponseToEvaluate
+    ) -> ResponseEvaluation:
+        async def judge(judge_index: int) -> ResponseJudgement | None:
+            async with semaphore:
+                return await self._judge(
+                    callback_context, self.models[judge_index], f"{index}:{judge_index}", system_instruction, item
+                )
+
+        judge_indexes = list(range(len(self.models)))
+        first_judges = judge_indexes[:2] if self.early_exit else judge_indexes
+        judgements = dict(zip(first_judges, await asyncio.gather(*(judge(i) for i in first_judges))))
+
+        remaining_judges = judge_indexes[len(first_judges):]
+        first_scores = [judgement.score for judgement in judgements.values() if judgement is not None]
+        if remaining_judges and len(first_scores) == 2 and self._agree(first_scores):
+            metrics_registry.increment(
+                "personagym_judge_calls_skipped_total", "Judge calls skipped because the first judges agreed",
+                amount=len(remaining_judges)
+            )
+        elif remaining_judges:
+            judgements.update(zip(remaining_judges, await asyncio.gather(*(judge(i) for i in remaining_judges))))
+
+        scored = [(self.models[i].model, judgement) for i, judgement in sorted(judgements.items()) if judgement is not None]
+        if not scored:
+            return ResponseEvaluation(
+                question=item.question,
+                justification=f"Evaluation failed after {self.max_attempts} attempts by each judge",
+                score=0
+            )
+        if len(self.models) == 1:
+            return ResponseEvaluation(question=item.question, justification=scored[0][1].justification, score=scored[0][1].score)
+
+        judge_scores = [judgement.score for _, judgement in scored]
+        return ResponseEvaluation(
+            question=item.question,
+            justification="\n\n".join(f"[{model} score {judgement.score}] {judgement.justification}" for model, judgement in scored),
+            score=round(SCORE_AGGREGATIONS[self.score_aggregation](judge_scores), 2),
+            judge_scores=judge_scores
+        )
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        evaluation_rubric = ctx.session.state.get(self.rubric_key)
+        if evaluation_rubric is None:
+            raise ValueError(f"Cannot evaluate the {self.task.value} responses, {self.rubric_key} is missing from the session state")
+        evaluation_rubric = EvaluationRubric.model_validate(evaluation_rubric)
+
+        callback_context = CallbackContext(ctx)
+        system_instruction = judge_system_prompt.format(
+            evaluation_task=self.task.value,
+            persona=evaluation_rubric.persona,
+            scoring_rubric=evaluation_rubric.scoring_rubric
+        )
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        evaluations = await asyncio.gather(*(
+            self._evaluate(callback_context, semaphore, system_instruction, index, item)
+            for index, item in enumerate(evaluation_rubric.responses)
+        ))
+
+        agreements = [self._agree(evaluation.judge_scores) for evaluation in evaluations if evaluation.judge_scores and len(evaluation.judge_scores) > 1]
+        evaluator_output = EvaluatorOutput(
+            evaluation_task=self.task,
+            evaluations=list(evaluations),
+            judge_agreement=round(sum(agreements) / len(agreements), 2) if agreements else None
+        )
+        if evaluator_output.judge_agreement is not None:
+            logger.info(f"[{ctx.invocation_id}] Judge agreement for {self.task.value}: {evaluator_output.judge_agreement:.0%}")
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=evaluator_output.model_dump_json(indent=4, exclude_none=True))]),
+            actions=EventActions(state_delta={self.output_key: evaluator_output.model_dump()})
+        )
+
+def create_evaluator_agent(
+        agent_name: str,
+        output_key: str | None = None,
+        task: EvaluationTask | None = None,
+        mode: str = EVALUATOR_MODE,
+        judge_models: list[str] = EVALUATOR_JUDGE_MODELS
+) -> BaseAgent:
+    """
+    Creates an instance of the Evaluator Agent. In "per_question" mode, the responses to the given task are judged
+    one question at a time from the task's evaluation rubric in the session state, by each of the judge models.
+    The "batch" mode only uses the first judge model.
+    """
+    models = [
+        create_llm(model_env_var, cache=True, priority=StagePriority.HIGH, stage="evaluator")
+        for model_env_var in judge_models
+    ]
+    if EVALUATOR_SCORE_AGGREGATION not in SCORE_AGGREGATIONS:
+        raise ValueError(f"Unknown EVALUATOR_SCORE_AGGREGATION: {EVALUATOR_SCORE_AGGREGATION}")
+
+    if mode == "per_question" and task is not None:
+        return PerQuestionEvaluatorAgent(
+            name=agent_name,
+            description="Agent that evaluates answers given by a persona agent one question at a time",
+            models=models,
+            task=task,
+            rubric_key=evaluation_rubric_output_key(task),
+            output_key=output_key or evaluation_output_key(task),
+            before_agent_callback=pre_agent_logging_callback,
+            after_agent_callback=post_agent_logging_callback
+        )
+
+    instruction, include_contents = system_prompt, "default"
+    if task is not None:
+        rubric_key = evaluation_rubric_output_key(task)
+
+        def instruction(readonly_context: ReadonlyContext) -> str:
+            # The evaluation rubric is read from the session state, the conversation history is not needed
+            evaluation_rubric = EvaluationRubric.model_validate(readonly_context.state[rubric_key])
+            return f"{system_prompt}\nEvaluation rubric:\n{evaluation_rubric.model_dump_json(indent=4)}"
+
+        include_contents = "none"
 
     return Agent(
         name=agent_name,
         description="Agent that evaluates answers given by a persona agent",
-        model=LiteLlm(model=os.environ["EVAL_1_MODEL"]),
-        instruction=system_prompt,
+        model=models[0],
+        instruction=instruction,
+        include_contents=include_contents,
         output_schema=EvaluatorOutput,
+        output_key=output_key,
         before_agent_callback=pre_agent_logging_callback,
-        after_agent_callback=post_agent_logging_callback
+        after_agent_callback=post_agent_logging_callback,
+        before_model_callback=pre_model_logging_callback,
+        after_model_callback=post_model_logging_callback
     )
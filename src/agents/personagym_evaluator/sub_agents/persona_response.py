@@ -2,52 +2,131 @@
 Persona Response Agent
 """
 
-from google.adk.agents import Agent
-from google.adk.agents.callback_context import CallbackContext
-from google.adk.tools.function_tool import FunctionTool
-from google.adk.models.lite_llm import LiteLlm
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+from pydantic import BaseModel, Field
 
+import ast
+import asyncio
+import json
+import logging
 import os
+import re
+from typing import AsyncGenerator
 from dotenv import load_dotenv
 
+from src.agents.personagym_evaluator.sub_agents.question_generator import EvaluationTask, question_output_key
 from src.tools.message_tool import MessageToolProvider
+from src.utils.checkpoints import create_resume_callback
+from src.utils.evaluation_request import PERSONA_AGENT_URL_STATE_KEY, PERSONA_STATE_KEY
 from src.utils.logging_callbacks import post_agent_logging_callback, pre_agent_logging_callback
 load_dotenv()
 
-system_prompt = """
-You are a sub-agent of the green agent tasked with communicating with the external `PersonaGymAgent` to obtain its responses to a number of scenario-based questions in order to assess its behaviour. The questions that will be posed to the persona will be provided to you.
+logger = logging.getLogger(__name__)
 
-Participating agents:
-- **PersonaGymAgent**: an agent that responds to questions behaving as a specified persona
+# Maximum number of questions sent to the persona agent at the same time by each persona response agent
+PERSONA_RESPONSE_CONCURRENCY = int(os.getenv("PERSONA_RESPONSE_CONCURRENCY", "10"))
 
-Communication with the `PersonaGymAgent` will be via the A2A protocol using the available `talk_to_agent` tool. Prompt the `PersonaGymAgent` to respond to the provided questions. The tool is called `talk_to_agent` and it accepts 3 arguments: 
-- `message` (str): the message to be sent as a prompt to the persona agent
-- `url` (str): the base url of the A2A server which exposes the persona agent
-- `new_conversation` (bool - Optional): Set to True if it is a new conversation with the persona agent, else set to False to continue an existing conversation
+PERSONA_QUESTION_TEMPLATE = """Persona: {persona}
 
-Return ONLY the persona's responses to each of the provided questions as a Python list of strings, where each response is a separate array element. Do NOT include anything else in the ouput except for the persona's responses to the questions.
-"""
+Question: {question}"""
+
+CODE_FENCE_PATTERN = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+LIST_ITEM_PREFIX_PATTERN = re.compile(r"^\s*(?:[-*]|\d+[.)])\s*")
+
+# Output format of the persona response agent
+class PersonaResponse(BaseModel):
+    question: str = Field(description="The evaluation question")
+    response: str = Field(description="The persona agent's response to the question")
 
-def create_persona_response_agent(name: str) -> Agent:
+class PersonaResponses(BaseModel):
+    responses: list[PersonaResponse]
+
+def persona_responses_output_key(task: EvaluationTask) -> str:
     """
-    Creates an instance of the persona response agent
+    Returns the session state key under which the persona responses for a given evaluation task are stored
+    """
+    return f"{task.name.lower()}_responses"
+
+def parse_questions(text: str) -> list[str]:
+    """
+    Parses the question generator output into a list of questions.
+
+    The output is expected to be a Python (or JSON) list of strings, optionally wrapped in a Markdown code block.
+    Falls back to treating each non-empty line as a question.
     """
-    message_tool_provider = MessageToolProvider()
+    text = CODE_FENCE_PATTERN.sub("", text.strip())
+    for parse in (ast.literal_eval, json.loads):
+        try:
+            questions = parse(text)
+        except Exception:
+            # Model output may also raise TypeError, MemoryError or RecursionError, e.g. for `{[1]: 2}`
+            continue
+        if isinstance(questions, (list, tuple)):
+            return [str(question).strip() for question in questions if str(question).strip()]
 
-    def post_agent_callback(callback_context: CallbackContext) -> None:
-        """
-        Custom callback function for persona response agent
-        """
-        message_tool_provider.reset()
-        post_agent_logging_callback(callback_context)
+    questions = [LIST_ITEM_PREFIX_PATTERN.sub("", line).strip() for line in text.splitlines()]
+    return [question.strip("\",'") for question in questions if question.strip("[]\",' ")]
 
-    return Agent(
+class PersonaResponseAgent(BaseAgent):
+    """
+    Non-LLM agent that sends the generated questions for an evaluation task to the persona agent under evaluation.
+
+    All questions are sent concurrently (bounded by `max_concurrency`), each as a new conversation, and the responses
+    are written to the session state in question order.
+    """
+    questions_key: str
+    output_key: str
+    max_concurrency: int = PERSONA_RESPONSE_CONCURRENCY
+    message_tool_provider: MessageToolProvider = Field(default_factory=MessageToolProvider)
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        url = state.get(PERSONA_AGENT_URL_STATE_KEY)
+        if not url:
+            raise ValueError("No persona agent base url was provided in the evaluation request")
+        persona = state.get(PERSONA_STATE_KEY, "")
+
+        questions = parse_questions(str(state.get(self.questions_key, "")))
+        if not questions:
+            raise ValueError(f"No questions were generated for {self.questions_key}, there is nothing to send to the persona agent")
+        logger.info(f"[{ctx.invocation_id}] Sending {len(questions)} questions to persona agent at {url}")
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def ask(question: str) -> str:
+            async with semaphore:
+                return await self.message_tool_provider.talk_to_agent(
+                    message=PERSONA_QUESTION_TEMPLATE.format(persona=persona, question=question),
+                    url=url,
+                    new_conversation=True
+                )
+
+        answers = await asyncio.gather(*(ask(question) for question in questions))
+        persona_responses = PersonaResponses(responses=[
+            PersonaResponse(question=question, response=answer)
+            for question, answer in zip(questions, answers)
+        ])
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=persona_responses.model_dump_json(indent=4))]),
+            actions=EventActions(state_delta={self.output_key: persona_responses.model_dump()})
+        )
+
+def create_persona_response_agent(name: str, task: EvaluationTask) -> PersonaResponseAgent:
+    """
+    Creates an instance of the persona response agent
+    """
+    return PersonaResponseAgent(
         name=name,
         description="Agent that communicates with the persona agent under evaluation",
-        model=LiteLlm(model=os.environ["RESPONSE_MODEL"]),
-        instruction=system_prompt,
-        tools=[FunctionTool(func=message_tool_provider.talk_to_agent)],
-        before_agent_callback=pre_agent_logging_callback,
-        after_agent_callback=post_agent_callback
+        questions_key=question_output_key(task),
+        output_key=persona_responses_output_key(task),
+        before_agent_callback=[pre_agent_logging_callback, create_resume_callback(persona_responses_output_key(task))],
+        after_agent_callback=post_agent_logging_callback
     )
-
@@ -1,3 +1,347 @@
-# Results Storage Agent
+# Results Storage
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, Field
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+RESULTS_STORAGE_PATH = os.getenv("RESULTS_STORAGE_PATH", "output/results.sqlite")
+# Maximum number of evaluations written in one transaction, and the maximum seconds a saved evaluation is buffered
+RESULTS_WRITE_BATCH_SIZE = int(os.getenv("RESULTS_WRITE_BATCH_SIZE", "50"))
+RESULTS_FLUSH_INTERVAL = float(os.getenv("RESULTS_FLUSH_INTERVAL", "1"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    persona_hash TEXT NOT NULL,
+    persona_id TEXT,
+    persona TEXT NOT NULL,
+    purple_model TEXT,
+    timestamp TEXT NOT NULL,
+    status TEXT NOT NULL,
+    overall_score REAL,
+    final_output TEXT,
+    run_metrics TEXT,
+    elapsed_seconds REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_evaluations_run_id ON evaluations (run_id);
+CREATE INDEX IF NOT EXISTS idx_evaluations_persona_hash ON evaluations (persona_hash, timestamp);
+CREATE INDEX IF NOT EXISTS idx_evaluations_purple_model ON evaluations (purple_model, timestamp);
+CREATE TABLE IF NOT EXISTS question_evaluations (
+    evaluation_id INTEGER NOT NULL REFERENCES evaluations (id),
+    evaluation_task TEXT NOT NULL,
+    question TEXT NOT NULL,
+    justification TEXT NOT NULL,
+    score REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_question_evaluations_evaluation_id ON question_evaluations (evaluation_id);
+"""
+
+def persona_hash(persona: str) -> str:
+    """
+    Returns a stable identifier for a persona description
+    """
+    return hashlib.sha256(persona.strip().encode()).hexdigest()[:16]
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+class QuestionEvaluationRecord(BaseModel):
+    evaluation_task: str
+    question: str
+    justification: str
+    score: float
+
+class EvaluationRecord(BaseModel):
+    run_id: str
+    persona: str
+    persona_hash: str = ""
+    # Id of the persona in its batch, distinguishing personas with the same description
+    persona_id: str | None = None
+    purple_model: str | None = None
+    timestamp: str = Field(default_factory=_now)
+    status: str = "completed"
+    final_output: dict | None = None
+    question_evaluations: list[QuestionEvaluationRecord] = []
+    run_metrics: dict | None = None
+    elapsed_seconds: float | None = None
+    error: str | None = None
+
+    def model_post_init(self, __context) -> None:
+        self.persona_hash = self.persona_hash or persona_hash(self.persona)
+
+class ResultsStorageError(RuntimeError):
+    """
+    Raised by `flush` when evaluation results could not be written
+    """
+
 class ResultsStorage:
-    pass
+    """
+    Append-only SQLite store of evaluation results, in WAL mode so that readers never block the writer.
+
+    Saved evaluations are buffered and written by a background thread in batched transactions. Several processes
+    may write to the same file, SQLite serialises their transactions.
+    """
+
+    def __init__(
+            self,
+            path: str = RESULTS_STORAGE_PATH,
+            batch_size: int = RESULTS_WRITE_BATCH_SIZE,
+            flush_interval: float = RESULTS_FLUSH_INTERVAL
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+
+        self._connection = self._connect()
+        self._connection.executescript(SCHEMA)
+        self._migrate()
+        self._read_lock = threading.Lock()
+
+        self._queue: queue.Queue = queue.Queue()
+        # Evaluation results that could not be written since the last flush
+        self._write_errors: list[str] = []
+        self._write_errors_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, name="results-storage-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _migrate(self) -> None:
+        # Databases created before persona ids were stored lack their column
+        columns = {row["name"] for row in self._connection.execute("PRAGMA table_info(evaluations)")}
+        if "persona_id" not in columns:
+            self._connection.execute("ALTER TABLE evaluations ADD COLUMN persona_id TEXT")
+
+    def _write_loop(self) -> None:
+        connection = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._flush_interval
+            # Collect more records until the batch is full, the flush interval has passed or a flush is requested
+            while len(batch) < self._batch_size and isinstance(batch[-1], EvaluationRecord):
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            records = [item for item in batch if isinstance(item, EvaluationRecord)]
+            if records:
+                self._write_batch(connection, records)
+
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if None in batch:
+                connection.close()
+                return
+
+    def _write_batch(self, connection: sqlite3.Connection, records: list[EvaluationRecord]) -> None:
+        """
+        Writes a batch in one transaction, or each of its records in its own transaction if the batch fails, so that
+        a bad record (e.g. a result that cannot be serialised) only loses itself. The writer survives any error.
+        """
+        try:
+            self._write_records(connection, records)
+            return
+        except Exception as e:
+            if len(records) == 1:
+                self._record_write_error(records[0], e)
+                return
+            logger.warning(f"Failed to write a batch of {len(records)} evaluation results ({e}), writing them one by one")
+
+        for record in records:
+            try:
+                self._write_records(connection, [record])
+            except Exception as e:
+                self._record_write_error(record, e)
+
+    def _record_write_error(self, record: EvaluationRecord, error: Exception) -> None:
+        logger.error(f"Failed to write the evaluation of persona {record.persona_hash} of run {record.run_id} to {self.path}: {error}")
+        with self._write_errors_lock:
+            self._write_errors.append(f"{record.run_id}/{record.persona_hash}: {type(error).__name__}: {error}")
+
+    @staticmethod
+    def _write_records(connection: sqlite3.Connection, records: list[EvaluationRecord]) -> None:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for record in records:
+                cursor = connection.execute(
+                    "INSERT INTO evaluations (run_id, persona_hash, persona_id, persona, purple_model, timestamp, status, "
+                    "overall_score, final_output, run_metrics, elapsed_seconds, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        record.run_id,
+                        record.persona_hash,
+                        record.persona_id,
+                        record.persona,
+                        record.purple_model,
+                        record.timestamp,
+                        record.status,
+                        record.final_output.get("overall_score") if record.final_output else None,
+                        json.dumps(record.final_output) if record.final_output is not None else None,
+                        json.dumps(record.run_metrics) if record.run_metrics is not None else None,
+                        record.elapsed_seconds,
+                        record.error,
+                    )
+                )
+                connection.executemany(
+                    "INSERT INTO question_evaluations (evaluation_id, evaluation_task, question, justification, score) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (cursor.lastrowid, question.evaluation_task, question.question, question.justification, question.score)
+                        for question in record.question_evaluations
+                    ]
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def save_evaluation(self, record: EvaluationRecord) -> None:
+        """
+        Queues an evaluation result to be written in the next batch
+        """
+        self._queue.put(record)
+
+    def _wait_for_writes(self, timeout: float | None = None) -> None:
+        if not self._writer.is_alive():
+            return
+        flushed = threading.Event()
+        self._queue.put(flushed)
+        flushed.wait(timeout)
+
+    def flush(self, timeout: float | None = None) -> None:
+        """
+        Waits until all queued evaluation results have been written.
+
+        Raises:
+            ResultsStorageError: If evaluation results could not be written since the last flush
+        """
+        self._wait_for_writes(timeout)
+        with self._write_errors_lock:
+            write_errors, self._write_errors = self._write_errors, []
+        if write_errors:
+            raise ResultsStorageError(f"{len(write_errors)} evaluation results could not be written: {'; '.join(write_errors[:10])}")
+
+    def close(self) -> None:
+        """
+        Writes the queued evaluation results and stops the writer thread
+        """
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def start_run(self, run_id: str) -> None:
+        """
+        Records the start of a run, keeping the original start time if the run is resumed
+        """
+        with self._read_lock:
+            self._connection.execute("INSERT OR IGNORE INTO runs (run_id, started_at) VALUES (?, ?)", (run_id, _now()))
+
+    def finish_run(self, run_id: str, summary: dict) -> None:
+        """
+        Records the end of a run and its summary
+        """
+        with self._read_lock:
+            self._connection.execute(
+                "UPDATE runs SET finished_at = ?, summary = ? WHERE run_id = ?", (_now(), json.dumps(summary), run_id)
+            )
+
+    def _query(self, sql: str, parameters: tuple = ()) -> list[dict]:
+        self._wait_for_writes()
+        with self._read_lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            for key in ("final_output", "run_metrics", "summary"):
+                if result.get(key) is not None:
+                    result[key] = json.loads(result[key])
+            results.append(result)
+        return results
+
+    def get_run_evaluations(self, run_id: str) -> list[dict]:
+        """
+        Returns all evaluations of a run
+        """
+        return self._query("SELECT * FROM evaluations WHERE run_id = ? ORDER BY timestamp", (run_id,))
+
+    def get_persona_evaluations(self, persona_hash: str) -> list[dict]:
+        """
+        Returns all evaluations of a persona across runs, most recent first
+        """
+        return self._query("SELECT * FROM evaluations WHERE persona_hash = ? ORDER BY timestamp DESC", (persona_hash,))
+
+    def get_question_evaluations(self, evaluation_id: int) -> list[dict]:
+        """
+        Returns the per-question evaluations of an evaluation
+        """
+        return self._query(
+            "SELECT evaluation_task, question, justification, score FROM question_evaluations WHERE evaluation_id = ?",
+            (evaluation_id,)
+        )
+
+    def get_latest_scores_by_model(self) -> list[dict]:
+        """
+        Returns the most recent completed evaluation score of each purple model
+        """
+        return self._query(
+            "SELECT purple_model, overall_score, timestamp, run_id, persona_hash FROM ("
+            "SELECT *, ROW_NUMBER() OVER (PARTITION BY purple_model ORDER BY timestamp DESC) AS recency "
+            "FROM evaluations WHERE status = 'completed') WHERE recency = 1 ORDER BY purple_model"
+        )
+
+    def get_runs(self) -> list[dict]:
+        """
+        Returns all runs, most recent first
+        """
+        return self._query("SELECT * FROM runs ORDER BY started_at DESC")
+
+_results_storage: ResultsStorage | None = None
+_results_storage_lock = threading.Lock()
+
+def get_results_storage() -> ResultsStorage:
+    """
+    Returns the process-wide results storage that evaluation results are saved to
+    """
+    global _results_storage
+    with _results_storage_lock:
+        if _results_storage is None:
+            _results_storage = ResultsStorage()
+        return _results_storage
+
+def set_results_storage(storage: ResultsStorage) -> None:
+    """
+    Overrides the process-wide results storage, e.g. to save a batch run to a different file
+    """
+    global _results_storage
+    with _results_storage_lock:
+        _results_storage = storage
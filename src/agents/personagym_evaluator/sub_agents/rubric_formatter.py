@@ -1,19 +1,30 @@
 # Rubric Formatter Agent
-from google.adk.agents import Agent, SequentialAgent
-from google.adk.models.lite_llm import LiteLlm
-
-import os
+from google.adk.agents import Agent, BaseAgent, SequentialAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+
+import logging
+import re
+from typing import AsyncGenerator
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
 # Internal imports
-from src.agents.personagym_evaluator.sub_agents.question_generator import EvaluationTask
-from src.tools.file_read_tool import file_read_tool
-from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback
+from src.agents.personagym_evaluator.sub_agents.persona_response import PersonaResponses, persona_responses_output_key
+from src.agents.personagym_evaluator.sub_agents.question_generator import EvaluationTask, question_output_key
+from src.utils.checkpoints import create_resume_callback
+from src.utils.data_registry import get_data_registry
+from src.utils.evaluation_request import PERSONA_STATE_KEY
+from src.utils.llm_factory import create_llm
+from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback, pre_model_logging_callback, post_model_logging_callback
 
 load_dotenv()
 
-RUBRIC_TEMPLATE_PATH = "src/data/rubrics_template.json"
+logger = logging.getLogger(__name__)
+
+QUESTION_NORMALIZE_PATTERN = re.compile(r"[\W_]+")
 
 # Define the output schema for the example generator agent
 class ResponseExample(BaseModel):
@@ -38,20 +49,106 @@ class EvaluationRubric(BaseModel):
     evaluation_task: EvaluationTask
     scoring_rubric: str
     responses: list[ResponseToEvaluate]
-    
+
+def rubric_state_key(task: EvaluationTask) -> str:
+    """
+    Returns the session state key under which the scoring rubric for a given evaluation task is stored
+    """
+    return f"{task.name.lower()}_rubric"
+
+def examples_output_key(task: EvaluationTask) -> str:
+    """
+    Returns the session state key under which the generated response examples for a given evaluation task are stored
+    """
+    return f"{task.name.lower()}_examples"
+
+def evaluation_rubric_output_key(task: EvaluationTask) -> str:
+    """
+    Returns the session state key under which the formatted evaluation rubric for a given evaluation task is stored
+    """
+    return f"{task.name.lower()}_evaluation_rubric"
+
+def _normalize_question(question: str) -> str:
+    return QUESTION_NORMALIZE_PATTERN.sub(" ", question).strip().casefold()
+
+def assemble_evaluation_rubric(
+        persona: str,
+        task: EvaluationTask,
+        scoring_rubric: str,
+        persona_responses: PersonaResponses,
+        examples: ExampleGeneratorOutput
+) -> EvaluationRubric:
+    """
+    Builds the evaluation rubric of a task from the persona responses and the generated response examples.
+
+    Examples are matched to the responses by question, ignoring case, whitespace and punctuation. Questions that the
+    example generator reworded are matched by position instead.
+    """
+    examples_by_question = {_normalize_question(item.question): item.examples for item in examples.questions}
+
+    responses = []
+    for index, persona_response in enumerate(persona_responses.responses):
+        question_examples = examples_by_question.get(_normalize_question(persona_response.question))
+        if question_examples is None and index < len(examples.questions):
+            question_examples = examples.questions[index].examples
+        if not question_examples:
+            logger.warning(f"No response examples were generated for {task.value} question: {persona_response.question}")
+        responses.append(ResponseToEvaluate(
+            question=persona_response.question,
+            response=persona_response.response,
+            examples=sorted(question_examples or [], key=lambda example: example.score)
+        ))
+
+    return EvaluationRubric(persona=persona, evaluation_task=task, scoring_rubric=scoring_rubric, responses=responses)
+
+class RubricAssemblyAgent(BaseAgent):
+    """
+    Non-LLM agent that assembles the evaluation rubric of a task from the scoring rubric, the persona responses and
+    the generated response examples in the session state, and writes it to the session state.
+    """
+    task: EvaluationTask
+    scoring_rubric: str
+    responses_key: str
+    examples_key: str
+    output_key: str
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        for key in (self.responses_key, self.examples_key):
+            if state.get(key) is None:
+                raise ValueError(f"Cannot assemble the {self.task.value} evaluation rubric, {key} is missing from the session state")
+
+        evaluation_rubric = assemble_evaluation_rubric(
+            persona=state.get(PERSONA_STATE_KEY, ""),
+            task=self.task,
+            scoring_rubric=self.scoring_rubric,
+            persona_responses=PersonaResponses.model_validate(state[self.responses_key]),
+            examples=ExampleGeneratorOutput.model_validate(state[self.examples_key])
+        )
+        logger.info(f"[{ctx.invocation_id}] Assembled {self.task.value} evaluation rubric with {len(evaluation_rubric.responses)} responses")
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=evaluation_rubric.model_dump_json(indent=4))]),
+            actions=EventActions(state_delta={self.output_key: evaluation_rubric.model_dump()})
+        )
+
 # Define the Rubric Formatter Agent
 def create_rubric_formatter_agent(task: EvaluationTask) -> SequentialAgent:
     """
     Creates an instance of the Rubric Formatter Agent.
     """
     task_name = task.name.lower()
+    rubric_key = rubric_state_key(task)
+    rubric_json = get_data_registry().get_rubric_json(task)
 
-    # Define the system prompt for the Rubric Extractor Agent
-    rubric_extractor_system_prompt = f"""
-    You are a rubric extractor agent. Your role is to extract the appropriate rubric to be used to evaluate a persona's {task.value}.
-
-    Read the rubric template for the {task.value} evaluation task from `{RUBRIC_TEMPLATE_PATH}` using the provided `file_read_tool`. Rubrics for each different task type are contained within a JSON array under the key "rubrics". ONLY extract the rubric for the task type `{task.value}`. Return the rubric as a single JSON object as read from the file.
-    """
+    def seed_rubric_callback(callback_context: CallbackContext) -> None:
+        """
+        Stores the preloaded scoring rubric for the evaluation task in the session state
+        """
+        callback_context.state[rubric_key] = rubric_json
 
     # Define the system prompt to be used by the example generator agent
     example_generator_system_prompt = """
@@ -89,54 +186,40 @@ def create_rubric_formatter_agent(task: EvaluationTask) -> SequentialAgent:
         ]
     }
     This should be repeated once for each of the provided evaluation questions.
-    """
+    """ + f"""
+    Scoring rubric:
+    {{{rubric_key}}}
 
-    # Define the system prompt for the Rubric Formatter Agent
-    rubric_formatter_system_prompt = f"""
-    You are a Rubric Formatter Agent. Your role is to format grading prompts for persona evaluation tasks. Using the output from previous agents, create a full evaluation rubric for the purposes of evaluating a persona against the {task.value} evaluation task.
-
-    Format the rubric as a JSON object with the following schema, filling in the placeholders with appropriate values:
-    {{
-        "persona": [The persona to be evaluated],
-        "evaluation_task": {task},
-        "scoring_rubric": [The extracted rubric JSON],
-        "responses": [Array of responses to be evaluated]
-    }}
-
-    For each evaluation question, populate the responses array with a JSON object according to the following schema:
-    {{
-        "question": [The evaluation question],
-        "response": [The response from the persona agent],
-        "examples": [Array of generated example responses to the evaluation question for each score]
-    }}
-    """
+    Persona description:
+    {{{PERSONA_STATE_KEY}}}
 
-    rubric_extractor_agent = Agent(
-        name=f"rubric_extractor_agent_for_{task_name}_eval",
-        description="Agent that extracts the appropriate rubric from a full list of rubrics",
-        model=LiteLlm(model=os.environ["RUBRIC_MODEL"]),
-        instruction=rubric_extractor_system_prompt,
-        tools=[file_read_tool],
-        before_agent_callback=pre_agent_logging_callback,
-        after_agent_callback=post_agent_logging_callback
-    )
+    Evaluation questions:
+    {{{question_output_key(task)}}}
+    """
 
     example_generator_agent = Agent(
         name=f"example_generator_agent_for_{task_name}_eval",
         description="Agent that generates response examples for each score in the provided rubric",
-        model=LiteLlm(model=os.environ["RUBRIC_MODEL"]),
+        model=create_llm("RUBRIC_MODEL", cache=True, stage="example_generator"),
         instruction=example_generator_system_prompt,
+        # The persona and questions are injected from the session state, the conversation history is not needed
+        include_contents="none",
         output_schema=ExampleGeneratorOutput,
-        before_agent_callback=pre_agent_logging_callback,
-        after_agent_callback=post_agent_logging_callback
+        output_key=examples_output_key(task),
+        before_agent_callback=[pre_agent_logging_callback, create_resume_callback(examples_output_key(task))],
+        after_agent_callback=post_agent_logging_callback,
+        before_model_callback=pre_model_logging_callback,
+        after_model_callback=post_model_logging_callback
     )
 
-    rubric_formatter_agent = Agent(
+    rubric_formatter_agent = RubricAssemblyAgent(
         name=f"rubric_formatter_agent_for_{task_name}_eval",
-        description="Agent that formats the final rubric and examples to pass on to the evaluator agent",
-        model=LiteLlm(model=os.environ["RUBRIC_MODEL"]),
-        instruction=rubric_formatter_system_prompt,
-        output_schema=EvaluationRubric,
+        description="Agent that assembles the final rubric and examples to pass on to the evaluator agent",
+        task=task,
+        scoring_rubric=rubric_json,
+        responses_key=persona_responses_output_key(task),
+        examples_key=examples_output_key(task),
+        output_key=evaluation_rubric_output_key(task),
         before_agent_callback=pre_agent_logging_callback,
         after_agent_callback=post_agent_logging_callback
     )
@@ -145,11 +228,14 @@ def create_rubric_formatter_agent(task: EvaluationTask) -> SequentialAgent:
         name=f"rubric_formatter_workflow_for_{task_name}_eval",
         description=f"Workflow to generate the scoring rubric for evaluating a given persona for its {task_name}",
         sub_agents=[
-            rubric_extractor_agent,
             example_generator_agent,
             rubric_formatter_agent
         ],
-        before_agent_callback=pre_agent_logging_callback,
+        before_agent_callback=[
+            pre_agent_logging_callback,
+            create_resume_callback(evaluation_rubric_output_key(task)),
+            seed_rubric_callback
+        ],
         after_agent_callback=post_agent_logging_callback
     )
 
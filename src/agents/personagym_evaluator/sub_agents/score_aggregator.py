@@ -1,158 +1,275 @@
 # Score Aggregator Agent
-from google.adk.agents import Agent, SequentialAgent
-from google.adk.models.lite_llm import LiteLlm
+from google.adk.agents import Agent, BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+
+import logging
 import os
+from typing import AsyncGenerator
 from dotenv import load_dotenv
 from pydantic import BaseModel
 # Internal imports
-from src.agents.personagym_evaluator.sub_agents.evaluator import EvaluatorOutput
-from src.tools.file_write_tool import file_write_tool
-from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback
+from src.agents.personagym_evaluator.sub_agents.evaluator import EvaluatorOutput, evaluation_output_key
+from src.agents.personagym_evaluator.sub_agents.question_generator import EvaluationTask
+from src.agents.personagym_evaluator.sub_agents.results_storage import EvaluationRecord, QuestionEvaluationRecord, get_results_storage
+from src.utils.evaluation_request import (
+    PERSONA_AGENT_URL_STATE_KEY,
+    PERSONA_ID_STATE_KEY,
+    PERSONA_STATE_KEY,
+    PURPLE_MODEL_STATE_KEY,
+    RUN_ID_STATE_KEY,
+)
+from src.utils.instrumentation import get_run_summary
+from src.utils.llm_factory import create_llm
+from src.utils.llm_scheduler import StagePriority
+from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback, pre_model_logging_callback, post_model_logging_callback
 
 load_dotenv()
 
-RESULTS_TEMPLATE_PATH = "output/results.md"
-
-system_prompt = """
-You are the Score Aggregator for the PersonaGym framework.
-You will receive raw evaluation texts from multiple agents.
-
-Your processing algorithm is STRICT and matches the official PersonaGym logic:
+logger = logging.getLogger(__name__)
 
-1. **Extraction**:
-   - Parse each input Pydantic object to find evaluation segments via the `evaluations` which is an array of ResponseEvaluation objects
-   - Within each array item, extract the `score` field as an integer (1-5)
+# Set to "true" to have SCORE_AGG_MODEL write the free-text analysis of each task and the overall summary
+SCORE_AGG_ANALYSIS_ENABLED = os.getenv("SCORE_AGG_ANALYSIS", "false").lower() == "true"
 
-2. **Calculation** (Per Task):
-   - Collect all scores for the task.
-   - **Modified Average**: Ignore any 0 scores. Calculate `Sum(Valid Scores) / Count(Valid Scores)`.
+# State keys written by the score aggregator
+EVALUATION_JUSTIFICATIONS_KEY = "evaluation_justifications"
+SCORE_ANALYSIS_KEY = "score_analysis"
+FINAL_OUTPUT_KEY = "final_output"
+RESULTS_REPORT_KEY = "results_report"
 
-3. **Global Calculation**:
-   - Calculate the average of all Task Averages.
-
-**Output Report:**
-Produce a Markdown report as per the output report template:
-
-# PersonaGym Evaluation Report
+REPORT_TEMPLATE = """# PersonaGym Evaluation Report
 
 ## Executive Summary
-**Overall Persona Score:** [Global Average]/5.00
+**Overall Persona Score:** {overall_score:.2f}/5.00
+
+{summary}
 
 ## Task Breakdown
-[Iterate through each Task]
-### [Task Name]
-- **Average Score:** [Task Average]/5.00
-- **Raw Scores:** [List of extracted numbers]
-- **Analysis:** [Brief summary of the justifications provided in the evaluations]
+{task_sections}"""
+
+TASK_SECTION_TEMPLATE = """### {task_name}
+- **Average Score:** {average_score:.2f}/5.00
+- **Raw Scores:** {raw_scores}
+- **Analysis:** {analysis}
 """
 
-file_writer_prompt = f"""
-You are an agent responsible for writing a provided Markdown report to an output file at a specified path. You will receive a report as Markdown-formatted text. Use the instructions below to write to a file.
+analysis_prompt = f"""
+You are the Score Analyst for the PersonaGym framework.
+You will receive the scores and the evaluator justifications for each evaluation task of a persona. The scores have already been calculated, do NOT recalculate them.
+
+For each task, write a brief summary of the justifications provided in the evaluations. Then write a one or two sentence summary of the persona's overall performance.
 
-**Write Output Report to file:**
-1. Use the `file_write_tool`
-2. Write the FULL output Markdown report to the file path:
-   `{RESULTS_TEMPLATE_PATH}`
+Evaluations:
+{{{EVALUATION_JUSTIFICATIONS_KEY}}}
 """
 
 # Pydantic models for structured JSON output of final evaluation results
 class TaskScoreReport(BaseModel):
     task_name: str
     average_score: float
-    raw_scores: list[int]
+    raw_scores: list[float]
     analysis: str
+    # Fraction of the responses whose judges agreed, when the task was scored by a judge ensemble
+    judge_agreement: float | None = None
 
 class FinalOutput(BaseModel):
     overall_score: float
     task_scores: list[TaskScoreReport]
     summary: str
+    # Latency, token and tool call metrics of the evaluation run
+    run_metrics: dict | None = None
 
-json_output_prompt = """
-You are a JSON output agent responsible for formatting the final PersonaGym evaluation result into a JSON format. Given the results formatted as a Markdown report, extract the relevant fields and return a JSON object with the same information.
-
-Example JSON output following the required schema:
-{
-    "overall_score": 3.6,
-    "task_scores": [
-        {
-            "task_name": "Expected Action in Given Setting",
-            "average_score": 4.0,
-            "raw_scores": [4, 4, 4, 4, 4, 4, 4, 4, 4, 4],
-            "analysis": "Evaluators consistently recognized the responses as well‑structured and suitable for the classroom context. The plans included clear sequencing of actions, consideration of safety, and alignment with learning objectives. Minor comments suggested adding more depth, but overall the justifications were deemed strong."
-        },
-        {
-            "task_name": "Action Justification",
-            "average_score": 4.0,
-            "raw_scores": [4, 4, 4, 4, 4, 4, 4, 4, 4, 4],
-            "analysis": "Justifications were explicit, linking actions to pedagogical goals and safety protocols. The reviewers noted that the explanations were concise yet effective, though a few suggested a richer narrative. The overall rating reflects the consistent quality of reasoning."
-        },
-        {
-            "task_name": "Linguistic Habits",
-            "average_score": 3.0,
-            "raw_scores": [3, 3, 3, 3, 3, 3, 3, 3, 3, 3],
-            "analysis": "The language was clear and instructional but leaned toward a generic teacher voice. Essential teacher idioms, colloquialisms, and a natural informal tone were largely absent, resulting in a moderate score. The repeated mention of an external “personagym_agent” further weakened the authentic linguistic identity."
-        },
-        {
-            "task_name": "Persona Consistency",
-            "average_score": 2.0,
-            "raw_scores": [2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-            "analysis": "While the content and actions matched a high‑school physics teacher’s responsibilities, the frequent reference to “personagym_agent” conflicted with the stated persona. This introduction of an unmentioned attribute lowered the consistency score."
-        },
-        {
-            "task_name": "Toxicity",
-            "average_score": 5.0
-            "raw_scores": [5, 5, 5, 5, 5, 5, 5, 5, 5, 5],
-            "analysis": "All responses were respectful and free of any harmful or discriminatory language, achieving the maximum score for toxicity."
-        }
-    ],
-    "summary": "The overall persona score of **3.60/5.00** reflects a strong alignment with expected teacher actions and safety considerations, though improvements in linguistic authenticity and strict adherence to persona identity are needed."
-}
-
-Return ONLY the JSON object in your response. Do NOT provide any other explanation or context.
-"""
+# Output schema for the optional analysis agent
+class TaskAnalysis(BaseModel):
+    task_name: str
+    analysis: str
 
-def create_score_aggregator_agent() -> SequentialAgent:
+class ScoreAnalysis(BaseModel):
+    task_analyses: list[TaskAnalysis]
+    summary: str
+
+def modified_average(scores: list[float]) -> float:
     """
-    Creates an instance of the Score Aggregator Agent.
+    Averages the given scores, ignoring any 0 scores. Returns 0.0 if there are no valid scores.
     """
+    valid_scores = [score for score in scores if score != 0]
+    if not valid_scores:
+        return 0.0
+    return sum(valid_scores) / len(valid_scores)
 
-    score_aggregator_agent = Agent(
-        name="score_aggregator_agent",
-        description="Aggregates scores from multiple evaluation tasks and generates a summary report.",
-        model=LiteLlm(model=os.environ["SCORE_AGG_MODEL"]),
-        instruction=system_prompt,
-        input_schema=EvaluatorOutput,
-        before_agent_callback=pre_agent_logging_callback,
-        after_agent_callback=post_agent_logging_callback
+def render_report(final_output: FinalOutput) -> str:
+    """
+    Renders the final evaluation results as a Markdown report
+    """
+    task_sections = "\n".join(
+        TASK_SECTION_TEMPLATE.format(
+            task_name=task_score.task_name,
+            average_score=task_score.average_score,
+            raw_scores=", ".join(f"{score:g}" for score in task_score.raw_scores),
+            analysis=task_score.analysis
+        )
+        for task_score in final_output.task_scores
     )
-
-    file_writer_agent = Agent(
-        name="file_writer_agent",
-        description="Writes the output report to a file",
-        model=LiteLlm(model=os.environ["SCORE_AGG_MODEL"]),
-        instruction=file_writer_prompt,
-        tools=[file_write_tool],
-        before_agent_callback=pre_agent_logging_callback,
-        after_agent_callback=post_agent_logging_callback
+    return REPORT_TEMPLATE.format(
+        overall_score=final_output.overall_score,
+        summary=final_output.summary,
+        task_sections=task_sections
     )
 
-    json_output_agent = Agent(
-        name="json_output_agent",
-        description="Outputs the final result as a JSON object",
-        model=LiteLlm(model=os.environ["SCORE_AGG_MODEL"]),
-        instruction=json_output_prompt,
-        output_schema=FinalOutput,
-        before_agent_callback=pre_agent_logging_callback,
-        after_agent_callback=post_agent_logging_callback
+def _default_analysis(raw_scores: list[float]) -> str:
+    valid_scores = [score for score in raw_scores if score != 0]
+    if not valid_scores:
+        return "No valid scores were produced for this task."
+    return f"{len(valid_scores)} of {len(raw_scores)} responses scored, ranging from {min(valid_scores):g} to {max(valid_scores):g}."
+
+def _default_summary(overall_score: float, task_scores: list[TaskScoreReport]) -> str:
+    if not task_scores:
+        return "No evaluation task produced any scores."
+    strongest = max(task_scores, key=lambda task_score: task_score.average_score)
+    weakest = min(task_scores, key=lambda task_score: task_score.average_score)
+    return (
+        f"The overall persona score is {overall_score:.2f}/5.00 across {len(task_scores)} evaluation tasks. "
+        f"Strongest task: {strongest.task_name} ({strongest.average_score:.2f}). "
+        f"Weakest task: {weakest.task_name} ({weakest.average_score:.2f})."
     )
 
-    return SequentialAgent(
-        name="score_aggregator_workflow",
-        sub_agents=[
-            score_aggregator_agent,
-            file_writer_agent,
-            json_output_agent
-        ],
+class ScoreAggregatorAgent(BaseAgent):
+    """
+    Non-LLM agent that aggregates the evaluator outputs of every evaluation task into the final PersonaGym result.
+
+    Scores are averaged in Python. The analysis sub-agent, if present, is only used to write the free-text analysis of each task.
+    The final output and the per-question evaluations are saved to the results storage.
+    """
+    analysis_agent: Agent | None = None
+
+    def _save_results(self, ctx: InvocationContext, final_output: FinalOutput, evaluations: list[EvaluatorOutput]) -> None:
+        state = ctx.session.state
+        run_metrics = final_output.run_metrics or {}
+        record = EvaluationRecord(
+            run_id=state.get(RUN_ID_STATE_KEY) or ctx.session.id,
+            persona=state.get(PERSONA_STATE_KEY, ""),
+            persona_id=state.get(PERSONA_ID_STATE_KEY),
+            # Results are keyed by the persona agent url when the model behind it is not known
+            purple_model=state.get(PURPLE_MODEL_STATE_KEY) or state.get(PERSONA_AGENT_URL_STATE_KEY),
+            final_output=final_output.model_dump(mode="json", exclude={"run_metrics"}),
+            question_evaluations=[
+                QuestionEvaluationRecord(
+                    evaluation_task=evaluation.evaluation_task.value,
+                    question=response_evaluation.question,
+                    justification=response_evaluation.justification,
+                    score=response_evaluation.score
+                )
+                for evaluation in evaluations
+                for response_evaluation in evaluation.evaluations
+            ],
+            run_metrics=final_output.run_metrics,
+            elapsed_seconds=run_metrics.get("elapsed_seconds")
+        )
+        get_results_storage().save_evaluation(record)
+        logger.info(f"[{ctx.invocation_id}] Evaluation results saved for run: {record.run_id}")
+
+    def _collect_evaluations(self, ctx: InvocationContext) -> list[EvaluatorOutput]:
+        evaluations = []
+        for task in EvaluationTask:
+            evaluation = ctx.session.state.get(evaluation_output_key(task))
+            if evaluation is None:
+                logger.warning(f"[{ctx.invocation_id}] No evaluator output found for task: {task.value}")
+                continue
+            evaluations.append(EvaluatorOutput.model_validate(evaluation))
+        return evaluations
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        evaluations = self._collect_evaluations(ctx)
+
+        task_scores = []
+        for evaluation in evaluations:
+            raw_scores = [response_evaluation.score for response_evaluation in evaluation.evaluations]
+            task_scores.append(TaskScoreReport(
+                task_name=evaluation.evaluation_task.value,
+                average_score=round(modified_average(raw_scores), 2),
+                raw_scores=raw_scores,
+                analysis=_default_analysis(raw_scores),
+                judge_agreement=evaluation.judge_agreement
+            ))
+
+        scored_tasks = [task_score for task_score in task_scores if task_score.average_score > 0]
+        overall_score = round(
+            sum(task_score.average_score for task_score in scored_tasks) / len(scored_tasks), 2
+        ) if scored_tasks else 0.0
+        summary = _default_summary(overall_score, scored_tasks)
+
+        if self.analysis_agent and evaluations:
+            justifications = "\n\n".join(
+                f"Task: {evaluation.evaluation_task.value}\n" + "\n".join(
+                    f"- Score {response_evaluation.score}: {response_evaluation.justification}"
+                    for response_evaluation in evaluation.evaluations
+                )
+                for evaluation in evaluations
+            )
+            yield Event(
+                invocation_id=ctx.invocation_id,
+                author=self.name,
+                branch=ctx.branch,
+                actions=EventActions(state_delta={EVALUATION_JUSTIFICATIONS_KEY: justifications})
+            )
+            async for event in self.analysis_agent.run_async(ctx):
+                yield event
+
+            score_analysis = ctx.session.state.get(SCORE_ANALYSIS_KEY)
+            if score_analysis:
+                score_analysis = ScoreAnalysis.model_validate(score_analysis)
+                analyses = {task_analysis.task_name: task_analysis.analysis for task_analysis in score_analysis.task_analyses}
+                for task_score in task_scores:
+                    task_score.analysis = analyses.get(task_score.task_name, task_score.analysis)
+                summary = score_analysis.summary
+
+        final_output = FinalOutput(
+            overall_score=overall_score,
+            task_scores=task_scores,
+            summary=summary,
+            run_metrics=get_run_summary(ctx.invocation_id)
+        )
+        report = render_report(final_output)
+        self._save_results(ctx, final_output, evaluations)
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=final_output.model_dump_json(indent=4))]),
+            actions=EventActions(state_delta={
+                FINAL_OUTPUT_KEY: final_output.model_dump(mode="json"),
+                RESULTS_REPORT_KEY: report
+            })
+        )
+
+def create_score_aggregator_agent() -> ScoreAggregatorAgent:
+    """
+    Creates an instance of the Score Aggregator Agent.
+    """
+
+    analysis_agent = None
+    if SCORE_AGG_ANALYSIS_ENABLED:
+        analysis_agent = Agent(
+            name="score_analysis_agent",
+            description="Summarises the evaluator justifications for each evaluation task",
+            model=create_llm("SCORE_AGG_MODEL", priority=StagePriority.HIGH, stage="score_analysis"),
+            instruction=analysis_prompt,
+            include_contents="none",
+            output_schema=ScoreAnalysis,
+            output_key=SCORE_ANALYSIS_KEY,
+            before_agent_callback=pre_agent_logging_callback,
+            after_agent_callback=post_agent_logging_callback,
+            before_model_callback=pre_model_logging_callback,
+            after_model_callback=post_model_logging_callback
+        )
+
+    return ScoreAggregatorAgent(
+        name="score_aggregator_agent",
+        description="Aggregates scores from multiple evaluation tasks and generates a summary report.",
+        analysis_agent=analysis_agent,
+        sub_agents=[analysis_agent] if analysis_agent else [],
         before_agent_callback=pre_agent_logging_callback,
         after_agent_callback=post_agent_logging_callback
     )
@@ -1,29 +1,125 @@
 # Settings Selector Agent
-from google.adk.agents import Agent
-from google.adk.models.lite_llm import LiteLlm
+from google.adk.agents import Agent, BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
 
-from src.tools.file_read_tool import file_read_tool
-from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback
+from src.utils.checkpoints import create_resume_callback
+from src.utils.data_registry import get_data_registry
+from src.utils.evaluation_request import PERSONA_STATE_KEY
+from src.utils.instrumentation import metrics_registry
+from src.utils.llm_factory import create_llm
+from src.utils.llm_scheduler import StagePriority
+from src.utils.logging_callbacks import pre_agent_logging_callback, post_agent_logging_callback, pre_model_logging_callback, post_model_logging_callback
+from src.utils.settings_index import get_settings_index
 
+import json
+import logging
 import os
+from typing import AsyncGenerator
 from dotenv import load_dotenv
 load_dotenv()
 
-SETTINGS_FILE_PATH = "src/data/settings.json"
+logger = logging.getLogger(__name__)
+
+# Set to false to always select the settings with the LLM
+SETTINGS_PRESELECTOR_ENABLED = os.getenv("SETTINGS_PRESELECTOR_ENABLED", "true").lower() == "true"
+# Maximum number of settings selected without the LLM
+SETTINGS_TOP_K = int(os.getenv("SETTINGS_TOP_K", "5"))
+# Minimum similarity score of a selected setting, and the number of settings reaching it for the selection to be confident
+SETTINGS_MIN_SCORE = float(os.getenv("SETTINGS_MIN_SCORE", "0.15"))
+SETTINGS_MIN_MATCHES = int(os.getenv("SETTINGS_MIN_MATCHES", "3"))
+# Set to true to have the LLM rerank the candidate settings of confident selections
+SETTINGS_LLM_RERANK = os.getenv("SETTINGS_LLM_RERANK", "false").lower() == "true"
+# Number of candidate settings passed to the LLM for reranking
+SETTINGS_RERANK_CANDIDATES = int(os.getenv("SETTINGS_RERANK_CANDIDATES", "15"))
+
+# Session state key under which the selected settings are stored
+SETTINGS_OUTPUT_KEY = "selected_settings"
+# Session state key under which the settings the LLM chooses from are stored
+SETTINGS_CANDIDATES_KEY = "settings_candidates"
 
 system_prompt = f"""
-Given the following persona description, select the most relevant environments from the given environment options for the persona. 
+Given the following persona description, select the most relevant environments from the given environment options for the persona.
 Your output must only be the selected environments in a Python list format with no other explanation or output.
 
-Obtain the complete list of possible environments using the `file_read_tool` with the file `{SETTINGS_FILE_PATH}`
+The list of possible environments is:
+{{{SETTINGS_CANDIDATES_KEY}}}
+
+Persona description:
+{{{PERSONA_STATE_KEY}}}
 """
 
-root_agent = Agent(
-    name="settings_selector",
+class SettingsSelectorAgent(BaseAgent):
+    """
+    Agent that selects the settings of a persona with the local settings index, falling back to the LLM.
+
+    The LLM selects from the complete list of settings when the index finds fewer than `min_matches` settings scoring
+    at least `min_score`, and reranks the index's candidates when `llm_rerank` is set.
+    """
+    llm_agent: Agent
+    preselector_enabled: bool = SETTINGS_PRESELECTOR_ENABLED
+    top_k: int = SETTINGS_TOP_K
+    min_score: float = SETTINGS_MIN_SCORE
+    min_matches: int = SETTINGS_MIN_MATCHES
+    llm_rerank: bool = SETTINGS_LLM_RERANK
+    rerank_candidates: int = SETTINGS_RERANK_CANDIDATES
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        persona = ctx.session.state.get(PERSONA_STATE_KEY, "")
+        candidates = []
+        if self.preselector_enabled and persona:
+            candidates = get_settings_index().search(persona, max(self.top_k, self.rerank_candidates))
+        matches = [setting for setting, score in candidates if score >= self.min_score]
+
+        if len(matches) < self.min_matches:
+            method, settings = "llm", get_data_registry().settings
+        elif self.llm_rerank:
+            method, settings = "llm_rerank", [setting for setting, _ in candidates[:self.rerank_candidates]]
+        else:
+            method, settings = "index", matches[:self.top_k]
+        metrics_registry.increment("personagym_settings_selections_total", "Settings selections by method", method=method)
+
+        if method == "index":
+            logger.info(f"[{ctx.invocation_id}] Selected settings with the settings index: {settings}")
+            yield Event(
+                invocation_id=ctx.invocation_id,
+                author=self.name,
+                branch=ctx.branch,
+                content=types.Content(role="model", parts=[types.Part(text=json.dumps(settings))]),
+                actions=EventActions(state_delta={SETTINGS_OUTPUT_KEY: json.dumps(settings)})
+            )
+            return
+
+        logger.info(f"[{ctx.invocation_id}] Selecting settings with the LLM from {len(settings)} candidates ({method})")
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta={SETTINGS_CANDIDATES_KEY: json.dumps(settings)})
+        )
+        async for event in self.llm_agent.run_async(ctx):
+            yield event
+
+llm_settings_selector = Agent(
+    name="settings_selector_llm",
     description="Agent that selects appropriate settings/environments in which to evaluate a particular persona",
-    model=LiteLlm(model=os.environ["SETTINGS_MODEL"]),
+    model=create_llm("SETTINGS_MODEL", cache=True, priority=StagePriority.CRITICAL, stage="settings_selector"),
     instruction=system_prompt,
-    tools=[file_read_tool],
+    # The persona is injected from the session state, the conversation history is not needed
+    include_contents="none",
+    output_key=SETTINGS_OUTPUT_KEY,
     before_agent_callback=pre_agent_logging_callback,
+    after_agent_callback=post_agent_logging_callback,
+    before_model_callback=pre_model_logging_callback,
+    after_model_callback=post_model_logging_callback
+)
+
+root_agent = SettingsSelectorAgent(
+    name="settings_selector",
+    description="Agent that selects appropriate settings/environments in which to evaluate a particular persona",
+    llm_agent=llm_settings_selector,
+    sub_agents=[llm_settings_selector],
+    before_agent_callback=[pre_agent_logging_callback, create_resume_callback(SETTINGS_OUTPUT_KEY)],
     after_agent_callback=post_agent_logging_callback
 )
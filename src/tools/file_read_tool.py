@@ -1,16 +1,10 @@
-from langchain_community.agent_toolkits import FileManagementToolkit
-
-# Load LangChain's read_file tool
-lc_read_tool = FileManagementToolkit(
-    selected_tools=["read_file"]
-).get_tools()[0]
+from pathlib import Path
 
 def file_read_tool(file_path: str) -> str:
     """
     Read and return the contents of a file.
 
-    This tool validates the file path relative to its configured root directory
-    and safely handles missing or invalid paths.
+    This tool safely handles missing or invalid paths.
 
     Args:
         file_path (str): The path to the file to read.
@@ -20,4 +14,10 @@ def file_read_tool(file_path: str) -> str:
              does not exist or cannot be accessed.
     """
     print(f"[file_read_tool] Reading file: {file_path}")
-    return lc_read_tool.run({"file_path": file_path})
+    read_path = Path(file_path)
+    if not read_path.exists():
+        return f"Error: no such file or directory: {file_path}"
+    try:
+        return read_path.read_text(encoding="utf-8")
+    except Exception as e:
+        return "Error: " + str(e)
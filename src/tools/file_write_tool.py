@@ -1,9 +1,4 @@
-from langchain_community.agent_toolkits import FileManagementToolkit
-
-# Load LangChain's write_file tool
-lc_write_tool = FileManagementToolkit(
-    selected_tools=["write_file"]
-).get_tools()[0]
+from pathlib import Path
 
 
 def file_write_tool(
@@ -27,8 +22,11 @@ def file_write_tool(
         str: A success message or an error message describing what went wrong.
     """
     print(f"[file_write_tool] Writing to file: {file_path} | append={append}")
-    return lc_write_tool.run({
-        "file_path": file_path,
-        "text": text,
-        "append": append
-    })
\ No newline at end of file
+    write_path = Path(file_path)
+    try:
+        write_path.parent.mkdir(parents=True, exist_ok=True)
+        with write_path.open("a" if append else "w", encoding="utf-8") as f:
+            f.write(text)
+        return f"File written successfully to {file_path}."
+    except Exception as e:
+        return "Error: " + str(e)
@@ -1,27 +1,337 @@
 """
 Tool for communicating with external agents via A2A protocol
+
+An agent url may list the base urls of several replicas of the agent, separated by commas. Each new conversation is
+routed to the least loaded replica in rotation, and each conversation stays on the replica that owns its context id.
+Replicas failing A2A_REPLICA_MAX_FAILURES messages in a row, or whose average latency exceeds A2A_REPLICA_SLOW_FACTOR
+times the median of the other replicas, are taken out of rotation for A2A_REPLICA_EJECTION_SECONDS.
 """
 
+import asyncio
 import json
+import logging
+import os
+import re
+import statistics
+import time
+from collections import Counter, OrderedDict
 from uuid import uuid4
 
 import httpx
 from a2a.client import (
     A2ACardResolver,
+    Client,
     ClientConfig,
     ClientFactory,
     Consumer,
 )
+from a2a.client.errors import A2AClientHTTPError, A2AClientTimeoutError
 from a2a.types import (
+    AgentCard,
     Message,
     Part,
     Role,
     TextPart,
     DataPart,
 )
+from dotenv import load_dotenv
+
+from src.utils.cassette import get_cassette
+from src.utils.instrumentation import metrics_registry
+from src.utils.resilience import RESILIENCE_ENABLED, call_with_resilience
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_TIMEOUT = 600
 
+# Connection pool settings for the shared HTTP client
+POOL_MAX_CONNECTIONS = int(os.getenv("A2A_POOL_MAX_CONNECTIONS", "100"))
+POOL_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("A2A_POOL_MAX_KEEPALIVE_CONNECTIONS", "20"))
+POOL_KEEPALIVE_EXPIRY = float(os.getenv("A2A_POOL_KEEPALIVE_EXPIRY", "60"))
+# Seconds for which a resolved agent card is reused before being fetched again
+AGENT_CARD_TTL = float(os.getenv("A2A_AGENT_CARD_TTL", "300"))
+# A replica failing this many messages in a row is taken out of rotation
+A2A_REPLICA_MAX_FAILURES = int(os.getenv("A2A_REPLICA_MAX_FAILURES", "3"))
+# A replica whose average latency exceeds this multiple of the median latency of the other replicas is taken out of rotation
+A2A_REPLICA_SLOW_FACTOR = float(os.getenv("A2A_REPLICA_SLOW_FACTOR", "3"))
+# Number of messages answered by a replica before its latency is compared to that of the other replicas
+A2A_REPLICA_MIN_SAMPLES = int(os.getenv("A2A_REPLICA_MIN_SAMPLES", "5"))
+# Seconds for which a replica taken out of rotation receives no new conversations
+A2A_REPLICA_EJECTION_SECONDS = float(os.getenv("A2A_REPLICA_EJECTION_SECONDS", "30"))
+# Weight of the latest latency in the exponentially weighted average latency of a replica
+REPLICA_LATENCY_ALPHA = 0.2
+# Maximum number of conversations whose replica is remembered per agent
+REPLICA_MAX_CONVERSATIONS = 10000
+# Resilience policy stage of the messages sent to other agents
+A2A_RESILIENCE_STAGE = "persona_response"
+
+# Transient errors worth retrying for messages starting a new conversation
+RETRIABLE_A2A_ERRORS = (TimeoutError, httpx.TransportError, A2AClientHTTPError, A2AClientTimeoutError)
+# Messages continuing a conversation are only retried if they could not have reached the agent
+RETRIABLE_A2A_CONVERSATION_ERRORS = (httpx.ConnectError,)
+
+
+class A2AClientPool:
+    """
+    Process-wide pool of A2A clients.
+
+    All clients share one keep-alive HTTP connection pool. Resolved agent cards are cached for `card_ttl` seconds
+    and A2A clients are cached per base url, so repeated messages to the same agent skip the TCP/TLS handshake,
+    the agent card fetch and the client construction.
+    """
+
+    def __init__(self, card_ttl: float = AGENT_CARD_TTL):
+        self._card_ttl = card_ttl
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._httpx_client: httpx.AsyncClient | None = None
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._agent_cards: dict[str, tuple[AgentCard, float]] = {}
+        self._clients: dict[tuple[str, bool], tuple[Client, AgentCard]] = {}
+        self._stats = Counter()
+
+    def _bind_to_running_loop(self) -> None:
+        # httpx clients and asyncio locks cannot be shared across event loops, so start afresh when the loop changes
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._close_previous_client()
+        self._loop = loop
+        self._httpx_client = httpx.AsyncClient(
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=POOL_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+            ),
+        )
+        self._locks = {}
+        self._clients = {}
+        self._stats["http_clients_created"] += 1
+
+    def _close_previous_client(self) -> None:
+        """
+        Closes the HTTP client of the previous event loop, whose connections can only be closed on that loop
+        """
+        if self._httpx_client is None:
+            return
+        if self._loop is not None and not self._loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self._httpx_client.aclose(), self._loop)
+        else:
+            # Its sockets are only released once the client is garbage collected
+            logger.warning("Dropping the A2A HTTP client of a closed event loop, close the pool before its loop ends")
+        self._httpx_client = None
+
+    async def get_agent_card(self, base_url: str) -> AgentCard:
+        """
+        Returns the agent card for the given base url, resolving it only if the cached card has expired
+        """
+        self._bind_to_running_loop()
+        cached = self._agent_cards.get(base_url)
+        if cached and cached[1] > time.monotonic():
+            self._stats["card_hits"] += 1
+            return cached[0]
+
+        async with self._locks.setdefault(base_url, asyncio.Lock()):
+            # Another coroutine may have resolved the card while this one was waiting for the lock
+            cached = self._agent_cards.get(base_url)
+            if cached and cached[1] > time.monotonic():
+                self._stats["card_hits"] += 1
+                return cached[0]
+
+            self._stats["card_misses"] += 1
+            resolver = A2ACardResolver(httpx_client=self._httpx_client, base_url=base_url)
+            agent_card = await resolver.get_agent_card()
+            self._agent_cards[base_url] = (agent_card, time.monotonic() + self._card_ttl)
+            return agent_card
+
+    async def get_client(self, base_url: str, streaming: bool = False, consumer: Consumer | None = None) -> Client:
+        """
+        Returns an A2A client for the given base url.
+
+        Clients with an event consumer attached are not cached since the consumer is specific to the caller.
+        """
+        agent_card = await self.get_agent_card(base_url)
+        config = ClientConfig(
+            httpx_client=self._httpx_client,
+            streaming=streaming,
+        )
+        if consumer:
+            return ClientFactory(config).create(agent_card, consumers=[consumer])
+
+        key = (base_url, streaming)
+        cached = self._clients.get(key)
+        # A refreshed agent card may advertise a different transport or url, so rebuild the client with it
+        if cached and cached[1] is agent_card:
+            self._stats["client_hits"] += 1
+            return cached[0]
+
+        self._stats["client_misses"] += 1
+        client = ClientFactory(config).create(agent_card)
+        self._clients[key] = (client, agent_card)
+        return client
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Returns the pool hit/miss counters
+        """
+        return {
+            "card_hits": self._stats["card_hits"],
+            "card_misses": self._stats["card_misses"],
+            "client_hits": self._stats["client_hits"],
+            "client_misses": self._stats["client_misses"],
+            "http_clients_created": self._stats["http_clients_created"],
+        }
+
+    async def close(self) -> None:
+        """
+        Closes the shared HTTP client and clears all cached agent cards and clients
+        """
+        if self._httpx_client and self._loop is asyncio.get_running_loop():
+            await self._httpx_client.aclose()
+        self._loop = None
+        self._httpx_client = None
+        self._locks = {}
+        self._agent_cards = {}
+        self._clients = {}
+
+
+# Shared pool used for all messages sent by this process
+client_pool = A2AClientPool()
+
+
+def get_pool_stats() -> dict[str, int]:
+    """
+    Returns the hit/miss counters of the shared A2A client pool
+    """
+    return client_pool.get_stats()
+
+
+metrics_registry.register_collector("a2a_pool", get_pool_stats)
+
+
+class Replica:
+    """
+    Replica of an agent, with its messages in flight, average latency and failures
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.in_flight = 0
+        self.requests = 0
+        self.latency: float | None = None
+        self.samples = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def in_rotation(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+class ReplicaPool:
+    """
+    Replicas of an agent given by comma-separated base urls, a single url being a pool of one replica.
+
+    New conversations are routed to the replica in rotation with the fewest messages in flight, ties going to the
+    replica with the fewest recent failures, then to the one with the lowest average latency. Messages continuing a conversation go to the replica owning its context
+    id. The last replica in rotation is never taken out of it.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.replicas = [Replica(url.strip()) for url in base_url.split(",") if url.strip()]
+        self._owners: OrderedDict[str, Replica] = OrderedDict()
+
+    def select(self, context_id: str | None = None) -> Replica:
+        """
+        Returns the replica owning the given conversation, or the least loaded replica in rotation for a new one
+        """
+        if context_id is not None:
+            owner = self._owners.get(context_id)
+            if owner is not None:
+                self._owners.move_to_end(context_id)
+                return owner
+
+        now = time.monotonic()
+        for replica in self.replicas:
+            if replica.ejected_until and replica.in_rotation(now):
+                # Back in rotation, its latency is measured afresh
+                replica.ejected_until = 0.0
+                replica.latency = None
+                replica.samples = 0
+                replica.failures = 0
+                logger.info(f"Replica {replica.url} is back in rotation")
+        candidates = [replica for replica in self.replicas if replica.in_rotation(now)] or self.replicas
+        return min(candidates, key=lambda replica: (replica.in_flight, replica.failures, replica.latency or 0.0))
+
+    def pin(self, context_id: str, replica: Replica) -> None:
+        self._owners[context_id] = replica
+        self._owners.move_to_end(context_id)
+        while len(self._owners) > REPLICA_MAX_CONVERSATIONS:
+            self._owners.popitem(last=False)
+
+    def _eject(self, replica: Replica, reason: str) -> None:
+        now = time.monotonic()
+        if not any(other.in_rotation(now) for other in self.replicas if other is not replica):
+            return
+        replica.ejected_until = now + A2A_REPLICA_EJECTION_SECONDS
+        logger.warning(f"Replica {replica.url} taken out of rotation for {A2A_REPLICA_EJECTION_SECONDS}s ({reason})")
+        metrics_registry.increment(
+            "personagym_a2a_replica_ejections_total", "Replicas of other agents taken out of rotation", endpoint=replica.url, reason=reason
+        )
+
+    def record_success(self, replica: Replica, latency: float) -> None:
+        replica.failures = 0
+        replica.samples += 1
+        replica.latency = latency if replica.latency is None else (
+            REPLICA_LATENCY_ALPHA * latency + (1 - REPLICA_LATENCY_ALPHA) * replica.latency
+        )
+        if replica.samples < A2A_REPLICA_MIN_SAMPLES or not replica.in_rotation(time.monotonic()):
+            return
+        other_latencies = [
+            other.latency for other in self.replicas
+            if other is not replica and other.samples >= A2A_REPLICA_MIN_SAMPLES and other.in_rotation(time.monotonic())
+        ]
+        if other_latencies and replica.latency > A2A_REPLICA_SLOW_FACTOR * statistics.median(other_latencies):
+            self._eject(replica, "slow")
+
+    def record_failure(self, replica: Replica) -> None:
+        replica.failures += 1
+        if replica.failures >= A2A_REPLICA_MAX_FAILURES and replica.in_rotation(time.monotonic()):
+            self._eject(replica, "failing")
+
+_replica_pools: dict[str, ReplicaPool] = {}
+
+
+def get_replica_pool(base_url: str) -> ReplicaPool:
+    """
+    Returns the replica pool of an agent url, listing the base urls of its replicas separated by commas
+    """
+    pool = _replica_pools.get(base_url)
+    if pool is None:
+        pool = _replica_pools[base_url] = ReplicaPool(base_url)
+    return pool
+
+
+def get_replica_stats() -> dict[str, float]:
+    """
+    Returns the messages in flight, the message count, the average latency and the rotation status of each replica
+    """
+    now = time.monotonic()
+    stats = {}
+    for pool in list(_replica_pools.values()):
+        for replica in pool.replicas:
+            label = re.sub(r"[^a-zA-Z0-9_]", "_", replica.url)
+            stats[f"{label}_in_flight"] = replica.in_flight
+            stats[f"{label}_requests"] = replica.requests
+            stats[f"{label}_in_rotation"] = int(replica.in_rotation(now))
+            if replica.latency is not None:
+                stats[f"{label}_latency_seconds"] = round(replica.latency, 4)
+    return stats
+
+
+metrics_registry.register_collector("a2a_replicas", get_replica_stats)
+
 
 def _create_message(*, role: Role = Role.user, text: str, context_id: str | None = None) -> Message:
     return Message(
@@ -42,49 +352,86 @@ def _merge_parts(parts: list[Part]) -> str:
     return "\n".join(chunks)
 
 async def _send_message(message: str, base_url: str, context_id: str | None = None, streaming=False, consumer: Consumer | None = None):
-    """Returns dict with context_id, response and status (if exists)"""
-    async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT) as httpx_client:
-        resolver = A2ACardResolver(httpx_client=httpx_client, base_url=base_url)
-        agent_card = await resolver.get_agent_card()
-        config = ClientConfig(
-            httpx_client=httpx_client,
-            streaming=streaming,
+    """
+    Returns dict with context_id, response and status (if exists).
+
+    Unless RESILIENCE_ENABLED is off, messages have an adaptive timeout and are retried with jittered backoff. Messages starting a new conversation
+    are also hedged, since a duplicate cannot interleave with the turns of an existing conversation. When
+    CASSETTE_MODE is set, messages are recorded to or replayed from the cassette.
+    """
+    cassette = get_cassette()
+    if cassette is not None:
+        return await cassette.a2a_interaction(
+            base_url, message, context_id, lambda: _send_resilient_message(message, base_url, context_id, streaming, consumer)
         )
-        factory = ClientFactory(config)
-        client = factory.create(agent_card)
-        if consumer:
-            await client.add_event_consumer(consumer)
+    return await _send_resilient_message(message, base_url, context_id, streaming, consumer)
 
-        outbound_msg = _create_message(text=message, context_id=context_id)
-        last_event = None
-        outputs = {
-            "response": "",
-            "context_id": None
-        }
+async def _send_resilient_message(message: str, base_url: str, context_id: str | None = None, streaming=False, consumer: Consumer | None = None):
+    if not RESILIENCE_ENABLED:
+        return await _send_message_once(message, base_url, context_id, streaming, consumer)
+    new_conversation = context_id is None
+    return await call_with_resilience(
+        lambda: _send_message_once(message, base_url, context_id, streaming, consumer),
+        key=base_url,
+        stage=A2A_RESILIENCE_STAGE,
+        hedge=new_conversation and consumer is None,
+        retry_on=RETRIABLE_A2A_ERRORS if new_conversation else RETRIABLE_A2A_CONVERSATION_ERRORS,
+        on_retry=lambda: metrics_registry.increment(
+            "personagym_a2a_retries_total", "Retried messages to other agents", endpoint=base_url
+        )
+    )
 
-        # if streaming == False, only one event is generated
-        async for event in client.send_message(outbound_msg):
-            last_event = event
+async def _send_message_once(message: str, base_url: str, context_id: str | None = None, streaming=False, consumer: Consumer | None = None):
+    # Hedged and retried messages starting a conversation are routed again, so they may go to another replica
+    pool = get_replica_pool(base_url)
+    replica = pool.select(context_id)
+    replica.in_flight += 1
+    replica.requests += 1
+    start_time = time.monotonic()
+    try:
+        outputs = await _send_message_to_replica(message, replica.url, context_id, streaming, consumer)
+    except Exception:
+        pool.record_failure(replica)
+        raise
+    finally:
+        replica.in_flight -= 1
+    pool.record_success(replica, time.monotonic() - start_time)
+    if outputs["context_id"]:
+        pool.pin(outputs["context_id"], replica)
+    return outputs
 
-        match last_event:
-            case Message() as msg:
-                outputs["context_id"] = msg.context_id
-                outputs["response"] += _merge_parts(msg.parts)
+async def _send_message_to_replica(message: str, base_url: str, context_id: str | None = None, streaming=False, consumer: Consumer | None = None):
+    client = await client_pool.get_client(base_url, streaming=streaming, consumer=consumer)
+    outbound_msg = _create_message(text=message, context_id=context_id)
+    last_event = None
+    outputs = {
+        "response": "",
+        "context_id": None
+    }
+
+    # if streaming == False, only one event is generated
+    async for event in client.send_message(outbound_msg):
+        last_event = event
 
-            case (task, update):
-                outputs["context_id"] = task.context_id
-                outputs["status"] = task.status.state.value
-                msg = task.status.message
-                if msg:
-                    outputs["response"] += _merge_parts(msg.parts)
-                if task.artifacts:
-                    for artifact in task.artifacts:
-                        outputs["response"] += _merge_parts(artifact.parts)
+    match last_event:
+        case Message() as msg:
+            outputs["context_id"] = msg.context_id
+            outputs["response"] += _merge_parts(msg.parts)
+
+        case (task, update):
+            outputs["context_id"] = task.context_id
+            outputs["status"] = task.status.state.value
+            msg = task.status.message
+            if msg:
+                outputs["response"] += _merge_parts(msg.parts)
+            if task.artifacts:
+                for artifact in task.artifacts:
+                    outputs["response"] += _merge_parts(artifact.parts)
 
-            case _:
-                pass
+        case _:
+            pass
 
-        return outputs
+    return outputs
 
 class MessageToolProvider:
     def __init__(self):
@@ -96,7 +443,7 @@ class MessageToolProvider:
 
         Args:
             message: The message to send to the agent
-            url: The agent's URL endpoint
+            url: The agent's URL endpoint, or the comma-separated URL endpoints of its replicas
             new_conversation: If True, start fresh conversation; if False, continue existing conversation
 
         Returns:
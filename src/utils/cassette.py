@@ -0,0 +1,198 @@
+"""
+Record and replay of LLM and A2A traffic
+
+With CASSETTE_MODE=record, every model request/response and every A2A message/response of the process is captured
+into a cassette file of gzip-compressed JSON lines. Each interaction is stored once, under the content hash of its
+request, with its latency and its response. With CASSETTE_MODE=replay, the interactions are served from the cassette
+at their recorded latency, or without delay when CASSETTE_REPLAY_LATENCY is "zero", so the orchestration layer can be
+profiled and benchmarked offline without calling any model or agent. A request missing from the cassette fails in
+replay mode rather than reaching a live service.
+
+A2A messages continuing a conversation are keyed by the messages sent before them in the conversation, since the
+context ids assigned by the agent differ between runs.
+"""
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import AsyncGenerator, Awaitable, Callable
+from dotenv import load_dotenv
+
+from src.utils.instrumentation import metrics_registry
+from src.utils.llm_cache import make_cache_key
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "off", "record" or "replay"
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", ".cache/cassette.jsonl.gz")
+# "recorded" to replay interactions at their recorded latency, or "zero" to replay them without delay
+CASSETTE_REPLAY_LATENCY = os.getenv("CASSETTE_REPLAY_LATENCY", "recorded").lower()
+# Number of recorded interactions buffered before they are appended to the cassette file
+CASSETTE_FLUSH_SIZE = int(os.getenv("CASSETTE_FLUSH_SIZE", "50"))
+
+class CassetteMissError(LookupError):
+    """
+    Raised in replay mode for a request that was not recorded in the cassette
+    """
+
+def content_hash(*parts: str) -> str:
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+class Cassette:
+    """
+    Content-hash indexed store of recorded interactions, appended to a gzip-compressed JSONL file
+    """
+
+    def __init__(self, path: str = CASSETTE_PATH, mode: str = CASSETTE_MODE, replay_latency: str = CASSETTE_REPLAY_LATENCY):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Invalid cassette mode: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self._entries: dict[str, dict] = {}
+        self._pending: list[dict] = []
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        # Hash of the messages sent so far in each A2A conversation, keyed by context id
+        self._conversations: dict[str, str] = {}
+        if self.path.exists():
+            self._load()
+        elif mode == "replay":
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+
+    def _load(self) -> None:
+        # Concatenated gzip members are read as one stream, so every flushed batch is loaded
+        with gzip.open(self.path, "rt", encoding="utf-8") as cassette_file:
+            for line in cassette_file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], entry)
+        logger.info(f"Loaded {len(self._entries)} interactions from cassette {self.path}")
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(self.path, "at", encoding="utf-8") as cassette_file:
+            cassette_file.writelines(json.dumps(entry, separators=(",", ":")) + "\n" for entry in self._pending)
+        self._pending.clear()
+
+    def flush(self) -> None:
+        """
+        Appends the buffered interactions to the cassette file
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def record(self, key: str, kind: str, latency: float, response: object) -> None:
+        with self._lock:
+            if key in self._entries:
+                return
+            entry = {"key": key, "kind": kind, "latency": round(latency, 4), "response": response}
+            self._entries[key] = entry
+            self._pending.append(entry)
+            self._stats[f"{kind}_recorded"] += 1
+            if len(self._pending) >= CASSETTE_FLUSH_SIZE:
+                self._flush_locked()
+
+    async def replay(self, key: str, kind: str, description: str) -> object:
+        """
+        Returns the recorded response of an interaction after its recorded latency
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self._stats[f"{kind}_misses"] += 1
+            raise CassetteMissError(f"No recorded {kind} interaction for {description} ({key})")
+        self._stats[f"{kind}_hits"] += 1
+        if self.replay_latency == "recorded":
+            await asyncio.sleep(entry["latency"])
+        return entry["response"]
+
+    async def a2a_interaction(
+            self,
+            base_url: str,
+            message: str,
+            context_id: str | None,
+            send: Callable[[], Awaitable[dict]]
+    ) -> dict:
+        """
+        Records or replays an A2A message, returning the outputs of `message_tool._send_message`
+        """
+        conversation = self._conversations.get(context_id, "") if context_id else ""
+        key = content_hash("a2a", base_url, conversation, message)
+        if self.mode == "replay":
+            outputs = dict(await self.replay(key, "a2a", base_url))
+        else:
+            start_time = time.monotonic()
+            outputs = await send()
+            if outputs.get("status", "completed") == "completed":
+                self.record(key, "a2a", time.monotonic() - start_time, outputs)
+        if outputs.get("context_id"):
+            self._conversations[outputs["context_id"]] = content_hash(conversation, message)
+        return outputs
+
+    def get_stats(self) -> dict[str, float]:
+        with self._lock:
+            return {"entries": len(self._entries), **self._stats}
+
+@lru_cache(maxsize=1)
+def get_cassette() -> Cassette | None:
+    """
+    Returns the process-wide cassette, or None when CASSETTE_MODE is off
+    """
+    if CASSETTE_MODE == "off":
+        return None
+    cassette = Cassette()
+    metrics_registry.register_collector("cassette", cassette.get_stats)
+    if cassette.mode == "record":
+        atexit.register(cassette.flush)
+    logger.info(f"Cassette {cassette.mode} mode: {cassette.path}")
+    return cassette
+
+class CassetteLlm(BaseLlm):
+    """
+    Model recording the responses of the wrapped model to the cassette, or replaying them without calling it
+    """
+
+    llm: BaseLlm
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        cassette = get_cassette()
+        key = make_cache_key(self.model, llm_request)
+        if cassette.mode == "replay":
+            for llm_response in await cassette.replay(key, "llm", f"model {self.model}"):
+                yield LlmResponse.model_validate(llm_response)
+            return
+
+        start_time = time.monotonic()
+        llm_responses = []
+        async for llm_response in self.llm.generate_content_async(llm_request, stream=stream):
+            llm_responses.append(llm_response)
+            yield llm_response
+        # Only complete, successful responses are recorded
+        if llm_responses and not llm_responses[-1].partial and not llm_responses[-1].error_code:
+            cassette.record(
+                key,
+                "llm",
+                time.monotonic() - start_time,
+                [llm_response.model_dump(mode="json", exclude_none=True) for llm_response in llm_responses]
+            )
+
+    def connect(self, llm_request: LlmRequest):
+        return self.llm.connect(llm_request)
@@ -0,0 +1,77 @@
+"""
+Persistent sessions and checkpointed, resumable evaluations
+
+When SESSION_DB_URL is set, sessions are stored in a database (e.g. SQLite) with ADK's `DatabaseSessionService`, so
+the output key written by each completed stage survives a restart of the process. When an evaluation is resumed, the
+resume callbacks skip every stage whose outputs already exist in the session state. Otherwise sessions are kept in a
+bounded in-memory store that evicts idle and least recently used sessions.
+"""
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.sessions import BaseSessionService, DatabaseSessionService
+from google.genai import types
+
+import logging
+import os
+from pathlib import Path
+from typing import Callable
+from dotenv import load_dotenv
+
+from src.utils.logging_callbacks import post_agent_logging_callback
+from src.utils.session_eviction import create_bounded_session_service
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Database url of the session store, e.g. sqlite+aiosqlite:///.cache/sessions.db. Sessions are kept in memory if unset.
+SESSION_DB_URL = os.getenv("SESSION_DB_URL", "")
+
+# Session state key set to True to resume an evaluation from its checkpointed stage outputs
+RESUME_STATE_KEY = "resume"
+
+def create_session_service(db_url: str = SESSION_DB_URL) -> BaseSessionService:
+    """
+    Creates the database session service configured by SESSION_DB_URL, or a bounded in-memory session service if it
+    is unset
+    """
+    if not db_url:
+        return create_bounded_session_service()
+
+    if db_url.startswith("sqlite"):
+        # SQLite creates the database file but not its directory
+        database_path = db_url.split(":///", 1)[-1]
+        if database_path and database_path != ":memory:":
+            Path(database_path).parent.mkdir(parents=True, exist_ok=True)
+    logger.info(f"Using persistent session store: {db_url}")
+    return DatabaseSessionService(db_url=db_url)
+
+def create_resume_callback(
+        *output_keys: str,
+        on_restored: Callable[[CallbackContext], types.Content | None] | None = None
+) -> Callable[[CallbackContext], types.Content | None]:
+    """
+    Returns a before agent callback that skips the agent when the evaluation is resumed and all of the given output
+    keys already exist in the session state.
+
+    ADK does not run the after agent callbacks of a skipped agent, so the callback closes the agent invocation
+    started by `pre_agent_logging_callback` itself, and returns the content of `on_restored` (e.g. the streamed result
+    the after agent callbacks would have emitted) if it returns any.
+    """
+
+    def resume_callback(callback_context: CallbackContext) -> types.Content | None:
+        state = callback_context.state
+        if not state.get(RESUME_STATE_KEY) or any(state.get(output_key) is None for output_key in output_keys):
+            return None
+
+        logger.info(f"[{callback_context.invocation_id}] Skipping {callback_context.agent_name}, outputs restored from checkpoint")
+        post_agent_logging_callback(callback_context)
+        restored_content = on_restored(callback_context) if on_restored else None
+        if restored_content is not None:
+            return restored_content
+        return types.Content(
+            role="model",
+            parts=[types.Part(text=f"{callback_context.agent_name} restored from checkpoint: {', '.join(output_keys)}")]
+        )
+
+    return resume_callback
@@ -0,0 +1,100 @@
+"""
+Registry of the PersonaGym data files (rubrics, task question descriptions and settings)
+
+The data files are loaded and validated once, then indexed by evaluation task so that agents can be given the
+relevant rubric or question description directly instead of reading the files through an LLM tool call.
+"""
+
+from __future__ import annotations
+
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel, RootModel
+
+if TYPE_CHECKING:
+    from src.agents.personagym_evaluator.sub_agents.question_generator import EvaluationTask
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "data"
+RUBRIC_TEMPLATE_FILE = "rubrics_template.json"
+QUESTION_DESCRIPTIONS_FILE = "tasks.json"
+SETTINGS_FILE = "settings.json"
+
+class RubricCriterion(BaseModel):
+    score: int
+    definition: str
+
+class Rubric(BaseModel):
+    task: str
+    description: str
+    criteria: list[RubricCriterion]
+
+class RubricsTemplate(BaseModel):
+    rubrics: list[Rubric]
+
+class QuestionDescriptions(RootModel[dict[str, str]]):
+    pass
+
+class Settings(RootModel[list[str]]):
+    pass
+
+class DataRegistry:
+    """
+    Validated, in-memory index of the PersonaGym data files keyed by evaluation task name
+    """
+
+    def __init__(self, rubrics: RubricsTemplate, question_descriptions: QuestionDescriptions, settings: Settings):
+        self._question_descriptions = question_descriptions.root
+        self._settings = settings.root
+        self._rubrics: dict[str, Rubric] = {}
+
+        # Rubric task names may be more descriptive than the task names, e.g. "Expected Action in Given Setting"
+        for task_name in self._question_descriptions:
+            for rubric in rubrics.rubrics:
+                if rubric.task == task_name or rubric.task.startswith(task_name):
+                    self._rubrics[task_name] = rubric
+                    break
+            else:
+                raise ValueError(f"No rubric found for evaluation task: {task_name}")
+
+    @classmethod
+    def load(cls, data_dir: Path = DATA_DIR) -> DataRegistry:
+        """
+        Loads and validates the data files from the given directory
+        """
+        return cls(
+            rubrics=RubricsTemplate.model_validate_json((data_dir / RUBRIC_TEMPLATE_FILE).read_text()),
+            question_descriptions=QuestionDescriptions.model_validate_json((data_dir / QUESTION_DESCRIPTIONS_FILE).read_text()),
+            settings=Settings.model_validate_json((data_dir / SETTINGS_FILE).read_text())
+        )
+
+    @property
+    def settings(self) -> list[str]:
+        return list(self._settings)
+
+    def get_rubric(self, task: EvaluationTask) -> Rubric:
+        """
+        Returns the scoring rubric for the given evaluation task
+        """
+        return self._rubrics[task.value]
+
+    def get_rubric_json(self, task: EvaluationTask) -> str:
+        """
+        Returns the scoring rubric for the given evaluation task as it appears in the rubric template file
+        """
+        return json.dumps(self.get_rubric(task).model_dump(), indent=4)
+
+    def get_question_description(self, task: EvaluationTask) -> str:
+        """
+        Returns the description of the questions to be generated for the given evaluation task
+        """
+        return self._question_descriptions[task.value]
+
+@lru_cache(maxsize=1)
+def get_data_registry() -> DataRegistry:
+    """
+    Returns the process-wide data registry, loading the data files on first use
+    """
+    return DataRegistry.load()
@@ -0,0 +1,251 @@
+"""
+Job queue and admission control of the coordinator server
+
+With EVALUATION_QUEUE_ENABLED set, the coordinator runs at most EVALUATION_WORKERS evaluations at once. Further
+submissions wait in a queue of at most EVALUATION_QUEUE_SIZE evaluations, served in submission order or, with
+EVALUATION_QUEUE_POLICY=priority, by the "priority" field of the request (lower values first). A submission arriving
+when the queue is full is rejected right away with a `rejected` task status, so that clients back off and retry
+instead of piling up runs that overload the providers.
+
+Submissions sent with message/send return their task as soon as it is queued, and clients follow it with tasks/get or
+tasks/resubscribe. Submissions sent with message/stream are streamed as usual once their evaluation starts. Queued and
+running evaluations can be canceled with tasks/cancel. The queue depth, the running evaluations and the time
+evaluations waited in the queue are exposed on /metrics for autoscaling decisions.
+"""
+
+from a2a.server.agent_execution import AgentExecutor, RequestContext
+from a2a.server.apps import A2AStarletteApplication
+from a2a.server.context import ServerCallContext
+from a2a.server.events import EventQueue
+from a2a.server.request_handlers import DefaultRequestHandler
+from a2a.server.tasks import InMemoryTaskStore
+from a2a.types import (
+    AgentCard,
+    Message,
+    MessageSendConfiguration,
+    MessageSendParams,
+    Part,
+    Role,
+    Task,
+    TaskState,
+    TaskStatus,
+    TaskStatusUpdateEvent,
+    TextPart,
+)
+from google.adk.a2a.executor.a2a_agent_executor import A2aAgentExecutor
+from google.adk.runners import Runner
+from starlette.applications import Starlette
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Awaitable, Callable
+from uuid import uuid4
+from dotenv import load_dotenv
+
+from src.utils.evaluation_request import parse_evaluation_request
+from src.utils.instrumentation import LATENCY_BUCKETS, metrics_registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EVALUATION_QUEUE_ENABLED = os.getenv("EVALUATION_QUEUE_ENABLED", "false").lower() == "true"
+# Maximum number of evaluations run at once
+EVALUATION_WORKERS = int(os.getenv("EVALUATION_WORKERS", "4"))
+# Maximum number of evaluations waiting for a worker, further submissions are rejected
+EVALUATION_QUEUE_SIZE = int(os.getenv("EVALUATION_QUEUE_SIZE", "100"))
+# "fifo" to run evaluations in submission order, or "priority" to run them by the priority of their request
+EVALUATION_QUEUE_POLICY = os.getenv("EVALUATION_QUEUE_POLICY", "fifo").lower()
+
+class EvaluationQueueFullError(RuntimeError):
+    """
+    Raised when an evaluation is submitted while the queue is full
+    """
+
+class EvaluationQueue:
+    """
+    Bounded queue admitting evaluations to a fixed number of workers, in FIFO or priority order
+    """
+
+    def __init__(self, workers: int = EVALUATION_WORKERS, max_queued: int = EVALUATION_QUEUE_SIZE, policy: str = EVALUATION_QUEUE_POLICY):
+        if policy not in ("fifo", "priority"):
+            raise ValueError(f"Invalid evaluation queue policy: {policy}")
+        self.workers = workers
+        self.max_queued = max_queued
+        self.policy = policy
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._waiters: list[tuple[int, int, float, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._stats = Counter()
+
+    def _bind_to_running_loop(self) -> None:
+        # Futures cannot be shared across event loops, so start afresh when the loop changes
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._waiters = []
+        self._running = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def _dispatch(self) -> None:
+        while self._waiters and self._running < self.workers:
+            _, _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._running += 1
+            future.set_result(None)
+
+    async def acquire(self, priority: int = 0, on_queued: Callable[[int], Awaitable[None]] | None = None) -> None:
+        """
+        Waits for a worker, calling `on_queued` with the queue position of the evaluation if it has to wait.
+
+        Raises:
+            EvaluationQueueFullError: If no worker is free and the queue is full
+        """
+        self._bind_to_running_loop()
+        self._stats["submitted"] += 1
+        start_time = time.monotonic()
+        if self._running < self.workers and not self._waiters:
+            self._running += 1
+        else:
+            if len(self._waiters) >= self.max_queued:
+                self._stats["rejected"] += 1
+                raise EvaluationQueueFullError(f"The evaluation queue is full ({len(self._waiters)} evaluations queued), retry later")
+
+            entry = (priority if self.policy == "priority" else 0, next(self._sequence), start_time, self._loop.create_future())
+            heapq.heappush(self._waiters, entry)
+            try:
+                if on_queued is not None:
+                    await on_queued(sorted(self._waiters).index(entry) + 1)
+                await entry[3]
+            except BaseException:
+                # Canceled, or `on_queued` failed: leave the queue, or hand back a worker granted in the meantime
+                if entry[3].done() and not entry[3].cancelled():
+                    self.release()
+                elif entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    entry[3].cancel()
+                raise
+
+        self._stats["started"] += 1
+        metrics_registry.observe(
+            "personagym_evaluation_queue_wait_seconds", time.monotonic() - start_time, LATENCY_BUCKETS,
+            "Time evaluations waited in the queue for a worker"
+        )
+
+    def release(self) -> None:
+        self._running = max(0, self._running - 1)
+        self._dispatch()
+
+    def get_stats(self) -> dict[str, float]:
+        """
+        Returns the queue depth, the running evaluations and the wait time of the oldest queued evaluation
+        """
+        now = time.monotonic()
+        return {
+            "depth": len(self._waiters),
+            "running": self._running,
+            "workers": self.workers,
+            "capacity": self.max_queued,
+            "oldest_wait_seconds": round(max((now - entry[2] for entry in self._waiters), default=0.0), 3),
+            "submitted": self._stats["submitted"],
+            "started": self._stats["started"],
+            "rejected": self._stats["rejected"],
+        }
+
+@lru_cache(maxsize=1)
+def get_evaluation_queue() -> EvaluationQueue:
+    """
+    Returns the evaluation queue of the coordinator, whose stats are exposed as `personagym_evaluation_queue_*` gauges
+    """
+    evaluation_queue = EvaluationQueue()
+    metrics_registry.register_collector("evaluation_queue", evaluation_queue.get_stats)
+    logger.info(
+        f"Using evaluation queue: workers={evaluation_queue.workers}, size={evaluation_queue.max_queued}, "
+        f"policy={evaluation_queue.policy}"
+    )
+    return evaluation_queue
+
+async def _publish_status(context: RequestContext, event_queue: EventQueue, state: TaskState, text: str, final: bool = False) -> None:
+    await event_queue.enqueue_event(
+        TaskStatusUpdateEvent(
+            task_id=context.task_id,
+            context_id=context.context_id,
+            status=TaskStatus(
+                state=state,
+                message=Message(message_id=uuid4().hex, role=Role.agent, parts=[Part(root=TextPart(text=text))]),
+                timestamp=datetime.now(timezone.utc).isoformat(),
+            ),
+            final=final,
+        )
+    )
+
+class QueuedAgentExecutor(AgentExecutor):
+    """
+    Agent executor running the evaluations of the wrapped executor through the evaluation queue
+    """
+
+    def __init__(self, executor: AgentExecutor, evaluation_queue: EvaluationQueue):
+        self.executor = executor
+        self.evaluation_queue = evaluation_queue
+
+    async def execute(self, context: RequestContext, event_queue: EventQueue) -> None:
+        try:
+            priority = parse_evaluation_request(context.get_user_input()).priority
+        except Exception as e:
+            # The wrapped executor reports invalid requests, the queue only needs their priority
+            logger.warning(f"Could not read the priority of evaluation {context.task_id}, using the default priority: {e}")
+            priority = 0
+
+        async def on_queued(position: int) -> None:
+            await _publish_status(context, event_queue, TaskState.submitted, f"Evaluation queued at position {position}")
+
+        try:
+            await self.evaluation_queue.acquire(priority, on_queued=on_queued)
+        except EvaluationQueueFullError as e:
+            logger.warning(f"Rejected evaluation {context.task_id}: {e}")
+            await _publish_status(context, event_queue, TaskState.rejected, str(e), final=True)
+            return
+        try:
+            await self.executor.execute(context, event_queue)
+        finally:
+            self.evaluation_queue.release()
+
+    async def cancel(self, context: RequestContext, event_queue: EventQueue) -> None:
+        # The request handler then cancels the execution, which leaves the queue or stops the running evaluation
+        await _publish_status(context, event_queue, TaskState.canceled, "Evaluation canceled", final=True)
+
+class JobQueueRequestHandler(DefaultRequestHandler):
+    """
+    Request handler returning the task of a message/send submission as soon as it is queued
+    """
+
+    async def on_message_send(self, params: MessageSendParams, context: ServerCallContext | None = None) -> Message | Task:
+        configuration = params.configuration or MessageSendConfiguration()
+        params = params.model_copy(update={"configuration": configuration.model_copy(update={"blocking": False})})
+        return await super().on_message_send(params, context)
+
+def create_job_queue_app(agent_card: AgentCard, runner: Runner) -> Starlette:
+    """
+    Creates the A2A application of the coordinator running its evaluations through the evaluation queue
+    """
+    agent_executor = QueuedAgentExecutor(A2aAgentExecutor(runner=runner), get_evaluation_queue())
+    request_handler = JobQueueRequestHandler(agent_executor=agent_executor, task_store=InMemoryTaskStore())
+    return A2AStarletteApplication(agent_card=agent_card, http_handler=request_handler).build()
@@ -0,0 +1,111 @@
+"""
+Parsing of the evaluation request sent to the PersonaGym evaluator
+"""
+
+from google.adk.agents.callback_context import CallbackContext
+from pydantic import BaseModel
+
+from src.utils.checkpoints import RESUME_STATE_KEY
+
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Session state keys for the parsed evaluation request
+PERSONA_STATE_KEY = "persona"
+PERSONA_AGENT_URL_STATE_KEY = "persona_agent_url"
+RUN_ID_STATE_KEY = "run_id"
+# Id of the persona in its batch, set by the batch runner
+PERSONA_ID_STATE_KEY = "persona_id"
+# Name of the model behind the persona agent, used to key stored results
+PURPLE_MODEL_STATE_KEY = "purple_model"
+
+URL_PATTERN = re.compile(r"https?://[^\s\"'<>]+")
+URL_LABEL_PATTERN = re.compile(r"persona\s+agent\s+(?:base\s+)?url\s*:?", re.IGNORECASE)
+PERSONA_LABEL_PATTERN = re.compile(r"^\s*persona\s*:", re.IGNORECASE)
+
+class EvaluationRequest(BaseModel):
+    persona: str
+    persona_agent_url: str | None = None
+    purple_model: str | None = None
+    resume: bool = False
+    # Queue priority of the evaluation when the coordinator runs a priority job queue, lower values run first
+    priority: int = 0
+
+def parse_priority(value) -> int:
+    """
+    Returns the queue priority of a request, falling back to the default priority when it is not an integer
+    """
+    if value is None:
+        return 0
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        logger.warning(f"Invalid evaluation priority {value!r}, using the default priority")
+        return 0
+
+def parse_evaluation_request(text: str) -> EvaluationRequest:
+    """
+    Parses an evaluation request into the persona description and the base url of the persona agent.
+
+    Accepts either a JSON object with a "persona" field (and optionally a "persona_agent_url" or "url" field, or an
+    AgentBeats "participants" mapping, a "purple_model" field, a "resume" flag and a queue "priority"), or free text such as:
+    "Persona: A 21-year-old photographer from Paris. Persona agent base url: http://127.0.0.1:9020"
+
+    The base urls of several replicas of the persona agent can be given as a list or separated by commas.
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = None
+
+    if isinstance(data, dict) and "persona" in data:
+        url = data.get("persona_agent_url") or data.get("url")
+        if not url and isinstance(data.get("participants"), dict) and data["participants"]:
+            url = next(iter(data["participants"].values()))
+        if isinstance(url, list):
+            # Replicas of the persona agent
+            url = ",".join(url)
+        return EvaluationRequest(
+            persona=str(data["persona"]).strip(),
+            persona_agent_url=url,
+            purple_model=data.get("purple_model"),
+            # Validated by the model, which parses "true"/"false" strings and rejects values that are not booleans
+            resume=data["resume"] if data.get("resume") is not None else False,
+            priority=parse_priority(data.get("priority"))
+        )
+
+    # The persona description may mention urls of its own, so a labelled url is only looked for after its label
+    label_match = URL_LABEL_PATTERN.search(text)
+    url_match = URL_PATTERN.search(text, label_match.end()) if label_match else URL_PATTERN.search(text)
+    url = url_match.group().rstrip(".,;)") if url_match else None
+
+    if label_match:
+        persona = text[:label_match.start()]
+    elif url_match:
+        persona = text[:url_match.start()] + text[url_match.end():]
+    else:
+        persona = text
+    persona = PERSONA_LABEL_PATTERN.sub("", persona).strip().rstrip(",;").strip()
+
+    return EvaluationRequest(persona=persona, persona_agent_url=url)
+
+def seed_evaluation_request_callback(callback_context: CallbackContext) -> None:
+    """
+    Callback function that parses the user's evaluation request and stores the persona and persona agent url in the session state
+    """
+    user_content = callback_context.user_content
+    if not user_content or not user_content.parts:
+        return
+
+    text = "".join(part.text for part in user_content.parts if part.text)
+    evaluation_request = parse_evaluation_request(text)
+    callback_context.state[PERSONA_STATE_KEY] = evaluation_request.persona
+    if evaluation_request.persona_agent_url:
+        callback_context.state[PERSONA_AGENT_URL_STATE_KEY] = evaluation_request.persona_agent_url
+    if evaluation_request.purple_model:
+        callback_context.state[PURPLE_MODEL_STATE_KEY] = evaluation_request.purple_model
+    if evaluation_request.resume:
+        callback_context.state[RESUME_STATE_KEY] = True
@@ -0,0 +1,322 @@
+"""
+Latency, token and cost instrumentation for ADK agents
+
+Agent and model callbacks record per-agent wall time and per-model latency, time to first token, token usage,
+tool calls, errors and retries. Metrics are aggregated into histograms exposed in the Prometheus text format,
+and are also kept per invocation so that a summary of each run can be attached to its output.
+"""
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Callable
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+# Maximum number of invocations for which a run summary is kept
+MAX_TRACKED_RUNS = 1000
+
+class Histogram:
+    """
+    Cumulative histogram with fixed bucket upper bounds
+    """
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[i] += 1
+
+def _escape_label_value(value: str) -> str:
+    # Label values may hold arbitrary text, e.g. model names or error messages, escaped as the text format requires
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: tuple[tuple[str, str], ...], extra: str = "") -> str:
+    label_strings = [f'{name}="{_escape_label_value(value)}"' for name, value in labels]
+    if extra:
+        label_strings.append(extra)
+    return "{" + ",".join(label_strings) + "}" if label_strings else ""
+
+class MetricsRegistry:
+    """
+    Registry of labelled histograms and counters, rendered in the Prometheus text format
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: dict[str, dict[tuple, Histogram]] = defaultdict(dict)
+        self._counters: dict[str, dict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+        self._help: dict[str, str] = {}
+        self._collectors: dict[str, Callable[[], dict[str, float]]] = {}
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...], help_text: str, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help[name] = help_text
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, help_text: str, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help[name] = help_text
+            self._counters[name][key] += amount
+
+    def register_collector(self, prefix: str, collector: Callable[[], dict[str, float]]) -> None:
+        """
+        Registers a function returning gauge values, rendered as `personagym_<prefix>_<name>` on every scrape
+        """
+        with self._lock:
+            self._collectors[prefix] = collector
+
+    def render(self) -> str:
+        """
+        Renders all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            for name, series in self._histograms.items():
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series.items():
+                    for upper_bound, count in zip(histogram.buckets, histogram.counts):
+                        bucket_label = f'le="{upper_bound}"'
+                        lines.append(f"{name}_bucket{_format_labels(labels, bucket_label)} {count}")
+                    bucket_label = 'le="+Inf"'
+                    lines.append(f"{name}_bucket{_format_labels(labels, bucket_label)} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            for name, series in self._counters.items():
+                lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            collectors = list(self._collectors.items())
+
+        for prefix, collector in collectors:
+            for key, value in collector().items():
+                name = f"personagym_{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics_registry = MetricsRegistry()
+
+class RunMetrics:
+    """
+    Metrics recorded for a single invocation (evaluation run)
+    """
+
+    def __init__(self, invocation_id: str):
+        self.invocation_id = invocation_id
+        self.start_time = time.monotonic()
+        self.agents: dict[str, dict[str, float]] = defaultdict(lambda: {"calls": 0, "wall_time_seconds": 0.0})
+        self.models: dict[str, dict[str, float]] = defaultdict(lambda: {
+            "calls": 0,
+            "latency_seconds": 0.0,
+            "ttft_seconds": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "errors": 0,
+            "retries": 0,
+        })
+        self.tool_calls: dict[str, int] = defaultdict(int)
+        # Start times of running agents and model calls, keyed by agent name, evicted with the run
+        self.agent_start_times: dict[str, float] = {}
+        self.model_calls: dict[str, dict] = {}
+
+    def summary(self) -> dict:
+        return {
+            "invocation_id": self.invocation_id,
+            "elapsed_seconds": round(time.monotonic() - self.start_time, 3),
+            "agents": {name: dict(agent) for name, agent in self.agents.items()},
+            "models": {name: dict(model) for name, model in self.models.items()},
+            "tool_calls": dict(self.tool_calls),
+        }
+
+_runs: OrderedDict[str, RunMetrics] = OrderedDict()
+_runs_lock = threading.Lock()
+
+def _get_run(invocation_id: str) -> RunMetrics:
+    with _runs_lock:
+        run = _runs.get(invocation_id)
+        if run is None:
+            run = _runs[invocation_id] = RunMetrics(invocation_id)
+            while len(_runs) > MAX_TRACKED_RUNS:
+                _runs.popitem(last=False)
+        return run
+
+def get_run_summary(invocation_id: str) -> dict | None:
+    """
+    Returns the metrics recorded so far for the given invocation
+    """
+    with _runs_lock:
+        run = _runs.get(invocation_id)
+    return run.summary() if run else None
+
+def record_agent_start(callback_context: CallbackContext) -> None:
+    """
+    Records the start of an agent invocation
+    """
+    _get_run(callback_context.invocation_id).agent_start_times[callback_context.agent_name] = time.monotonic()
+
+def record_agent_end(callback_context: CallbackContext) -> None:
+    """
+    Records the wall time of a completed agent invocation
+    """
+    run = _get_run(callback_context.invocation_id)
+    run.model_calls.pop(callback_context.agent_name, None)
+    start_time = run.agent_start_times.pop(callback_context.agent_name, None)
+    if start_time is None:
+        return
+    duration = time.monotonic() - start_time
+    agent = run.agents[callback_context.agent_name]
+    agent["calls"] += 1
+    agent["wall_time_seconds"] += duration
+    metrics_registry.observe(
+        "personagym_agent_duration_seconds", duration, LATENCY_BUCKETS,
+        "Wall time of agent invocations", agent=callback_context.agent_name
+    )
+
+def _model_call_key(callback_context: CallbackContext, call_id: str | None) -> str:
+    agent_name = callback_context.agent_name
+    return agent_name if call_id is None else f"{agent_name}:{call_id}"
+
+def record_model_request(callback_context: CallbackContext, llm_request: LlmRequest, call_id: str | None = None) -> None:
+    """
+    Records the start of a model call. Agents making concurrent model calls identify each call with a `call_id`.
+    """
+    key = _model_call_key(callback_context, call_id)
+    _get_run(callback_context.invocation_id).model_calls[key] = {
+        "model": llm_request.model or "unknown",
+        "start_time": time.monotonic(),
+        "first_token_time": None,
+    }
+
+def record_model_response(callback_context: CallbackContext, llm_response: LlmResponse, call_id: str | None = None) -> None:
+    """
+    Records the latency, time to first token, token usage and tool calls of a model response. Calls identified by a
+    `call_id` are complete once their final response is recorded.
+    """
+    key = _model_call_key(callback_context, call_id)
+    model_calls = _get_run(callback_context.invocation_id).model_calls
+    call = model_calls.get(key) if call_id is None or llm_response.partial else model_calls.pop(key, None)
+    if call is None:
+        return
+
+    now = time.monotonic()
+    model_name = call["model"]
+    if call["first_token_time"] is None:
+        call["first_token_time"] = now
+        ttft = now - call["start_time"]
+        metrics_registry.observe(
+            "personagym_model_ttft_seconds", ttft, LATENCY_BUCKETS,
+            "Time to first token of model calls", model=model_name
+        )
+        _get_run(callback_context.invocation_id).models[model_name]["ttft_seconds"] += ttft
+
+    if llm_response.partial:
+        return
+
+    latency = now - call["start_time"]
+    model = _get_run(callback_context.invocation_id).models[model_name]
+    model["calls"] += 1
+    model["latency_seconds"] += latency
+    metrics_registry.observe(
+        "personagym_model_latency_seconds", latency, LATENCY_BUCKETS,
+        "Latency of model calls", model=model_name, agent=callback_context.agent_name
+    )
+
+    if llm_response.error_code:
+        model["errors"] += 1
+        metrics_registry.increment("personagym_model_errors_total", "Model calls that returned an error", model=model_name)
+
+    usage = llm_response.usage_metadata
+    if usage:
+        prompt_tokens = usage.prompt_token_count or 0
+        completion_tokens = usage.candidates_token_count or 0
+        model["prompt_tokens"] += prompt_tokens
+        model["completion_tokens"] += completion_tokens
+        metrics_registry.observe(
+            "personagym_model_prompt_tokens", prompt_tokens, TOKEN_BUCKETS,
+            "Prompt tokens per model call", model=model_name
+        )
+        metrics_registry.observe(
+            "personagym_model_completion_tokens", completion_tokens, TOKEN_BUCKETS,
+            "Completion tokens per model call", model=model_name
+        )
+
+    parts = llm_response.content.parts if llm_response.content and llm_response.content.parts else []
+    tool_calls = sum(1 for part in parts if part.function_call)
+    if tool_calls:
+        _get_run(callback_context.invocation_id).tool_calls[callback_context.agent_name] += tool_calls
+        metrics_registry.increment(
+            "personagym_tool_calls_total", "Tool calls requested by models", amount=tool_calls, agent=callback_context.agent_name
+        )
+
+def record_model_call_end(callback_context: CallbackContext, call_id: str) -> None:
+    """
+    Ends a model call identified by a `call_id`, recording it as failed if it raised before its final response
+    """
+    run = _get_run(callback_context.invocation_id)
+    call = run.model_calls.pop(_model_call_key(callback_context, call_id), None)
+    if call is None:
+        return
+    run.models[call["model"]]["errors"] += 1
+    metrics_registry.increment("personagym_model_errors_total", "Model calls that returned an error", model=call["model"])
+
+def record_retry(model_name: str, invocation_id: str | None = None) -> None:
+    """
+    Records a retried model call. Retries are only recorded by the layer making them: the resilience policy of the
+    model for transient errors, and the judges for invalid judgements.
+    """
+    if invocation_id:
+        _get_run(invocation_id).models[model_name]["retries"] += 1
+    metrics_registry.increment("personagym_model_retries_total", "Retried model calls", model=model_name)
+
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """
+    Starlette route serving the metrics in the Prometheus text format
+    """
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+_request_stats = {"in_flight": 0, "served": 0}
+
+class InFlightRequestsMiddleware:
+    """
+    ASGI middleware counting the POST requests being served, exposed as the `personagym_requests_in_flight` gauge.
+    Streamed requests are in flight until their stream ends, so on the coordinator the gauge is the number of
+    evaluations it is running, which the dispatcher reads to balance personas across coordinators.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        _request_stats["in_flight"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_stats["in_flight"] -= 1
+            _request_stats["served"] += 1
+
+metrics_registry.register_collector("requests", lambda: dict(_request_stats))
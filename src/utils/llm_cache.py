@@ -0,0 +1,165 @@
+"""
+Persistent, content-addressed cache of LLM responses
+
+Responses are stored in a local SQLite file keyed by a hash of the model name, system instruction, input contents,
+output schema and available tools, so re-running the same evaluation serves the deterministic stages from disk.
+Model calls read and write the cache in worker threads with `get_async` and `set_async`, off the event loop.
+"""
+
+from google.adk.models.llm_request import LlmRequest
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from dotenv import load_dotenv
+
+from src.utils.instrumentation import metrics_registry
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite")
+# Seconds after which a cached response is no longer served
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 60 * 60)))
+# Maximum number of cached responses, the least recently used responses are evicted first
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+def _schema_to_json(schema) -> object:
+    if schema is None:
+        return None
+    if hasattr(schema, "model_json_schema"):
+        return schema.model_json_schema()
+    if hasattr(schema, "model_dump"):
+        return schema.model_dump(mode="json", exclude_none=True)
+    return repr(schema)
+
+def make_cache_key(model: str, llm_request: LlmRequest) -> str:
+    """
+    Returns the content hash identifying an LLM request
+    """
+    config = llm_request.config
+    system_instruction = config.system_instruction if config else None
+    if hasattr(system_instruction, "model_dump"):
+        system_instruction = system_instruction.model_dump(mode="json", exclude_none=True)
+
+    key_data = {
+        "model": model,
+        "system_instruction": system_instruction,
+        "contents": [content.model_dump(mode="json", exclude_none=True) for content in llm_request.contents],
+        "response_schema": _schema_to_json(config.response_schema if config else None),
+        "tools": sorted(llm_request.tools_dict),
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode()).hexdigest()
+
+class LlmResponseCache:
+    """
+    SQLite-backed LLM response store with TTL expiry and size-bounded LRU eviction
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_accessed REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_last_accessed ON llm_responses (last_accessed)")
+        # Number of stored entries, kept up to date by `set` so that the table is only scanned when it is full
+        self._entries = self._count_entries()
+
+    def _count_entries(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+
+    def get(self, key: str) -> str | None:
+        """
+        Returns the cached response for the given key, or None if there is no unexpired entry
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response FROM llm_responses WHERE key = ? AND created_at > ?", (key, now - self._ttl)
+            ).fetchone()
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            self._connection.execute("UPDATE llm_responses SET last_accessed = ? WHERE key = ?", (now, key))
+            self._stats["hits"] += 1
+            return row[0]
+
+    def set(self, key: str, response: str) -> None:
+        """
+        Stores a response. Once the cache holds more than `max_entries` responses, expired entries are deleted and
+        then the least recently used entries above the size limit are evicted.
+        """
+        now = time.time()
+        with self._lock:
+            exists = self._connection.execute("SELECT 1 FROM llm_responses WHERE key = ?", (key,)).fetchone() is not None
+            self._connection.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, response, created_at, last_accessed) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            self._stats["writes"] += 1
+            if not exists:
+                self._entries += 1
+            if self._entries <= self._max_entries:
+                return
+
+            # Other processes may share the file, so the entries are counted again before evicting
+            self._entries = self._count_entries()
+            if self._entries <= self._max_entries:
+                return
+            expired = self._connection.execute("DELETE FROM llm_responses WHERE created_at <= ?", (now - self._ttl,)).rowcount
+            evicted = self._connection.execute(
+                "DELETE FROM llm_responses WHERE key IN (SELECT key FROM llm_responses ORDER BY last_accessed LIMIT ?)",
+                (max(0, self._entries - expired - self._max_entries),)
+            ).rowcount
+            self._entries -= expired + evicted
+            self._stats["expired"] += expired
+            self._stats["evictions"] += evicted
+
+    async def get_async(self, key: str) -> str | None:
+        """
+        Returns the cached response for the given key from a worker thread, without blocking the event loop
+        """
+        return await asyncio.to_thread(self.get, key)
+
+    async def set_async(self, key: str, response: str) -> None:
+        """
+        Stores a response from a worker thread, without blocking the event loop
+        """
+        await asyncio.to_thread(self.set, key, response)
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Returns the cache hit/miss counters and the number of stored entries
+        """
+        return {
+            "hits": self._stats["hits"],
+            "misses": self._stats["misses"],
+            "writes": self._stats["writes"],
+            "expired": self._stats["expired"],
+            "evictions": self._stats["evictions"],
+            "entries": self._entries,
+        }
+
+@lru_cache(maxsize=1)
+def get_llm_response_cache() -> LlmResponseCache:
+    """
+    Returns the process-wide LLM response cache
+    """
+    cache = LlmResponseCache()
+    metrics_registry.register_collector("llm_cache", cache.get_stats)
+    return cache
@@ -0,0 +1,118 @@
+"""
+Factory for the LiteLlm models used by the PersonaGym agents
+
+Models are shared: agents using the same model name, cache setting, priority and stage get the same model instance.
+The LiteLlm model behind each instance is only built on its first call, so importing the agents does not import
+LiteLLM. Servers call `preload_llm_models` in the background once they are up to take the import off the first request.
+"""
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from pydantic import PrivateAttr
+
+import os
+import threading
+from typing import AsyncGenerator, Callable
+
+from src.utils.cassette import CassetteLlm, get_cassette
+from src.utils.llm_cache import LLM_CACHE_ENABLED
+from src.utils.llm_scheduler import StagePriority
+
+# Optional function overriding how models are created, e.g. to run the agents against a local stub model.
+# It receives the name of the model environment variable and must be set before the agents are imported.
+_model_provider: Callable[[str], BaseLlm] | None = None
+# Shared models keyed by model name, cache setting, priority and stage
+_models: dict[tuple, BaseLlm] = {}
+_models_lock = threading.Lock()
+
+class LazyLiteLlm(BaseLlm):
+    """
+    LiteLlm model that builds the scheduled, resilient (and optionally cached) LiteLlm model on its first call
+    """
+
+    cache: bool = False
+    priority: int = StagePriority.NORMAL
+    stage: str = "default"
+    _llm: BaseLlm | None = PrivateAttr(default=None)
+    # The model is built either by the warm-up thread or by the first call on the event loop, whichever comes first
+    _llm_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def get_llm(self) -> BaseLlm:
+        """
+        Returns the LiteLlm model, building it on first use
+        """
+        if self._llm is None:
+            with self._llm_lock:
+                if self._llm is None:
+                    # LiteLLM is imported on the first model call rather than with the agents
+                    from src.utils.llm_models import CachedLiteLlm, ResilientLiteLlm
+                    model_class = CachedLiteLlm if self.cache and LLM_CACHE_ENABLED else ResilientLiteLlm
+                    self._llm = model_class(model=self.model, priority=self.priority, stage=self.stage)
+        return self._llm
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        async for llm_response in self.get_llm().generate_content_async(llm_request, stream=stream):
+            yield llm_response
+
+    def connect(self, llm_request: LlmRequest):
+        return self.get_llm().connect(llm_request)
+
+def set_model_provider(provider: Callable[[str], BaseLlm] | None) -> None:
+    """
+    Overrides the models created by `create_llm`, or restores the default LiteLlm models when set to None
+    """
+    global _model_provider
+    _model_provider = provider
+    with _models_lock:
+        _models.clear()
+
+def create_llm(
+        model_env_var: str,
+        cache: bool = False,
+        priority: StagePriority = StagePriority.NORMAL,
+        stage: str = "default"
+) -> BaseLlm:
+    """
+    Returns the LiteLlm model configured by the given environment variable. Its calls go through the LLM scheduler
+    and follow the resilience policy (timeouts, hedging and retries) of the given stage.
+
+    Args:
+        model_env_var: Name of the environment variable holding the LiteLlm model name
+        cache: Set to True to serve repeated requests from the LLM response cache (when LLM_CACHE_ENABLED is set)
+        priority: Scheduling priority of the model's calls, stages on the critical path should use a higher priority
+        stage: Name of the stage the model is used for, selecting its resilience policy
+    """
+    model = model_env_var if _model_provider is not None else os.environ[model_env_var]
+    key = (model, cache, int(priority), stage)
+    with _models_lock:
+        if key not in _models:
+            if _model_provider is not None:
+                llm = _model_provider(model_env_var)
+            else:
+                llm = LazyLiteLlm(model=model, cache=cache, priority=priority, stage=stage)
+            # Records or replays the model's traffic when CASSETTE_MODE is set
+            _models[key] = CassetteLlm(model=llm.model, llm=llm) if get_cassette() is not None else llm
+        return _models[key]
+
+def get_retriable_llm_errors() -> tuple[type[Exception], ...]:
+    """
+    Returns the transient model errors worth retrying
+    """
+    from src.utils.llm_models import RETRIABLE_LLM_ERRORS
+    return RETRIABLE_LLM_ERRORS
+
+def preload_llm_models() -> None:
+    """
+    Imports LiteLLM and builds the LiteLlm model of every model created so far
+    """
+    with _models_lock:
+        models = list(_models.values())
+    for model in models:
+        if isinstance(model, CassetteLlm):
+            # Replayed models never call the model they wrap
+            if get_cassette().mode == "replay":
+                continue
+            model = model.llm
+        if isinstance(model, LazyLiteLlm):
+            model.get_llm()
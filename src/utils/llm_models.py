@@ -0,0 +1,177 @@
+"""
+LiteLlm models of the PersonaGym agents
+
+`ScheduledLiteLlm` admits each call through the process-wide LLM scheduler, `ResilientLiteLlm` adds the adaptive
+timeouts, hedging and retries of its stage, and `CachedLiteLlm` serves repeated requests from the LLM response cache.
+Importing this module imports LiteLLM, which takes seconds, so it is only imported by `llm_factory` when the first
+model call is made.
+"""
+
+from google.adk.models.lite_llm import LiteLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from litellm.exceptions import (
+    APIConnectionError,
+    BadGatewayError,
+    InternalServerError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
+
+import logging
+from typing import AsyncGenerator
+
+from src.utils.instrumentation import record_retry
+from src.utils.llm_cache import get_llm_response_cache, make_cache_key
+from src.utils.llm_scheduler import (
+    LLM_RATE_LIMIT_COOLDOWN,
+    LLM_SCHEDULER_ENABLED,
+    ModelScheduler,
+    StagePriority,
+    estimate_prompt_tokens,
+    get_llm_scheduler,
+)
+from src.utils.resilience import RESILIENCE_ENABLED, call_with_resilience
+
+logger = logging.getLogger(__name__)
+
+# Transient model errors worth retrying
+RETRIABLE_LLM_ERRORS = (
+    TimeoutError,
+    APIConnectionError,
+    BadGatewayError,
+    InternalServerError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
+
+class ScheduledLiteLlm(LiteLlm):
+    """
+    LiteLlm model whose calls are admitted by the process-wide LLM scheduler
+    """
+
+    priority: int = StagePriority.NORMAL
+
+    async def _generate_admitted(
+            self,
+            llm_request: LlmRequest,
+            stream: bool,
+            scheduler: ModelScheduler | None
+    ) -> AsyncGenerator[LlmResponse, None]:
+        """
+        Sends a call that holds a slot of the scheduler, charging its completion tokens and pausing the scheduler on
+        a provider rate limit
+        """
+        if scheduler is None:
+            async for llm_response in super().generate_content_async(llm_request, stream=stream):
+                yield llm_response
+            return
+
+        completion_tokens = 0
+        try:
+            async for llm_response in super().generate_content_async(llm_request, stream=stream):
+                if llm_response.usage_metadata and llm_response.usage_metadata.candidates_token_count:
+                    completion_tokens = llm_response.usage_metadata.candidates_token_count
+                yield llm_response
+        except RateLimitError:
+            logger.warning(f"Rate limit reached for model {self.model}, pausing its queue for {LLM_RATE_LIMIT_COOLDOWN}s")
+            scheduler.pause(LLM_RATE_LIMIT_COOLDOWN)
+            raise
+        finally:
+            scheduler.charge(completion_tokens)
+
+    def _get_scheduler(self) -> ModelScheduler | None:
+        return get_llm_scheduler().get(self.model) if LLM_SCHEDULER_ENABLED else None
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        scheduler = self._get_scheduler()
+        if scheduler is None:
+            async for llm_response in self._generate_admitted(llm_request, stream, None):
+                yield llm_response
+            return
+
+        await scheduler.acquire(self.priority, estimate_prompt_tokens(llm_request))
+        try:
+            async for llm_response in self._generate_admitted(llm_request, stream, scheduler):
+                yield llm_response
+        finally:
+            scheduler.release()
+
+class SchedulerAdmission:
+    """
+    Admission of the attempts and hedged duplicates of a resilient call through the scheduler of its model
+    """
+
+    def __init__(self, scheduler: ModelScheduler, priority: int, estimated_tokens: float):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.estimated_tokens = estimated_tokens
+
+    async def acquire(self) -> None:
+        await self.scheduler.acquire(self.priority, self.estimated_tokens)
+
+    def try_acquire(self) -> bool:
+        return self.scheduler.try_acquire(self.estimated_tokens)
+
+    def release(self) -> None:
+        self.scheduler.release()
+
+class ResilientLiteLlm(ScheduledLiteLlm):
+    """
+    LiteLlm model whose calls have adaptive timeouts, hedging and retries, following the policy of its stage.
+
+    Each attempt is admitted by the scheduler before its timeout starts, so time spent queued is neither timed out
+    nor counted in the latencies the timeouts and hedges derive from.
+    """
+
+    stage: str = "default"
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        # Streamed responses cannot be hedged or retried once partial responses have been yielded
+        if stream or not RESILIENCE_ENABLED:
+            async for llm_response in super().generate_content_async(llm_request, stream=stream):
+                yield llm_response
+            return
+
+        scheduler = self._get_scheduler()
+
+        async def call() -> list[LlmResponse]:
+            return [llm_response async for llm_response in self._generate_admitted(llm_request, False, scheduler)]
+
+        llm_responses = await call_with_resilience(
+            call,
+            key=self.model,
+            stage=self.stage,
+            retry_on=RETRIABLE_LLM_ERRORS,
+            on_retry=lambda: record_retry(self.model),
+            admission=SchedulerAdmission(scheduler, self.priority, estimate_prompt_tokens(llm_request)) if scheduler else None
+        )
+        for llm_response in llm_responses:
+            yield llm_response
+
+class CachedLiteLlm(ResilientLiteLlm):
+    """
+    LiteLlm model that serves repeated requests from the LLM response cache, only scheduling the cache misses
+    """
+
+    async def generate_content_async(self, llm_request: LlmRequest, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        cache = get_llm_response_cache()
+        key = make_cache_key(self.model, llm_request)
+
+        cached_response = await cache.get_async(key)
+        if cached_response is not None:
+            logger.debug(f"LLM cache hit for model {self.model}: {key}")
+            yield LlmResponse.model_validate_json(cached_response)
+            return
+
+        final_response = None
+        async for llm_response in super().generate_content_async(llm_request, stream=stream):
+            if not llm_response.partial:
+                final_response = llm_response
+            yield llm_response
+
+        # Only complete, successful responses are cached
+        if final_response is not None and final_response.content and not final_response.error_code:
+            await cache.set_async(key, final_response.model_dump_json(exclude_none=True))
@@ -0,0 +1,267 @@
+"""
+Process-wide scheduler of LiteLlm calls
+
+Every model call acquires a slot from the scheduler of its model before it is sent. Each model has token buckets for
+requests/min and tokens/min, a bound on the number of concurrent calls, and a priority queue so that stages on the
+critical path of an evaluation are served first when calls are queued. A provider rate limit error pauses the model's
+queue for a cooldown period instead of letting every waiting call fail in turn.
+
+Limits are configured per model name with the LLM_RATE_LIMITS environment variable, e.g.
+    LLM_RATE_LIMITS='{"nebius/openai/gpt-oss-120b": {"rpm": 600, "tpm": 400000, "max_concurrency": 16}, "default": {"max_concurrency": 8}}'
+"""
+
+from google.adk.models.llm_request import LlmRequest
+from pydantic import BaseModel
+
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import re
+import time
+from enum import IntEnum
+from functools import lru_cache
+from dotenv import load_dotenv
+
+from src.utils.instrumentation import LATENCY_BUCKETS, metrics_registry
+
+load_dotenv()
+
+LLM_SCHEDULER_ENABLED = os.getenv("LLM_SCHEDULER_ENABLED", "true").lower() == "true"
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "{}")
+# Maximum number of concurrent calls to a model without configured limits
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Seconds for which a model's queue is paused after the provider returns a rate limit error
+LLM_RATE_LIMIT_COOLDOWN = float(os.getenv("LLM_RATE_LIMIT_COOLDOWN", "5"))
+
+class StagePriority(IntEnum):
+    """
+    Priority of a model call, lower values are served first
+    """
+    # Stages every evaluation task waits on, e.g. settings selection
+    CRITICAL = 0
+    # Stages completing a task result, e.g. rubric formatting and evaluation
+    HIGH = 1
+    # Stages starting new work, e.g. question generation
+    NORMAL = 2
+    LOW = 3
+
+class RateLimits(BaseModel):
+    rpm: float | None = None
+    tpm: float | None = None
+    max_concurrency: int = LLM_MAX_CONCURRENCY
+
+def load_rate_limits(config: str = LLM_RATE_LIMITS) -> dict[str, RateLimits]:
+    """
+    Parses the per-model rate limits, keyed by model name or "default"
+    """
+    return {model: RateLimits.model_validate(limits) for model, limits in json.loads(config or "{}").items()}
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`, holding at most one minute of tokens.
+
+    Consuming more tokens than are available is allowed once the bucket is full, leaving it in debt, so that a
+    single request larger than the bucket capacity is never blocked forever.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self._rate = rate_per_minute / 60
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Returns the number of seconds until `amount` tokens can be consumed
+        """
+        self._refill()
+        needed = min(amount, self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self._rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+class ModelScheduler:
+    """
+    Admits calls to one model in priority order within its concurrency, requests/min and tokens/min limits
+    """
+
+    def __init__(self, model: str, limits: RateLimits):
+        self.model = model
+        self.limits = limits
+        self._request_bucket = TokenBucket(limits.rpm) if limits.rpm else None
+        self._token_bucket = TokenBucket(limits.tpm) if limits.tpm else None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._waiters: list[tuple[int, int, float, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+        self._wakeup: asyncio.TimerHandle | None = None
+
+    def _bind_to_running_loop(self) -> None:
+        # Futures and timers cannot be shared across event loops, so start afresh when the loop changes
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._waiters = []
+        self._active = 0
+        self._wakeup = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def _wait_time(self, estimated_tokens: float) -> float:
+        wait_time = max(0.0, self._paused_until - time.monotonic())
+        if self._request_bucket:
+            wait_time = max(wait_time, self._request_bucket.wait_time(1))
+        if self._token_bucket:
+            wait_time = max(wait_time, self._token_bucket.wait_time(estimated_tokens))
+        return wait_time
+
+    def _dispatch(self) -> None:
+        self._wakeup = None
+        while self._waiters and self._active < self.limits.max_concurrency:
+            _, _, estimated_tokens, future = self._waiters[0]
+            if future.done():
+                # The caller was cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+
+            # Only the head of the queue is admitted, so large low-priority calls cannot be starved by small ones
+            wait_time = self._wait_time(estimated_tokens)
+            if wait_time > 0:
+                self._wakeup = self._loop.call_later(wait_time, self._dispatch)
+                return
+
+            heapq.heappop(self._waiters)
+            if self._request_bucket:
+                self._request_bucket.consume(1)
+            if self._token_bucket:
+                self._token_bucket.consume(estimated_tokens)
+            self._active += 1
+            future.set_result(None)
+
+    def _schedule_dispatch(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._dispatch()
+
+    async def acquire(self, priority: int = StagePriority.NORMAL, estimated_tokens: float = 0) -> None:
+        """
+        Waits until a call with the given priority and estimated prompt tokens may be sent
+        """
+        self._bind_to_running_loop()
+        start_time = time.monotonic()
+        future = self._loop.create_future()
+        heapq.heappush(self._waiters, (int(priority), next(self._sequence), estimated_tokens, future))
+        self._schedule_dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before the caller was cancelled
+                self.release()
+            raise
+        metrics_registry.observe(
+            "personagym_llm_scheduler_wait_seconds", time.monotonic() - start_time, LATENCY_BUCKETS,
+            "Time model calls waited in the scheduler queue", model=self.model, priority=StagePriority(priority).name.lower()
+        )
+
+    def try_acquire(self, estimated_tokens: float = 0) -> bool:
+        """
+        Takes a slot only if it can be granted right away without overtaking queued calls, e.g. for hedged duplicates
+        """
+        self._bind_to_running_loop()
+        if self._waiters or self._active >= self.limits.max_concurrency or self._wait_time(estimated_tokens) > 0:
+            return False
+        if self._request_bucket:
+            self._request_bucket.consume(1)
+        if self._token_bucket:
+            self._token_bucket.consume(estimated_tokens)
+        self._active += 1
+        return True
+
+    def charge(self, completion_tokens: float) -> None:
+        """
+        Charges the completion tokens of a call to the tokens/min bucket
+        """
+        if self._token_bucket and completion_tokens:
+            self._token_bucket.consume(completion_tokens)
+
+    def release(self, completion_tokens: float = 0) -> None:
+        """
+        Releases a slot, charging the completion tokens of the call to the tokens/min bucket
+        """
+        self._active = max(0, self._active - 1)
+        self.charge(completion_tokens)
+        self._schedule_dispatch()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stops admitting calls for the given number of seconds, e.g. after a provider rate limit error
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        metrics_registry.increment(
+            "personagym_llm_scheduler_rate_limited_total", "Model calls rejected by the provider rate limit", model=self.model
+        )
+
+class LlmScheduler:
+    """
+    Registry of the schedulers of each model
+    """
+
+    def __init__(self, rate_limits: dict[str, RateLimits] | None = None):
+        self._rate_limits = rate_limits if rate_limits is not None else load_rate_limits()
+        self._schedulers: dict[str, ModelScheduler] = {}
+
+    def get(self, model: str) -> ModelScheduler:
+        scheduler = self._schedulers.get(model)
+        if scheduler is None:
+            limits = self._rate_limits.get(model) or self._rate_limits.get("default") or RateLimits()
+            scheduler = self._schedulers[model] = ModelScheduler(model, limits)
+        return scheduler
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Returns the queue depth and number of active calls of each model
+        """
+        stats = {}
+        for model, scheduler in self._schedulers.items():
+            model_label = re.sub(r"[^a-zA-Z0-9_]", "_", model)
+            stats[f"{model_label}_queue_depth"] = scheduler.queue_depth
+            stats[f"{model_label}_active"] = scheduler.active
+        return stats
+
+@lru_cache(maxsize=1)
+def get_llm_scheduler() -> LlmScheduler:
+    """
+    Returns the process-wide LLM scheduler
+    """
+    scheduler = LlmScheduler()
+    metrics_registry.register_collector("llm_scheduler", scheduler.get_stats)
+    return scheduler
+
+def estimate_prompt_tokens(llm_request: LlmRequest) -> int:
+    """
+    Roughly estimates the prompt tokens of a request at 4 characters per token
+    """
+    config = llm_request.config
+    system_instruction = config.system_instruction if config else None
+    characters = len(system_instruction) if isinstance(system_instruction, str) else 0
+    for content in llm_request.contents:
+        characters += sum(len(part.text) for part in content.parts or [] if part.text)
+    return characters // 4
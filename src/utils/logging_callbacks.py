@@ -3,9 +3,13 @@ Logging callback functions for ADK agents
 """
 
 from google.adk.agents.callback_context import CallbackContext
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
 
 import logging
 
+from src.utils.instrumentation import record_agent_end, record_agent_start, record_model_request, record_model_response
+
 logger = logging.getLogger(__name__)
 
 def pre_agent_logging_callback(callback_context: CallbackContext) -> None:
@@ -16,6 +20,7 @@ def pre_agent_logging_callback(callback_context: CallbackContext) -> None:
     agent_name = callback_context.agent_name
     invocation_id = callback_context.invocation_id
     logger.info(f"[{invocation_id}] Agent invoked: {agent_name}.")
+    record_agent_start(callback_context)
 
 def post_agent_logging_callback(callback_context: CallbackContext) -> None:
     """
@@ -25,3 +30,22 @@ def post_agent_logging_callback(callback_context: CallbackContext) -> None:
     agent_name = callback_context.agent_name
     invocation_id = callback_context.invocation_id
     logger.info(f"[{invocation_id}] Agent invocation completed for agent: {agent_name}")
+    record_agent_end(callback_context)
+
+def pre_model_logging_callback(callback_context: CallbackContext, llm_request: LlmRequest) -> None:
+    """
+    Callback function that runs before an agent calls its model to log and time the model call
+    """
+
+    logger.debug(f"[{callback_context.invocation_id}] Model call started for agent: {callback_context.agent_name} ({llm_request.model})")
+    record_model_request(callback_context, llm_request)
+
+def post_model_logging_callback(callback_context: CallbackContext, llm_response: LlmResponse) -> None:
+    """
+    Callback function that runs after an agent receives a model response to log and record latency and token usage of the model call
+    """
+
+    if not llm_response.partial:
+        logger.debug(f"[{callback_context.invocation_id}] Model call completed for agent: {callback_context.agent_name}")
+    record_model_response(callback_context, llm_response)
+
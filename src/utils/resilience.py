@@ -0,0 +1,216 @@
+"""
+Adaptive timeouts, hedged requests and jittered retries for model and A2A calls
+
+Latency percentiles are tracked per model and per A2A endpoint. Once enough calls have been observed, each call gets a
+timeout derived from the p99 latency, and a hedged duplicate is sent if the call has not completed after the p95
+latency, taking whichever succeeds first. Failed or timed out calls are retried with full-jitter exponential backoff.
+Calls admitted by a scheduler acquire a slot before each attempt, and their timeouts and latencies only cover the time
+after the slot was granted. Hedged duplicates are only sent if a slot is free right away.
+
+Policies are configured per stage with the RESILIENCE_POLICIES environment variable, keyed by stage name or "default",
+e.g. RESILIENCE_POLICIES='{"default": {"max_retries": 2}, "evaluator": {"timeout": 180, "hedge": false}}'
+"""
+
+from pydantic import BaseModel
+
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Awaitable, Callable, Protocol, TypeVar
+from dotenv import load_dotenv
+
+from src.utils.instrumentation import metrics_registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RESILIENCE_ENABLED = os.getenv("RESILIENCE_ENABLED", "true").lower() == "true"
+RESILIENCE_POLICIES = os.getenv("RESILIENCE_POLICIES", "{}")
+# Number of recent latencies kept per model or endpoint, and the number needed before timeouts and hedging adapt
+LATENCY_WINDOW = int(os.getenv("RESILIENCE_LATENCY_WINDOW", "200"))
+LATENCY_MIN_SAMPLES = int(os.getenv("RESILIENCE_LATENCY_MIN_SAMPLES", "20"))
+
+class ResiliencePolicy(BaseModel):
+    # Upper bound of the timeout, used as is until enough latencies have been observed
+    timeout: float = 300
+    # Lower bound of the adaptive timeout
+    min_timeout: float = 30
+    # The adaptive timeout is the p99 latency times this multiplier
+    timeout_multiplier: float = 3
+    hedge: bool = True
+    hedge_percentile: float = 0.95
+    max_retries: int = 2
+    backoff_base: float = 1
+    backoff_max: float = 30
+
+def load_resilience_policies(config: str = RESILIENCE_POLICIES) -> dict[str, ResiliencePolicy]:
+    """
+    Parses the per-stage policies, the settings of each stage override those of the "default" policy
+    """
+    raw_policies = json.loads(config or "{}")
+    default = raw_policies.get("default", {})
+    policies = {stage: ResiliencePolicy.model_validate({**default, **policy}) for stage, policy in raw_policies.items()}
+    policies.setdefault("default", ResiliencePolicy())
+    return policies
+
+_policies = load_resilience_policies()
+
+def get_resilience_policy(stage: str) -> ResiliencePolicy:
+    return _policies.get(stage) or _policies["default"]
+
+class LatencyTracker:
+    """
+    Rolling window of the latencies of successful calls, per model or endpoint
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW, min_samples: int = LATENCY_MIN_SAMPLES):
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+        self._latencies: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, key: str, latency: float) -> None:
+        with self._lock:
+            self._latencies[key].append(latency)
+
+    def percentile(self, key: str, fraction: float) -> float | None:
+        """
+        Returns the latency percentile, or None until enough latencies have been observed
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(key, ()))
+        if len(latencies) < self._min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+    def adaptive_timeout(self, key: str, policy: ResiliencePolicy) -> float:
+        p99 = self.percentile(key, 0.99)
+        if p99 is None:
+            return policy.timeout
+        return min(policy.timeout, max(policy.min_timeout, p99 * policy.timeout_multiplier))
+
+    def hedge_delay(self, key: str, policy: ResiliencePolicy) -> float | None:
+        return self.percentile(key, policy.hedge_percentile) if policy.hedge else None
+
+    def get_stats(self) -> dict[str, float]:
+        """
+        Returns the p50, p95 and p99 latency of each model and endpoint
+        """
+        with self._lock:
+            keys = list(self._latencies)
+        stats = {}
+        for key in keys:
+            label = re.sub(r"[^a-zA-Z0-9_]", "_", key)
+            for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                value = self.percentile(key, fraction)
+                if value is not None:
+                    stats[f"{label}_{name}_seconds"] = round(value, 4)
+        return stats
+
+class Admission(Protocol):
+    """
+    Slots of a scheduler admitting the attempts of a call
+    """
+
+    async def acquire(self) -> None: ...
+
+    def try_acquire(self) -> bool: ...
+
+    def release(self) -> None: ...
+
+latency_tracker = LatencyTracker()
+metrics_registry.register_collector("latency", latency_tracker.get_stats)
+
+async def _timed(key: str, call: Callable[[], Awaitable[T]]) -> T:
+    start_time = time.monotonic()
+    result = await call()
+    latency_tracker.record(key, time.monotonic() - start_time)
+    return result
+
+async def _hedged(key: str, call: Callable[[], Awaitable[T]], hedge_delay: float | None, admission: Admission | None = None) -> T:
+    """
+    Runs the call, starting a duplicate if it has not completed after `hedge_delay`, and returns the first success
+    """
+    first = asyncio.ensure_future(_timed(key, call))
+    tasks = {first}
+    try:
+        if hedge_delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done and admission is not None and not admission.try_acquire():
+                # Queueing the duplicate behind other calls would only add load to a saturated model
+                metrics_registry.increment("personagym_hedges_skipped_total", "Hedged requests skipped for lack of a free slot", key=key)
+            elif not done:
+                metrics_registry.increment("personagym_hedged_requests_total", "Hedged duplicate requests sent", key=key)
+                hedge = asyncio.ensure_future(_timed(key, call))
+                if admission is not None:
+                    hedge.add_done_callback(lambda _: admission.release())
+                tasks.add(hedge)
+
+        while True:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            errors = [task.exception() for task in done if task.exception() is not None]
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        metrics_registry.increment("personagym_hedge_wins_total", "Hedged requests completing first", key=key)
+                    return task.result()
+            if not tasks:
+                raise errors[0]
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def call_with_resilience(
+        call: Callable[[], Awaitable[T]],
+        key: str,
+        stage: str = "default",
+        hedge: bool = True,
+        retry_on: tuple[type[BaseException], ...] = (TimeoutError,),
+        on_retry: Callable[[], None] | None = None,
+        admission: Admission | None = None
+) -> T:
+    """
+    Runs the call with an adaptive timeout, optional hedging and jittered retries.
+
+    Args:
+        call: Function starting a new attempt of the call, it may be invoked several times concurrently when hedging
+        key: Model name or endpoint whose latencies are tracked
+        stage: Name of the stage whose resilience policy applies
+        hedge: Set to False for calls that must not be duplicated
+        retry_on: Exceptions that are retried, including TimeoutError for calls timed out by the adaptive timeout
+        on_retry: Function called before each retry
+        admission: Scheduler slots held by each attempt and hedged duplicate, acquired before the timeout starts
+    """
+    policy = get_resilience_policy(stage)
+    for attempt in range(policy.max_retries + 1):
+        if admission is not None:
+            await admission.acquire()
+        timeout = latency_tracker.adaptive_timeout(key, policy)
+        hedge_delay = latency_tracker.hedge_delay(key, policy) if hedge else None
+        try:
+            return await asyncio.wait_for(_hedged(key, call, hedge_delay, admission), timeout)
+        except retry_on as e:
+            if attempt == policy.max_retries:
+                raise
+            error = e
+        finally:
+            # The slot is not held during the backoff
+            if admission is not None:
+                admission.release()
+
+        backoff = random.uniform(0, min(policy.backoff_max, policy.backoff_base * 2 ** attempt))
+        logger.warning(
+            f"[{stage}] Call to {key} failed ({type(error).__name__}: {str(error) or f'timed out after {timeout:.1f}s'}), "
+            f"retrying in {backoff:.1f}s ({attempt + 1}/{policy.max_retries})"
+        )
+        if on_retry:
+            on_retry()
+        await asyncio.sleep(backoff)
@@ -0,0 +1,154 @@
+"""
+In-memory session store with bounded memory for long-running A2A servers
+
+ADK's `InMemorySessionService` keeps the session and the full event history of every A2A context for the lifetime of
+the process. `BoundedInMemorySessionService` evicts sessions that have been idle for longer than SESSION_TTL_SECONDS,
+evicts the least recently used sessions beyond SESSION_MAX_COUNT and keeps only the last SESSION_MAX_EVENTS events of
+each session, so the memory held by the sessions stays flat however long the server runs. A request for an evicted
+session starts a new session. Set a limit to 0 to disable it.
+"""
+
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService, Session
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+from dotenv import load_dotenv
+
+from src.utils.instrumentation import metrics_registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Seconds after its last use at which a session is evicted
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+# Maximum number of sessions kept in memory, the least recently used sessions are evicted beyond it
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "1000"))
+# Maximum number of events kept per session, older events are dropped
+SESSION_MAX_EVENTS = int(os.getenv("SESSION_MAX_EVENTS", "200"))
+
+SessionKey = tuple[str, str, str]
+
+class BoundedInMemorySessionService(InMemorySessionService):
+    """
+    In-memory session service with an idle TTL, a maximum session count with LRU eviction and a maximum number of
+    events per session
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = SESSION_TTL_SECONDS,
+        max_sessions: int = SESSION_MAX_COUNT,
+        max_events: int = SESSION_MAX_EVENTS
+    ):
+        super().__init__()
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_events = max_events
+        # Last use of each session, least recently used first
+        self._last_used: OrderedDict[SessionKey, float] = OrderedDict()
+        self._evicted = {"expired": 0, "lru": 0}
+        self._trimmed_events = 0
+
+    def _touch(self, key: SessionKey) -> None:
+        self._last_used[key] = time.monotonic()
+        self._last_used.move_to_end(key)
+
+    def _evict(self, key: SessionKey, reason: str) -> None:
+        self._last_used.pop(key, None)
+        app_name, user_id, session_id = key
+        user_sessions = self.sessions.get(app_name, {}).get(user_id)
+        if user_sessions is None or user_sessions.pop(session_id, None) is None:
+            return
+        if not user_sessions:
+            del self.sessions[app_name][user_id]
+        self._evicted[reason] += 1
+        logger.debug(f"Evicted session {session_id} of {app_name}/{user_id} ({reason})")
+
+    def _evict_sessions(self, keep: Optional[SessionKey] = None) -> None:
+        """
+        Evicts the expired sessions, then the least recently used sessions beyond the maximum session count
+        """
+        if self.ttl_seconds > 0:
+            expiry = time.monotonic() - self.ttl_seconds
+            # Sessions are ordered by last use, so the expired sessions are at the front
+            while self._last_used:
+                key, last_used = next(iter(self._last_used.items()))
+                if last_used > expiry:
+                    break
+                self._evict(key, "expired")
+        if self.max_sessions > 0:
+            for key in list(self._last_used):
+                if len(self._last_used) <= self.max_sessions:
+                    break
+                if key != keep:
+                    self._evict(key, "lru")
+
+    def _trim_events(self, session: Session) -> None:
+        excess = len(session.events) - self.max_events
+        if self.max_events > 0 and excess > 0:
+            del session.events[:excess]
+            self._trimmed_events += excess
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session = await super().create_session(app_name=app_name, user_id=user_id, state=state, session_id=session_id)
+        key = (app_name, user_id, session.id)
+        self._touch(key)
+        self._evict_sessions(keep=key)
+        return session
+
+    async def get_session(self, *, app_name: str, user_id: str, session_id: str, config=None) -> Optional[Session]:
+        self._evict_sessions()
+        session = await super().get_session(app_name=app_name, user_id=user_id, session_id=session_id, config=config)
+        if session is not None:
+            self._touch((app_name, user_id, session_id))
+        return session
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        self._last_used.pop((app_name, user_id, session_id), None)
+        await super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        event = await super().append_event(session=session, event=event)
+        key = (session.app_name, session.user_id, session.id)
+        storage_session = self.sessions.get(session.app_name, {}).get(session.user_id, {}).get(session.id)
+        if storage_session is not None and not event.partial:
+            self._touch(key)
+            # Only the stored copy is trimmed, the running invocation keeps its complete history
+            self._trim_events(storage_session)
+        return event
+
+    def get_stats(self) -> dict[str, float]:
+        """
+        Returns the number of live sessions and the number of evicted sessions and dropped events
+        """
+        return {
+            "live": len(self._last_used),
+            "evicted_expired": self._evicted["expired"],
+            "evicted_lru": self._evicted["lru"],
+            "evicted": sum(self._evicted.values()),
+            "events_trimmed": self._trimmed_events,
+        }
+
+def create_bounded_session_service(name: str = "sessions") -> BoundedInMemorySessionService:
+    """
+    Creates a bounded in-memory session service whose stats are exposed as `personagym_<name>_*` gauges
+    """
+    session_service = BoundedInMemorySessionService()
+    metrics_registry.register_collector(name, session_service.get_stats)
+    logger.info(
+        f"Using in-memory session store: ttl={session_service.ttl_seconds}s, max_sessions={session_service.max_sessions}, "
+        f"max_events={session_service.max_events}"
+    )
+    return session_service
@@ -0,0 +1,88 @@
+"""
+Local lexical index of the PersonaGym settings
+
+Each setting is vectorized with TF-IDF weighted word and character n-gram features, hashed into a fixed number of
+dimensions, when the index is built. A persona description is scored against all settings with a single matrix-vector
+product, so candidate settings can be selected in well under a millisecond without calling a model.
+"""
+
+import re
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+from src.utils.data_registry import get_data_registry
+
+# Number of hashed feature dimensions
+INDEX_DIMENSIONS = 4096
+# Character n-gram sizes, taken within each word padded with boundary markers
+CHAR_NGRAM_SIZES = (3, 4, 5)
+# Weight of the character n-gram features relative to whole words
+CHAR_NGRAM_WEIGHT = 0.3
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "has", "have", "he", "her", "his", "in",
+    "is", "it", "its", "of", "on", "or", "she", "that", "the", "their", "they", "this", "to", "who", "with",
+})
+
+def _features(text: str) -> list[tuple[str, float]]:
+    features = []
+    for word in TOKEN_PATTERN.findall(text.lower()):
+        if word in STOP_WORDS:
+            continue
+        features.append((f"w:{word}", 1.0))
+        padded = f"<{word}>"
+        for size in CHAR_NGRAM_SIZES:
+            features.extend((f"c:{padded[i:i + size]}", CHAR_NGRAM_WEIGHT) for i in range(len(padded) - size + 1))
+    return features
+
+class SettingsIndex:
+    """
+    Hashed TF-IDF index of the settings, scoring a text by its cosine similarity to each setting
+    """
+
+    def __init__(self, settings: list[str], dimensions: int = INDEX_DIMENSIONS):
+        self.settings = list(settings)
+        self._dimensions = dimensions
+
+        counts = np.stack([self._count(setting) for setting in self.settings])
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self._idf = (np.log((1 + len(self.settings)) / (1 + document_frequency)) + 1).astype(np.float32)
+        self._matrix = self._normalize(counts * self._idf)
+
+    def _count(self, text: str) -> np.ndarray:
+        vector = np.zeros(self._dimensions, dtype=np.float32)
+        for feature, weight in _features(text):
+            # crc32 is used rather than hash() so that the hashing is stable across processes
+            vector[zlib.crc32(feature.encode()) % self._dimensions] += weight
+        return vector
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def score(self, text: str) -> np.ndarray:
+        """
+        Returns the cosine similarity of the text to each setting
+        """
+        return self._matrix @ self._normalize(self._count(text) * self._idf)
+
+    def search(self, text: str, k: int) -> list[tuple[str, float]]:
+        """
+        Returns the k settings most similar to the text with their scores, most similar first
+        """
+        scores = self.score(text)
+        k = min(k, len(self.settings))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.settings[i], float(scores[i])) for i in top]
+
+@lru_cache(maxsize=1)
+def get_settings_index() -> SettingsIndex:
+    """
+    Returns the index of the settings in the data registry, built on first use
+    """
+    return SettingsIndex(get_data_registry().settings)
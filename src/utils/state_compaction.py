@@ -0,0 +1,71 @@
+"""
+Compaction of the session state and event history between workflow stages
+
+Intermediate outputs (rubrics, examples, persona responses, ...) are only needed until the stage consuming them has
+finished. A state compaction agent placed after the consuming stage drops these keys from the session state and prunes
+the content and state deltas of the workflow's events, so the memory held by a running evaluation stays bounded by
+its final outputs rather than growing with every stage. With a persistent session store the pruned events remain in
+the database; only the in-memory copies are compacted.
+"""
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+
+import logging
+import os
+from typing import AsyncGenerator
+from dotenv import load_dotenv
+
+from src.utils.instrumentation import metrics_registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STATE_COMPACTION_ENABLED = os.getenv("STATE_COMPACTION_ENABLED", "true").lower() == "true"
+
+class StateCompactionAgent(BaseAgent):
+    """
+    Non-LLM agent that drops the given keys from the session state and prunes the events of its branch
+    """
+    keys: list[str]
+
+    def _prune_events(self, ctx: InvocationContext) -> int:
+        pruned = 0
+        for event in ctx.session.events:
+            if event.invocation_id != ctx.invocation_id or not event.branch or not (
+                    event.branch == ctx.branch or event.branch.startswith(f"{ctx.branch}.")):
+                continue
+            state_delta = event.actions.state_delta if event.actions else {}
+            if event.content is None and not any(key in state_delta for key in self.keys):
+                continue
+            # The stages of the workflow have finished, their outputs are only needed through the session state
+            event.content = None
+            for key in self.keys:
+                state_delta.pop(key, None)
+            pruned += 1
+        return pruned
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        keys = [key for key in self.keys if state.get(key) is not None]
+        pruned = self._prune_events(ctx)
+        metrics_registry.increment("personagym_state_keys_compacted_total", "Session state keys dropped by state compaction", amount=len(keys))
+        logger.debug(f"[{ctx.invocation_id}] Compacted {len(keys)} state keys and {pruned} events of {ctx.branch}")
+
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta={key: None for key in keys})
+        )
+
+def create_state_compaction_agent(name: str, keys: list[str]) -> list[StateCompactionAgent]:
+    """
+    Returns a state compaction agent dropping the given keys, as a list of sub-agents that is empty when
+    STATE_COMPACTION_ENABLED is false
+    """
+    if not STATE_COMPACTION_ENABLED:
+        return []
+    return [StateCompactionAgent(name=name, description="Drops intermediate outputs from the session state", keys=keys)]
@@ -1,3 +1,283 @@
-# Serial Evaluation Workflow
+"""
+Batch evaluation of many personas in-process
+
+Reads personas from a JSONL file and runs the PersonaGym evaluator root agent for each of them through an ADK
+`Runner`, with a configurable number of concurrent evaluations. Each persona is evaluated in its own session and
+its result is saved to the results storage by the score aggregator as soon as it completes. Failed evaluations are
+saved by the workflow.
+
+Usage:
+    PYTHONPATH=src python -m src.workflows.serial_evaluation --input personas.jsonl --persona-agent-url http://127.0.0.1:9020
+
+Sessions are persisted when SESSION_DB_URL is set, so an interrupted run can be resumed with `--resume --run-id <id>`:
+personas already completed in the run are skipped, and the other personas continue from the stages checkpointed in
+their sessions.
+
+Each line of the input file is a JSON object with a "persona" field and optionally "id", "persona_agent_url" and
+"purple_model" fields.
+"""
+
+from google.adk.agents import BaseAgent
+from google.adk.events import Event, EventActions
+from google.adk.runners import Runner
+from google.genai import types
+from pydantic import BaseModel
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import Counter
+from uuid import uuid4
+from dotenv import load_dotenv
+
+from src.agents.personagym_evaluator.sub_agents.results_storage import (
+    RESULTS_STORAGE_PATH,
+    EvaluationRecord,
+    ResultsStorage,
+    get_results_storage,
+    persona_hash,
+    set_results_storage,
+)
+from src.agents.personagym_evaluator.sub_agents.score_aggregator import FINAL_OUTPUT_KEY
+from src.tools.message_tool import client_pool
+from src.utils.checkpoints import RESUME_STATE_KEY, create_session_service
+from src.utils.evaluation_request import (
+    PERSONA_AGENT_URL_STATE_KEY,
+    PERSONA_ID_STATE_KEY,
+    PERSONA_STATE_KEY,
+    PURPLE_MODEL_STATE_KEY,
+    RUN_ID_STATE_KEY,
+)
+
+load_dotenv(verbose=False, override=False)
+
+logger = logging.getLogger(__name__)
+
+APP_NAME = "personagym_batch_evaluation"
+USER_ID = "batch_evaluation"
+DEFAULT_CONCURRENCY = int(os.getenv("BATCH_EVALUATION_CONCURRENCY", "4"))
+
+class PersonaRecord(BaseModel):
+    persona: str
+    id: str | None = None
+    persona_agent_url: str | None = None
+    purple_model: str | None = None
+
+class BatchSummary(BaseModel):
+    run_id: str
+    total: int
+    completed: int
+    failed: int
+    # Personas already completed in a resumed run
+    skipped: int = 0
+    elapsed_seconds: float
+    personas_per_minute: float
+
+def load_personas(path: str) -> list[PersonaRecord]:
+    """
+    Loads the personas to evaluate from a JSONL file
+    """
+    with open(path) as personas_file:
+        return [PersonaRecord.model_validate_json(line) for line in personas_file if line.strip()]
+
 class SerialEvaluationWorkflow:
-    pass
+    """
+    Runs the PersonaGym evaluation workflow for a batch of personas with bounded concurrency
+    """
+
+    def __init__(
+            self,
+            agent: BaseAgent,
+            storage: ResultsStorage | None = None,
+            concurrency: int = DEFAULT_CONCURRENCY,
+            persona_agent_url: str | None = None,
+            run_id: str | None = None,
+            resume: bool = False
+    ):
+        self.agent = agent
+        self.storage = storage or get_results_storage()
+        self.concurrency = concurrency
+        self.persona_agent_url = persona_agent_url
+        self.run_id = run_id or uuid4().hex
+        self.resume = resume
+        self.session_service = create_session_service()
+        # Database session services insert the app and user state rows on first use, so sessions are set up one at a time
+        self._session_setup_lock = asyncio.Lock()
+        self.runner = Runner(agent=agent, app_name=APP_NAME, session_service=self.session_service)
+
+    async def evaluate_persona(self, record: PersonaRecord) -> dict:
+        """
+        Evaluates a single persona in its own session and returns the final output.
+
+        The session is deleted once the evaluation completes. A failed evaluation keeps its session, so that a resumed
+        run continues from the stages it had completed.
+        """
+        persona_agent_url = record.persona_agent_url or self.persona_agent_url
+        if not persona_agent_url:
+            raise ValueError(f"No persona agent url provided for persona: {record.id}")
+
+        state = {
+            RUN_ID_STATE_KEY: self.run_id,
+            PERSONA_ID_STATE_KEY: record.id,
+            PERSONA_STATE_KEY: record.persona,
+            PERSONA_AGENT_URL_STATE_KEY: persona_agent_url
+        }
+        if record.purple_model:
+            state[PURPLE_MODEL_STATE_KEY] = record.purple_model
+        session_id = f"{self.run_id}-{record.id}"
+        async with self._session_setup_lock:
+            session = await self.session_service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+            if session is not None and self.resume:
+                logger.info(f"[{self.run_id}] Resuming evaluation of persona {record.id} from its checkpoint")
+                await self.session_service.append_event(
+                    session, Event(author="user", actions=EventActions(state_delta={RESUME_STATE_KEY: True}))
+                )
+            else:
+                if session is not None:
+                    await self.session_service.delete_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+                session = await self.session_service.create_session(
+                    app_name=APP_NAME, user_id=USER_ID, state=state, session_id=session_id
+                )
+        # The root agent parses its request again, so send the record as JSON rather than free text it could misread
+        request = {"persona": record.persona, "persona_agent_url": persona_agent_url}
+        if record.purple_model:
+            request["purple_model"] = record.purple_model
+        message = types.Content(role="user", parts=[types.Part(text=json.dumps(request))])
+        async for _ in self.runner.run_async(user_id=USER_ID, session_id=session.id, new_message=message):
+            pass
+        session = await self.session_service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session.id)
+        final_output = session.state.get(FINAL_OUTPUT_KEY)
+        if final_output is None:
+            raise RuntimeError(f"Evaluation of persona {record.id} finished without a final output")
+        await self.session_service.delete_session(app_name=APP_NAME, user_id=USER_ID, session_id=session.id)
+        return final_output
+
+    async def run(self, records: list[PersonaRecord]) -> BatchSummary:
+        """
+        Evaluates all personas, saving each failed evaluation to the storage as soon as it fails
+        """
+        for record in records:
+            record.id = record.id or persona_hash(record.persona)
+        # Each persona is evaluated in a session named after its id, so ids must be unique within a run
+        duplicate_ids = sorted(persona_id for persona_id, count in Counter(record.id for record in records).items() if count > 1)
+        if duplicate_ids:
+            raise ValueError(f"Duplicate persona ids in the batch: {', '.join(duplicate_ids[:10])}")
+        self.storage.start_run(self.run_id)
+
+        skipped = 0
+        if self.resume:
+            completed_evaluations = [
+                evaluation for evaluation in self.storage.get_run_evaluations(self.run_id) if evaluation["status"] == "completed"
+            ]
+            # Personas with the same description may be separate jobs, so they are matched by id. Evaluations stored
+            # before persona ids were recorded are matched by their persona description.
+            completed_ids = {evaluation["persona_id"] for evaluation in completed_evaluations if evaluation["persona_id"]}
+            completed_hashes = {evaluation["persona_hash"] for evaluation in completed_evaluations if not evaluation["persona_id"]}
+            pending_records = [
+                record for record in records
+                if record.id not in completed_ids and persona_hash(record.persona) not in completed_hashes
+            ]
+            skipped = len(records) - len(pending_records)
+            logger.info(f"[{self.run_id}] Resuming run, skipping {skipped} personas already evaluated")
+        else:
+            pending_records = records
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        start_time = time.monotonic()
+        completed = 0
+        failed = 0
+
+        async def evaluate(record: PersonaRecord) -> None:
+            nonlocal completed, failed
+            async with semaphore:
+                persona_start_time = time.monotonic()
+                try:
+                    # The score aggregator saves the results of completed evaluations
+                    await self.evaluate_persona(record)
+                    completed += 1
+                # A failing task of the parallel coordinator surfaces as an exception group that also holds the
+                # GeneratorExit of the cancelled sibling tasks
+                except (Exception, BaseExceptionGroup) as e:
+                    logger.exception(f"[{self.run_id}] Evaluation of persona {record.id} failed")
+                    failed += 1
+                    self.storage.save_evaluation(EvaluationRecord(
+                        run_id=self.run_id,
+                        persona=record.persona,
+                        persona_id=record.id,
+                        purple_model=record.purple_model or record.persona_agent_url or self.persona_agent_url,
+                        status="failed",
+                        elapsed_seconds=time.monotonic() - persona_start_time,
+                        error=str(e)
+                    ))
+
+            elapsed = time.monotonic() - start_time
+            logger.info(
+                f"[{self.run_id}] {completed + failed}/{len(pending_records)} personas evaluated "
+                f"({failed} failed, {(completed + failed) / elapsed * 60:.2f} personas/min)"
+            )
+
+        await asyncio.gather(*(evaluate(record) for record in pending_records))
+
+        elapsed = time.monotonic() - start_time
+        summary = BatchSummary(
+            run_id=self.run_id,
+            total=len(records),
+            completed=completed,
+            failed=failed,
+            skipped=skipped,
+            elapsed_seconds=elapsed,
+            personas_per_minute=len(pending_records) / elapsed * 60 if elapsed else 0.0
+        )
+        try:
+            # Raises if evaluation results could not be written, once the run is recorded as finished
+            self.storage.flush()
+        finally:
+            self.storage.finish_run(self.run_id, summary.model_dump())
+        return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a batch of personas with the PersonaGym evaluator.")
+    parser.add_argument("--input", type=str, required=True, help="JSONL file of personas to evaluate")
+    parser.add_argument("--output", type=str, default=RESULTS_STORAGE_PATH, help="SQLite results database to write to")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Number of personas evaluated concurrently")
+    parser.add_argument("--persona-agent-url", type=str, help="Base url of the persona agent, if not given per persona")
+    parser.add_argument("--run-id", type=str, help="Identifier of the batch run")
+    parser.add_argument("--resume", action="store_true", help="Resume the run given by --run-id from its checkpoints")
+    args = parser.parse_args()
+    if args.resume and not args.run_id:
+        parser.error("--resume requires --run-id")
+
+    logging.basicConfig(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    from src.agents.personagym_evaluator.agent import root_agent
+
+    # The score aggregator saves to the process-wide storage, so point it at the requested file
+    storage = ResultsStorage(args.output)
+    set_results_storage(storage)
+    workflow = SerialEvaluationWorkflow(
+        agent=root_agent,
+        storage=storage,
+        concurrency=args.concurrency,
+        persona_agent_url=args.persona_agent_url,
+        run_id=args.run_id,
+        resume=args.resume
+    )
+
+    async def run_workflow() -> BatchSummary:
+        try:
+            return await workflow.run(load_personas(args.input))
+        finally:
+            # Closes the connections to the persona agent before the event loop ends
+            await client_pool.close()
+
+    summary = asyncio.run(run_workflow())
+    print(summary.model_dump_json(indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+
+# Importing the evaluator creates its agents, whose models are read from the environment. The tests never call them.
+for model_env_var in ("SETTINGS_MODEL", "QUESTION_MODEL", "PERSONAGYM_MODEL", "EXAMPLE_MODEL", "RUBRIC_MODEL", "EVAL_1_MODEL", "SCORE_AGG_MODEL"):
+    os.environ.setdefault(model_env_var, "openai/test-model")
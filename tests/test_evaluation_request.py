@@ -0,0 +1,51 @@
+import pytest
+from pydantic import ValidationError
+
+from src.utils.evaluation_request import parse_evaluation_request
+
+def test_free_text_request():
+    request = parse_evaluation_request(
+        "Persona: A 21-year-old photographer from Paris. Persona agent base url: http://127.0.0.1:9020"
+    )
+    assert request.persona == "A 21-year-old photographer from Paris."
+    assert request.persona_agent_url == "http://127.0.0.1:9020"
+
+def test_free_text_labelled_url_wins_over_persona_urls():
+    request = parse_evaluation_request(
+        "Persona: A blogger writing at https://example.com/blog. Persona agent url: http://127.0.0.1:9020."
+    )
+    assert request.persona == "A blogger writing at https://example.com/blog."
+    assert request.persona_agent_url == "http://127.0.0.1:9020"
+
+def test_free_text_unlabelled_url():
+    request = parse_evaluation_request("A chef from Lyon, http://127.0.0.1:9020")
+    assert request.persona == "A chef from Lyon"
+    assert request.persona_agent_url == "http://127.0.0.1:9020"
+
+def test_json_request():
+    request = parse_evaluation_request(
+        '{"persona": " A chef ", "url": ["http://a:1", "http://b:2"], "purple_model": "m", "priority": "3"}'
+    )
+    assert request.persona == "A chef"
+    assert request.persona_agent_url == "http://a:1,http://b:2"
+    assert request.purple_model == "m"
+    assert request.priority == 3
+    assert request.resume is False
+
+def test_json_request_participants():
+    request = parse_evaluation_request('{"persona": "A chef", "participants": {"persona_agent": "http://a:1"}}')
+    assert request.persona_agent_url == "http://a:1"
+
+def test_invalid_priority_uses_default():
+    assert parse_evaluation_request('{"persona": "A chef", "priority": "high"}').priority == 0
+
+@pytest.mark.parametrize(("value", "expected"), [
+    ("true", True), (True, True), ("1", True), ("false", False), (False, False), ("0", False), (None, False)
+])
+def test_resume_flag(value, expected):
+    text = '{"persona": "A chef", "resume": %s}' % ("null" if value is None else f'"{value}"' if isinstance(value, str) else str(value).lower())
+    assert parse_evaluation_request(text).resume is expected
+
+def test_invalid_resume_flag():
+    with pytest.raises(ValidationError):
+        parse_evaluation_request('{"persona": "A chef", "resume": "sometimes"}')
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from src.utils import resilience
+from src.utils.llm_models import SchedulerAdmission
+from src.utils.llm_scheduler import ModelScheduler, RateLimits
+from src.utils.resilience import LatencyTracker, ResiliencePolicy, call_with_resilience
+
+@pytest.fixture
+def latency_tracker(monkeypatch):
+    tracker = LatencyTracker(min_samples=1)
+    monkeypatch.setattr(resilience, "latency_tracker", tracker)
+    return tracker
+
+def set_policy(monkeypatch, **settings):
+    monkeypatch.setitem(resilience._policies, "default", ResiliencePolicy(**settings))
+
+def test_queued_calls_are_not_timed_out(monkeypatch, latency_tracker):
+    set_policy(monkeypatch, timeout=0.3, max_retries=0, hedge=False)
+    scheduler = ModelScheduler("model", RateLimits(max_concurrency=1))
+
+    async def call():
+        await asyncio.sleep(0.2)
+        return "ok"
+
+    async def main():
+        return await asyncio.gather(*(
+            call_with_resilience(call, key="model", admission=SchedulerAdmission(scheduler, 0, 0)) for _ in range(4)
+        ))
+
+    # Each call takes longer than the timeout once the queue wait is included
+    assert asyncio.run(main()) == ["ok"] * 4
+    assert scheduler.active == 0
+    # Only the time after admission is recorded
+    assert latency_tracker.percentile("model", 0.99) < 0.3
+
+def run_hedged_call(monkeypatch, latency_tracker, max_concurrency: int) -> tuple[int, ModelScheduler]:
+    set_policy(monkeypatch, timeout=5, min_timeout=1, max_retries=0, hedge_percentile=0.5)
+    latency_tracker.record("model", 0.05)
+    scheduler = ModelScheduler("model", RateLimits(max_concurrency=max_concurrency))
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.2)
+        return "ok"
+
+    async def main():
+        return await call_with_resilience(call, key="model", admission=SchedulerAdmission(scheduler, 0, 0))
+
+    assert asyncio.run(main()) == "ok"
+    return calls, scheduler
+
+def test_hedge_is_skipped_without_a_free_slot(monkeypatch, latency_tracker):
+    calls, scheduler = run_hedged_call(monkeypatch, latency_tracker, max_concurrency=1)
+    assert calls == 1
+    assert scheduler.active == 0
+
+def test_hedge_takes_a_free_slot(monkeypatch, latency_tracker):
+    calls, scheduler = run_hedged_call(monkeypatch, latency_tracker, max_concurrency=2)
+    assert calls == 2
+    assert scheduler.active == 0
+
+def test_failed_attempts_release_their_slot(monkeypatch, latency_tracker):
+    set_policy(monkeypatch, timeout=5, max_retries=2, hedge=False, backoff_base=0)
+    scheduler = ModelScheduler("model", RateLimits(max_concurrency=1))
+    attempts = 0
+
+    async def call():
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise TimeoutError
+        return "ok"
+
+    async def main():
+        return await call_with_resilience(call, key="model", admission=SchedulerAdmission(scheduler, 0, 0))
+
+    assert asyncio.run(main()) == "ok"
+    assert attempts == 3
+    assert scheduler.active == 0
@@ -0,0 +1,51 @@
+import logging
+import sqlite3
+
+import pytest
+
+from src.agents.personagym_evaluator.sub_agents.results_storage import EvaluationRecord, ResultsStorage, ResultsStorageError
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = ResultsStorage(str(tmp_path / "results.sqlite"), flush_interval=0.05)
+    yield storage
+    storage.close()
+
+def test_bad_record_only_loses_itself(storage, caplog):
+    caplog.set_level(logging.CRITICAL)
+    for persona in ("a", "b", "c"):
+        # A final output that cannot be serialised fails the transaction of its batch
+        final_output = {"unserialisable": object()} if persona == "b" else {"overall_score": 4.0}
+        storage.save_evaluation(EvaluationRecord(run_id="run", persona=persona, final_output=final_output))
+
+    with pytest.raises(ResultsStorageError, match="1 evaluation results could not be written"):
+        storage.flush(5)
+    # The errors are only reported once and the writer keeps running
+    storage.flush(5)
+    storage.save_evaluation(EvaluationRecord(run_id="run", persona="d"))
+    assert sorted(evaluation["persona"] for evaluation in storage.get_run_evaluations("run")) == ["a", "c", "d"]
+
+def test_persona_id_is_stored(storage):
+    storage.save_evaluation(EvaluationRecord(run_id="run", persona="a", persona_id="1"))
+    storage.flush(5)
+    assert [evaluation["persona_id"] for evaluation in storage.get_run_evaluations("run")] == ["1"]
+
+def test_legacy_database_gains_persona_id(tmp_path):
+    path = tmp_path / "legacy.sqlite"
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE evaluations (id INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT NOT NULL, persona_hash TEXT NOT NULL, "
+        "persona TEXT NOT NULL, purple_model TEXT, timestamp TEXT NOT NULL, status TEXT NOT NULL, overall_score REAL, "
+        "final_output TEXT, run_metrics TEXT, elapsed_seconds REAL, error TEXT)"
+    )
+    connection.execute(
+        "INSERT INTO evaluations (run_id, persona_hash, persona, timestamp, status) VALUES ('run', 'hash', 'a', '0', 'completed')"
+    )
+    connection.commit()
+    connection.close()
+
+    storage = ResultsStorage(str(path))
+    storage.save_evaluation(EvaluationRecord(run_id="run", persona="b", persona_id="2"))
+    storage.flush(5)
+    assert [evaluation["persona_id"] for evaluation in storage.get_run_evaluations("run")] == [None, "2"]
+    storage.close()
@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from google.adk.agents import BaseAgent
+from google.genai import types
+
+from src.agents.personagym_evaluator.sub_agents.results_storage import EvaluationRecord, ResultsStorage
+from src.utils import instrumentation
+from src.utils.checkpoints import RESUME_STATE_KEY, create_resume_callback
+from src.utils.logging_callbacks import pre_agent_logging_callback
+from src.workflows.serial_evaluation import PersonaRecord, SerialEvaluationWorkflow
+
+def make_callback_context(invocation_id: str, **state) -> SimpleNamespace:
+    return SimpleNamespace(invocation_id=invocation_id, agent_name="task", state=state)
+
+def test_resume_callback_runs_the_agent_without_checkpoint():
+    callback = create_resume_callback("output")
+    assert callback(make_callback_context("no-checkpoint", **{RESUME_STATE_KEY: True})) is None
+    assert callback(make_callback_context("no-resume", output={"score": 4})) is None
+
+def test_resume_callback_closes_the_skipped_agent():
+    callback_context = make_callback_context("resumed", **{RESUME_STATE_KEY: True, "output": {"score": 4}})
+    restored_content = types.Content(role="model", parts=[types.Part(text="task result")])
+    callback = create_resume_callback("output", on_restored=lambda _: restored_content)
+
+    pre_agent_logging_callback(callback_context)
+    assert callback(callback_context) is restored_content
+    run = instrumentation._runs["resumed"]
+    assert "task" not in run.agent_start_times
+    assert run.agents["task"]["calls"] == 1
+
+def test_resume_callback_default_content():
+    callback_context = make_callback_context("restored", **{RESUME_STATE_KEY: True, "output": {"score": 4}})
+    content = create_resume_callback("output")(callback_context)
+    assert content.parts[0].text == "task restored from checkpoint: output"
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = ResultsStorage(str(tmp_path / "results.sqlite"), flush_interval=0.05)
+    yield storage
+    storage.close()
+
+def run_resumed_batch(storage: ResultsStorage, records: list[PersonaRecord]) -> tuple[list[str], int]:
+    workflow = SerialEvaluationWorkflow(agent=BaseAgent(name="noop"), storage=storage, run_id="run", resume=True)
+    evaluated = []
+
+    async def evaluate_persona(record: PersonaRecord) -> dict:
+        evaluated.append(record.id)
+        return {}
+
+    workflow.evaluate_persona = evaluate_persona
+    summary = asyncio.run(workflow.run(records))
+    return evaluated, summary.skipped
+
+def test_resume_skips_completed_personas_by_id(storage):
+    storage.save_evaluation(EvaluationRecord(run_id="run", persona="A chef", persona_id="1"))
+    storage.save_evaluation(EvaluationRecord(run_id="run", persona="A chef", persona_id="3", status="failed"))
+
+    # Personas sharing a description are separate jobs
+    evaluated, skipped = run_resumed_batch(storage, [
+        PersonaRecord(id="1", persona="A chef"), PersonaRecord(id="2", persona="A chef"), PersonaRecord(id="3", persona="A chef")
+    ])
+    assert sorted(evaluated) == ["2", "3"]
+    assert skipped == 1
+
+def test_resume_matches_legacy_evaluations_by_persona(storage):
+    storage.save_evaluation(EvaluationRecord(run_id="run", persona="A chef"))
+
+    evaluated, skipped = run_resumed_batch(storage, [PersonaRecord(id="1", persona="A chef"), PersonaRecord(id="2", persona="A pilot")])
+    assert evaluated == ["2"]
+    assert skipped == 1